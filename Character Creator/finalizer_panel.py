@@ -1,15 +1,20 @@
 # finalizer_panel.py
 
 import os
+import sys
 import json
 import faiss
 import numpy as np
 import customtkinter as ctk
-from sentence_transformers import SentenceTransformer
-from transformers import AutoTokenizer
 from tkinter import messagebox
-
-tokenizer = AutoTokenizer.from_pretrained("Intel/neural-chat-7b-v3-1")
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.token_utils import count_tokens_many, wait_for_tokenizer
+from utils.memory_filters import ATTRIBUTES_FILE, MemoryAttributes, normalize_perspective
+from utils.memory_records import prompt_fields, annotated_lines
+from utils.model_registry import get_embedder, write_index_meta
+from utils.vector_store import (
+    build_index, save_exact_vectors, remove_exact_vectors, DEFAULT_PQ_M, DEFAULT_REFINE_FACTOR
+)
 
 DEFAULT_BASE_PATH = os.path.abspath(
     os.path.join(os.path.dirname(__file__), "..", "Character")
@@ -116,11 +121,6 @@ class FinalizerPanel(ctk.CTkFrame):
         except Exception as e:
             print(f"[WARN] Could not load alias_map.json: {e}")
 
-# Helper Functions 
-
-def count_tokens(text):
-    return len(tokenizer.encode(text, add_special_tokens=False))
-
 def finalize_memories(character_name: str, base_path: str = DEFAULT_BASE_PATH):
     print(f"Starting finalization for character: {character_name}")
 
@@ -129,10 +129,9 @@ def finalize_memories(character_name: str, base_path: str = DEFAULT_BASE_PATH):
     output_folder = os.path.join(base_path, character_name)
     os.makedirs(output_folder, exist_ok=True)
 
-    model_name = "all-MiniLM-L6-v2-main"
+    # Same registry (and so the same weights) the chat app embeds queries with
     print("Loading embedding model...")
-    model_path = os.path.join(os.path.dirname(__file__), model_name, model_name)
-    model = SentenceTransformer(model_path)
+    model = get_embedder()
 
     # Load templates
     templates = {}
@@ -155,10 +154,17 @@ def finalize_memories(character_name: str, base_path: str = DEFAULT_BASE_PATH):
         except Exception as e:
             print(f"[WARN] Failed to load alias map: {e}")
 
-    # Setup FAISS index
+    # Index storage format: flat (exact), sq8 or pq, chosen per character
+    character_config = {}
+    config_path = os.path.join(output_folder, "character_config.json")
+    if os.path.exists(config_path):
+        with open(config_path, "r", encoding="utf-8") as f:
+            character_config = json.load(f)
+    index_type = character_config.get("index_type", "flat")
+
     embedding_dim = model.get_sentence_embedding_dimension()
-    index = faiss.IndexFlatIP(embedding_dim)
     memory_mapping = []
+    search_texts = []
 
     print("Processing memories...")
     for folder_root, _, files in os.walk(memory_folder):
@@ -187,6 +193,7 @@ def finalize_memories(character_name: str, base_path: str = DEFAULT_BASE_PATH):
             memory_id = memory.get("memory_id", fname.replace(".json", ""))
             tags = []
             importance = None
+            perspective = None
 
             for field in template["fields"]:
                 label = field["label"]
@@ -219,6 +226,8 @@ def finalize_memories(character_name: str, base_path: str = DEFAULT_BASE_PATH):
                     tags.extend([t.strip() for t in memory.get(label, [])])
                 if label == "__importance__":
                     importance = memory.get(label, "Medium")
+                if label == "__perspective__":
+                    perspective = normalize_perspective(value)
 
             # === Append alias clarification note if a root tag is mentioned ===
             if alias_map:
@@ -232,28 +241,66 @@ def finalize_memories(character_name: str, base_path: str = DEFAULT_BASE_PATH):
                 if clarification_lines:
                     prompt_text += "\n\n" + "\n".join(clarification_lines)
 
-            embedding = model.encode(search_text, convert_to_numpy=True, normalize_embeddings=True)
-            index.add(np.array([embedding]))
+            search_texts.append(search_text)
 
             prompt_text = prompt_text.strip()
-            token_count = count_tokens(prompt_text)
             llm_visible_text = prompt_text
 
+            # Pre-render the template's prompt instructions so chat turns never reopen templates
+            memory_annotations = annotated_lines(memory, prompt_fields(template))
+
+            # Top-level folder under Personal_Memories (e.g. "Chamber of Secrets"), for scoped retrieval
+            relative_folder = os.path.relpath(folder_root, memory_folder)
+            source_folder = "" if relative_folder == "." else relative_folder.split(os.sep)[0]
+
             memory_mapping.append({
                 "memory_id": memory_id,
                 "prompt_text": llm_visible_text,
                 "search_text": search_text.strip(),
                 "tags": tags,
                 "importance": importance,
-                "token_count": token_count
+                "perspective": perspective,
+                "source_folder": source_folder,
+                "template_used": template_name,
+                "annotated_lines": memory_annotations,
+                "token_count": 0
             })
 
             print(f"  [OK] Processed: {memory_id} | Importance: {importance} | Tags: {tags}")
 
+    # Embed every memory in batches (much faster than one encode call per memory)
+    embeddings = np.zeros((0, embedding_dim), dtype="float32")
+    if search_texts:
+        print(f"Embedding {len(search_texts)} memories...")
+        embeddings = model.encode(search_texts, batch_size=64, convert_to_numpy=True, normalize_embeddings=True)
+        embeddings = np.asarray(embeddings, dtype="float32")
+    index, index_type = build_index(embeddings, index_type, character_config.get("pq_m", DEFAULT_PQ_M))
+    print(f"[INFO] Index type: {index_type} ({index.sa_code_size()} bytes per memory)")
+
+    # Count every memory's tokens in one batch encode (exact counts, so wait for the tokenizer)
+    if not wait_for_tokenizer(timeout=120):
+        print("[WARN] Tokenizer unavailable; memory token counts are estimates.")
+    token_counts = count_tokens_many([mem["prompt_text"] for mem in memory_mapping])
+    for mem, token_count in zip(memory_mapping, token_counts):
+        mem["token_count"] = token_count
+
     print("\nSaving index and memory mapping...")
     faiss.write_index(index, os.path.join(output_folder, "memory_index.faiss"))
     with open(os.path.join(output_folder, "memory_mapping.json"), "w", encoding="utf-8") as f:
         json.dump(memory_mapping, f, indent=2, ensure_ascii=False)
+    MemoryAttributes.from_mapping(memory_mapping).save(os.path.join(output_folder, ATTRIBUTES_FILE))
+
+    # Compressed indexes keep exact vectors on disk (memory-mapped) to re-rank their top candidates
+    refine = index_type != "flat" and character_config.get("refine", True)
+    if refine:
+        save_exact_vectors(output_folder, embeddings)
+    else:
+        remove_exact_vectors(output_folder)
+    write_index_meta(
+        output_folder, embedding_dim, index.ntotal,
+        index_type=index_type,
+        refine_factor=character_config.get("refine_factor", DEFAULT_REFINE_FACTOR) if refine else None,
+    )
 
     print(f"Finalization complete. Indexed {len(memory_mapping)} memory chunks.")
     total_tokens = sum(mem["token_count"] for mem in memory_mapping)
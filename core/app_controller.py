@@ -2,6 +2,8 @@ import os
 import customtkinter as ctk
 import json
 from core.start_session_panel import StartSessionPanel
+from utils.asset_cache import get_asset_cache
+from utils.task_scheduler import TaskScheduler
 from tkinter import messagebox
 
 """
@@ -26,6 +28,10 @@ class RoleplayApp(ctk.CTk):
         self.accent_color = "#00ccff"
         self.text_color = "#ffffff"
 
+        # Background executor for disk/model/LLM work; results come back on the Tk thread
+        self.scheduler = TaskScheduler(self)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
         # Frame container for swapping between views
         self.container = ctk.CTkFrame(self)
         self.container.pack(fill="both", expand=True)
@@ -54,6 +60,11 @@ class RoleplayApp(ctk.CTk):
         # Raise the specified frame to the front of the UI.
         self.frames[name].tkraise()
 
+    def on_close(self):
+        # Drop queued background work so closing the window doesn't wait on it
+        self.scheduler.shutdown()
+        self.destroy()
+
     def apply_theme_colors(self, bg_color, accent_color, text_color, entry_bg_color="#222222"):
         #Recursively applies color and font theming to all widgets in each registered view.
         # This is used when theme settings are loaded or updated.
@@ -107,6 +118,10 @@ class RoleplayApp(ctk.CTk):
             # Apply settings to the AdvancedSettings screen
             self.frames["AdvancedSettings"].apply_settings(data)
 
+            # Optional: serve character assets from memory, invalidated by file events
+            if data.get("asset_watcher", False):
+                get_asset_cache().start_watcher("Character")
+
             # Apply theme to all views after settings are loaded
             bg_color = data.get("theme_color", "#333333")
             accent_color = data.get("accent_color", "#00ccff")
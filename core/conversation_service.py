@@ -5,12 +5,18 @@ Contains the ConversationService class, which encapsulates the logic for
 building prompts, payloads, and conversation history used by the LLM backend.
 This version introduces a dynamic, token-budget aware rolling memory system...
 """
-import re
 import os
-import json
-from utils.api_utils import call_llm_api
-from utils.token_utils import count_tokens
+import threading
+from utils.llm_router import get_llm_router
+from utils.api_utils import LLMError, LLMCancelled
+from utils.llm_usage import UsageTracker, CallMeter
+from utils.token_utils import count_tokens, count_tokens_many, get_token_counter
+from utils.embedding_cache import embedding_cache_stats
 from utils.text_utils import extract_questions, jaccard_like
+from utils.history_window import TokenBudgetWindow
+from utils.memory_filters import memory_perspective
+from utils.asset_cache import read_json
+from utils.memory_records import prompt_fields, annotated_lines, format_memory_block, memory_block
 
 # ASCII-only helpers for the summarizer
 SUMMARIZER_SYSTEM = (
@@ -36,6 +42,37 @@ def build_summarizer_user_prompt(raw_context, prefix, last_user):
         + raw_context
     )
 
+class HeadlessSettings:
+    """
+    Stands in for the AdvancedSettings frame where ConversationService expects one:
+    headless sessions, and worker threads reading a snapshot taken on the Tk thread.
+    """
+
+    def __init__(self, settings_data):
+        self.settings_data = settings_data
+
+    def get_llm_url(self):
+        return (self.settings_data.get("llm_url") or "http://localhost:1234/v1/chat/completions").strip()
+
+    def get_llm_endpoints(self):
+        return self.settings_data.get("llm_endpoints")
+
+    def get_max_tokens(self):
+        if self.settings_data.get("no_token_limit"):
+            return None
+        max_tokens = self.settings_data.get("max_tokens")
+        return max_tokens if isinstance(max_tokens, int) else 2048
+
+    def get_chat_history_length(self):
+        try:
+            return max(0, int(self.settings_data.get("chat_history_length", 10)))
+        except (ValueError, TypeError):
+            return 0
+
+    def get_all_settings(self):
+        return dict(self.settings_data)
+
+
 class ConversationService:
     """Service layer for building prompts and payloads for the LLM."""
     DEFAULT_CONTEXT_TOKEN_BUDGET = 16000
@@ -45,6 +82,35 @@ class ConversationService:
         self.loaded_scenario_data = {}
         self.loaded_prefix_data = {}
         self.trimmed_history = []
+        self.last_rolling_count = None  # messages in the last built rolling window
+        self.last_token_stats = {}
+        self.history_window = TokenBudgetWindow()
+        self.usage = UsageTracker()  # LLM tokens and timings of this session, per stage
+        self._thread_state = threading.local()
+
+    def use_settings_snapshot(self, settings_data):
+        """
+        Serve settings on the calling (worker) thread from `settings_data` instead of
+        the live AdvancedSettings widgets, which only the Tk thread may touch.
+        None switches back to the widgets.
+        """
+        self._thread_state.frame = HeadlessSettings(settings_data) if settings_data is not None else None
+
+    def use_cancel_token(self, cancel):
+        """Make the calling thread's LLM requests abortable through `cancel` (a CancelToken, or None)."""
+        self._thread_state.cancel = cancel
+
+    def _settings_frame(self):
+        return getattr(self._thread_state, "frame", None) or self.controller.frames.get("AdvancedSettings")
+
+    def _cancel_token(self):
+        return getattr(self._thread_state, "cancel", None)
+
+    def llm_router(self):
+        """Router over the configured LLM endpoints ("llm_endpoints", else just "llm_url")."""
+        frame = self._settings_frame()
+        endpoints = frame.get_llm_endpoints() if hasattr(frame, "get_llm_endpoints") else None
+        return get_llm_router(frame.get_llm_url(), endpoints)
 
     def _build_system_message(self, scenario, prefix, memories, llm_character_config, user_character_config) -> str:
         formatted_memories = ""
@@ -111,8 +177,29 @@ class ConversationService:
         return payload
 
     def fetch_reply(self, payload, conversation_history, prompt, debug_mode=False):
-        url = self.controller.frames["AdvancedSettings"].get_llm_url()
-        return call_llm_api(url, payload, debug_mode, conversation_history, prompt)
+        """The final reply; raises an api_utils.LLMError if the backend can't produce one."""
+        reply = self.llm_router().call("reply", payload, cancel=self._cancel_token())
+        self.usage.record("reply", reply)
+        return reply
+
+    def fetch_replies(self, payload, n=1, use_n=True, stage="reply") -> list:
+        """The reply plus up to n-1 alternatives for Try Again (see api_utils.call_llm_candidates)."""
+        replies = self.llm_router().candidates("reply", payload, n, use_n, cancel=self._cancel_token())
+        # Every choice came from one request, whose usage and timing the first one carries
+        self.usage.record(stage, replies[0])
+        return replies
+
+    def stream_reply(self, payload):
+        """The final reply as streamed deltas (see LLMRouter.stream); its usage is recorded once it ends."""
+        meter = CallMeter()
+        parts = []
+        try:
+            for delta in self.llm_router().stream("reply", payload, self._cancel_token(), meter=meter):
+                parts.append(delta)
+                yield delta
+        finally:
+            if parts:
+                self.usage.record("reply", meter.result("".join(parts)))
 
     def build_prompt(self, user_message: str, memories: list, scenario: str, prefix: str, llm_char_name: str = None) -> str:
         """
@@ -122,7 +209,8 @@ class ConversationService:
             [MEMORIES]
             [USER_MESSAGE]
 
-        - Memories include prompt_text and any prompt_instruction fields from their templates.
+        - Memories include prompt_text and any prompt_instruction fields from their templates
+          (pre-rendered by the finalizer; see utils/memory_records.py).
         - All additional formatting and logging is handled outside this function.
         """
         lines = []
@@ -137,47 +225,9 @@ class ConversationService:
             formatted_memories = []
 
             for m in memories:
-                pt = (m.get("prompt_text") or "").strip()
-                if not pt:
+                if not (m.get("prompt_text") or "").strip():
                     continue
-
-                entry_lines = []
-                entry_lines.append(pt)
-
-                # Load matching template
-                tmpl_name = (m.get("template_used") or "").strip()
-                tmpl = None
-                if tmpl_name:
-                    tmpl = template_cache.get(tmpl_name)
-                    if tmpl is None:
-                        tmpl = self._load_template_by_name(tmpl_name)
-                        template_cache[tmpl_name] = tmpl
-
-                # Gather prompt fields
-                pairs = self._collect_prompt_fields(tmpl) if tmpl else []
-
-                for label, instr in pairs:
-                    if label.lower().strip() == "prompt_text":
-                        continue  # already included
-
-                    val = m.get(label)
-                    if val is None:
-                        for k, v in m.items():
-                            if isinstance(k, str) and k.lower().strip() == label.lower().strip():
-                                val = v
-                                break
-                    if val is None:
-                        continue
-
-                    if isinstance(val, (list, tuple)):
-                        val_str = ", ".join(str(x).strip() for x in val if str(x).strip())
-                    else:
-                        val_str = str(val).strip()
-
-                    if val_str:
-                        entry_lines.append(f"{instr.strip()}: {val_str}")
-
-                formatted_memories.append("\n".join(entry_lines).strip())
+                formatted_memories.append(self._memory_block(m, template_cache))
 
             lines.append("Combined context to consider:")
             lines.append("<<<MEMORY MONOLOGUE>>>")
@@ -194,7 +244,7 @@ class ConversationService:
     def build_chat_messages(self, conversation_history, scenario, prefix, memories, llm_character_config, user_character_config): 
         system_content = self._build_system_message(scenario, prefix, memories, llm_character_config, user_character_config)
         max_budget = self.DEFAULT_CONTEXT_TOKEN_BUDGET
-        settings_frame = self.controller.frames.get("AdvancedSettings")
+        settings_frame = self._settings_frame()
         if settings_frame and hasattr(settings_frame, "get_max_tokens"):
             try:
                 mt = settings_frame.get_max_tokens()
@@ -205,21 +255,42 @@ class ConversationService:
             except Exception:
                 pass
 
+        max_messages = 0
+        if settings_frame and hasattr(settings_frame, "get_chat_history_length"):
+            try:
+                max_messages = int(settings_frame.get_chat_history_length() or 0)
+            except Exception:
+                max_messages = 0
+
         overhead_tokens = self._calculate_overhead_tokens(system_content)
         available_tokens = max(max_budget - overhead_tokens, 0)
 
-        trimmed_history = []
-        used_tokens = 0
-        for entry in reversed(conversation_history):
-            content = entry.get("content", "") or ""
-            tokens = count_tokens(content)
-            if trimmed_history:
-                if used_tokens + tokens > available_tokens:
-                    break
-            trimmed_history.insert(0, entry)
-            used_tokens += tokens
+        # Binary search over cumulative per-entry counts (only new entries get counted)
+        start = self.history_window.window_start(conversation_history, available_tokens)
+        if max_messages > 0:
+            # The full history is kept now, so honor the Chat History Length setting
+            start = max(start, len(conversation_history) - max_messages)
+        used_tokens = self.history_window.suffix_tokens(start)
+        trimmed_history = conversation_history[start:]
 
         self.trimmed_history = trimmed_history
+        self.last_rolling_count = len(trimmed_history)
+        scenario_tokens, prefix_tokens, memory_tokens = count_tokens_many([
+            scenario or "",
+            prefix or "",
+            "\n".join((m.get("prompt_text") or "") for m in memories or []),
+        ])
+        self.last_token_stats = {
+            "max_tokens": max_budget,
+            "system_tokens": overhead_tokens,
+            "scenario_tokens": scenario_tokens,
+            "prefix_tokens": prefix_tokens,
+            "memory_tokens": memory_tokens,
+            "available_for_rolling": available_tokens,
+            "rolling_used_tokens": used_tokens,
+            "token_cache": get_token_counter().stats(),
+            "embedding_cache": embedding_cache_stats(),
+        }
         messages = [{"role": "system", "content": system_content}]
         for entry in trimmed_history:
             role = entry.get("role")
@@ -229,6 +300,21 @@ class ConversationService:
 
         return messages, trimmed_history
 
+    def episodic_cutoff(self, total_messages: int) -> int:
+        """
+        Absolute history index where the rolling window starts, based on the last
+        window built. Episodic recall skips exchanges from there on, since the
+        model already sees them verbatim.
+        """
+        rolling = self.last_rolling_count
+        if rolling is None:
+            settings_frame = self._settings_frame()
+            try:
+                rolling = int(settings_frame.get_chat_history_length() or 0) if settings_frame else 0
+            except Exception:
+                rolling = 0
+        return max(0, total_messages - rolling)
+
     def summarize_text(self, raw_text, settings_data, user_message, prefix, ratio_default=0.25):
         # Empty in, empty out
         if not isinstance(raw_text, str) or not raw_text.strip():
@@ -269,11 +355,18 @@ class ConversationService:
             "max_tokens": max_summary_tokens,
         }
 
-        url = self.controller.frames["AdvancedSettings"].get_llm_url()
-        summary = call_llm_api(url, payload, show_debug=False)
+        router = self.llm_router()
+        try:
+            summary = router.call("summary", payload, cancel=self._cancel_token())
+            self.usage.record("history_summary", summary)
+        except LLMCancelled:
+            raise
+        except LLMError as e:
+            # Never fall back to the whole raw history: an overloaded backend would get an even bigger prompt
+            print(f"[WARN] History summarizer unavailable ({e}); using the most recent lines instead.")
+            return self._recent_excerpt(raw_text, target_tokens)
         if not isinstance(summary, str) or not summary.strip():
-            # API error or empty string -> fallback
-            return raw_text
+            return self._recent_excerpt(raw_text, target_tokens)
 
         summary_text = summary.strip()
 
@@ -290,12 +383,33 @@ class ConversationService:
                 {"role": "user", "content": tightened},
             ]
             payload_retry["max_tokens"] = min(max_summary_tokens, 512)
-            summary2 = call_llm_api(url, payload_retry, show_debug=False)
+            try:
+                summary2 = router.call("summary", payload_retry, cancel=self._cancel_token())
+                self.usage.record("history_summary", summary2)
+            except LLMCancelled:
+                raise
+            except LLMError as e:
+                print(f"[WARN] Tighter summary failed ({e}); keeping the first one.")
+                summary2 = None
             if isinstance(summary2, str) and summary2.strip():
                 summary_text = summary2.strip()
 
         return summary_text
 
+    @staticmethod
+    def _recent_excerpt(raw_text, max_tokens):
+        """The newest lines of raw_text that fit in max_tokens: the summary's stand-in when the summarizer fails."""
+        kept, used = [], 0
+        for line in reversed(raw_text.strip().splitlines()):
+            cost = count_tokens(line) + 1
+            if used + cost > max_tokens:
+                if not kept:
+                    kept.append(line[-max_tokens * 4:])  # ~4 characters per token
+                break
+            kept.append(line)
+            used += cost
+        return "\n".join(reversed(kept))
+
     def compose_final_messages(
         self,
         summary_text: str,
@@ -359,37 +473,11 @@ class ConversationService:
 
     def _extract_perspective(self, mem: dict) -> str:
         """
-        Try to read a normalized perspective from the memory object.
-        Order of preference:
-          1) explicit field (perspective or __perspective__)
-          2) [PERSPECTIVE: ...] header inside prompt_text
+        Normalized perspective of a memory object: the structured field the
+        finalizer stores, else the [PERSPECTIVE: ...] header inside prompt_text.
         Returns one of: 'First Hand', 'Second Hand', 'Lore' (fallback: 'Unknown').
         """
-        # explicit field
-        for key in ("perspective", "__perspective__", "Perspective", "PERSPECTIVE"):
-            val = mem.get(key)
-            if isinstance(val, str) and val.strip():
-                v = val.strip().lower()
-                if "first" in v:
-                    return "First Hand"
-                if "second" in v:
-                    return "Second Hand"
-                if "lore" in v:
-                    return "Lore"
-
-        # parse from prompt_text header
-        pt = (mem.get("prompt_text") or "").strip()
-        m = re.search(r"\[PERSPECTIVE:\s*([^\]]+)\]", pt, flags=re.IGNORECASE)
-        if m:
-            v = m.group(1).strip().lower()
-            if "first" in v:
-                return "First Hand"
-            if "second" in v:
-                return "Second Hand"
-            if "lore" in v:
-                return "Lore"
-
-        return "Unknown"
+        return memory_perspective(mem)
 
 
 
@@ -458,8 +546,9 @@ class ConversationService:
             <annotated lines from template fields>
         - Ends with (END)
 
-        Templates are loaded from:
-            Character/<LLM Character>/Memory_Template/<template_used>.json
+        The annotated lines are pre-rendered by the finalizer (annotated_lines).
+        Older mappings fall back to loading
+            Character/<LLM Character>/Memory_Templates/<template_used>.json
 
         Includes only fields where:
             usage in {"Prompt", "Both"} AND prompt_instructions is present
@@ -472,7 +561,7 @@ class ConversationService:
         buckets = {"First Hand": [], "Second Hand": [], "Lore": []}
         counters = {"First Hand": 0, "Second Hand": 0, "Lore": 0}
 
-        # Cache templates to avoid redundant disk IO
+        # Only records finalized before annotations were stored need their template
         template_cache: dict[str, dict] = {}
 
         for m in memories or []:
@@ -480,62 +569,12 @@ class ConversationService:
             p = self._extract_perspective(m)
             if p not in buckets:
                 continue
-
-            # Resolve memory template
-            tmpl_name = (m.get("template_used") or "").strip()
-            tmpl = None
-            if tmpl_name:
-                tmpl = template_cache.get(tmpl_name)
-                if tmpl is None:
-                    tmpl = self._load_template_by_name(tmpl_name)
-                    if tmpl:
-                        template_cache[tmpl_name] = tmpl
-
-            # Collect label -> instruction mappings
-            pairs: list[tuple[str, str]] = []
-            if tmpl:
-                pairs = self._collect_prompt_fields(tmpl)
-
-            # Build formatted memory block
-            entry_lines = []
-            counters[p] += 1
-            idx = counters[p]
-            entry_lines.append(f"(Memory {idx})")
-
-            pt = (m.get("prompt_text") or "").strip()
-            if not pt:
-                counters[p] -= 1
+            if not (m.get("prompt_text") or "").strip():
                 continue
-            entry_lines.append(pt)
-
-            for label, instr in pairs:
-                if label.strip().lower() == "prompt_text":
-                    continue
 
-                val = None
-                label_clean = label.strip().lower()
-                for k, v in m.items():
-                    if isinstance(k, str) and k.strip().lower() == label_clean:
-                        val = v
-                        break
-
-                if val is None:
-                    print(f"[DEBUG] Missing field for label: '{label}' in memory ID: {m.get('memory_id')}")
-                    continue
-
-                # Format list or string values
-                if isinstance(val, (list, tuple)):
-                    val_str = ", ".join(str(x).strip() for x in val if str(x).strip())
-                else:
-                    val_str = str(val).strip()
-
-                if not val_str:
-                    continue
-
-                entry_lines.append(f"{instr.strip()}: {val_str}")
-
-            # Add memory to correct section
-            buckets[p].append("\n".join(entry_lines).strip())
+            counters[p] += 1
+            block = self._memory_block(m, template_cache)
+            buckets[p].append(f"(Memory {counters[p]})\n{block}")
 
         # Build final LLM input
         lines = []
@@ -595,8 +634,15 @@ class ConversationService:
         }
 
         # Call LLM
-        url = self.controller.frames["AdvancedSettings"].get_llm_url()
-        result_text = call_llm_api(url, payload, show_debug=False)
+        try:
+            result_text = self.llm_router().call("summary", payload, cancel=self._cancel_token())
+            self.usage.record("memory_summary", result_text)
+        except LLMCancelled:
+            raise
+        except LLMError as e:
+            # The reply can still be written from the rolling history; don't paste the raw memory prompt in
+            print(f"[WARN] Memory summarizer unavailable ({e}); continuing without memories.")
+            result_text = "(memory summary unavailable)"
         if not isinstance(result_text, str):
             result_text = ""
 
@@ -616,6 +662,7 @@ class ConversationService:
     def _load_template_by_name(self, template_name: str) -> dict | None:
         """
         Loads Character/<LLM Character>/Memory_Templates/<template_name>.json
+        through the shared asset cache (no disk read unless the file changed).
         Returns dict or None if not found/invalid.
         """
         try:
@@ -631,10 +678,7 @@ class ConversationService:
 
             # Templates are stored under 'Memory_Templates'
             tmpl_path = os.path.join(char_path, "Memory_Templates", f"{template_name}.json")
-            if not os.path.exists(tmpl_path):
-                return None
-            with open(tmpl_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            data = read_json(tmpl_path)
             if isinstance(data, dict) and data.get("fields"):
                 return data
         except Exception as e:
@@ -646,19 +690,26 @@ class ConversationService:
         From a template document, return [(label, prompt_instructions)] for fields
         whose usage is 'Prompt' or 'Both' AND that define prompt_instructions.
         """
-        results = []
         try:
-            for fld in template_doc.get("fields", []):
-                usage = (fld.get("usage") or "").strip().lower()
-                if usage not in ("prompt", "both"):
-                    continue
-                instr = (fld.get("prompt_instructions") or "").strip()
-                if not instr:
-                    continue
-                label = fld.get("label")
-                if not isinstance(label, str) or not label.strip():
-                    continue
-                results.append((label, instr))
+            return prompt_fields(template_doc)
         except Exception as e:
             print(f"[WARN] _collect_prompt_fields: {e}")
-        return results
\ No newline at end of file
+            return []
+
+    def _memory_block(self, m: dict, template_cache: dict) -> str:
+        """
+        prompt_text plus its annotated template lines. Uses the finalizer's
+        pre-rendered record when present; otherwise loads the template (cached per call).
+        """
+        block = memory_block(m)
+        if block is not None:
+            return block
+
+        tmpl_name = (m.get("template_used") or "").strip()
+        tmpl = None
+        if tmpl_name:
+            if tmpl_name not in template_cache:
+                template_cache[tmpl_name] = self._load_template_by_name(tmpl_name)
+            tmpl = template_cache[tmpl_name]
+        pairs = self._collect_prompt_fields(tmpl) if tmpl else []
+        return format_memory_block(m.get("prompt_text"), annotated_lines(m, pairs))
\ No newline at end of file
@@ -0,0 +1,459 @@
+"""
+session_host.py
+
+Headless roleplay sessions for the HTTP server (start_server.py).
+
+A RoleplaySession runs the same turn pipeline as ChatView (memory retrieval,
+rolling-history summary, memory summary, final generation) without any Tk
+widgets. Models and memory indexes come from core.shared_resources, so each
+additional session only holds its own history and a few strings.
+"""
+import os
+import json
+import uuid
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from core.conversation_service import ConversationService, HeadlessSettings
+from core.turn_executor import DEFAULT_TURN_DEADLINE
+from core.shared_resources import (
+    get_embedder, get_lemmatizer, get_memory_store, get_memory_attributes, embedder_model_id
+)
+from utils.file_utils import atomic_write_json
+from utils.asset_cache import get_asset_cache, read_json
+from utils.history_window import history_entry
+from utils.history_store import HistoryStore
+from utils.episodic_memory import EpisodicIndex
+from utils.memory_utils import retrieve_relevant_memories
+from utils.api_utils import CancelToken, LLMError
+
+DEFAULT_SETTINGS_PATH = "config/advanced_settings.json"
+CHARACTER_DIR = "Character"
+
+
+def load_settings_file(path=DEFAULT_SETTINGS_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f) or {}
+    except Exception as e:
+        print(f"[Warning] Could not read settings file {path}: {e}")
+        return {}
+
+
+class HeadlessController:
+    """Minimal controller exposing the attributes ConversationService reads."""
+
+    def __init__(self, settings_data, session_data):
+        self.frames = {"AdvancedSettings": HeadlessSettings(settings_data)}
+        self.active_session_data = session_data
+        self.selected_character = session_data.get("llm_character", "")
+
+
+class SessionExistsError(Exception):
+    """A live session already owns this character's session folder (its history files allow one writer)."""
+
+    def __init__(self, session):
+        super().__init__(
+            f"Session '{session.session_name}' of {session.llm_character} is already open as {session.session_id}."
+        )
+        self.session = session
+
+
+def _check_name(value, field):
+    """A request-supplied file or folder name must stay inside its folder: no separators, '..' or drive."""
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"Missing required field: {field}")
+    if (
+        value in (".", "..")
+        or "/" in value or "\\" in value
+        or os.path.isabs(value) or os.path.splitdrive(value)[0]
+        or value != os.path.basename(value)
+    ):
+        raise ValueError(f"Invalid {field}: {value!r}")
+    return value
+
+
+def _read_json(path, default=None):
+    if not path:
+        return default
+    return read_json(path, default)
+
+
+class RoleplaySession:
+    """One roleplay conversation. Holds only per-session state; models are shared."""
+
+    def __init__(self, session_data, settings_data):
+        self.session_id = uuid.uuid4().hex
+        self.session_data = session_data
+        self.settings_data = settings_data
+        self.llm_character = session_data.get("llm_character", "")
+        self.user_character = session_data.get("user_character", "")
+        self.session_name = session_data.get("session_name", "")
+        # Always derived, never taken from the request
+        self.character_path = os.path.join(CHARACTER_DIR, self.llm_character)
+        session_data["character_path"] = self.character_path
+
+        self.controller = HeadlessController(settings_data, session_data)
+        self.conversation_service = ConversationService(self.controller)
+        self.conversation_history = []
+
+        # Serializes turns within this session; different sessions run in parallel.
+        # SessionManager queues a session's turns itself, so the lock is never waited on
+        # by a pool worker; close() takes it to wait for the running turn.
+        self.turn_lock = threading.Lock()
+        self.turn_queue = deque()    # (future, fn, args) of turns waiting for this session
+        self.turn_running = False
+        self.active_cancel = None    # CancelToken of the running turn
+
+        self.llm_character_config = _read_json(
+            os.path.join(CHARACTER_DIR, self.llm_character, "character_config.json"), {"name": "Bot"}
+        )
+        self.user_character_config = _read_json(
+            os.path.join(CHARACTER_DIR, self.user_character, "character_config.json"), {"name": "You"}
+        )
+
+        scenario_file = session_data.get("scenario_file")
+        prefix_file = session_data.get("prefix_file")
+        scenario_data = _read_json(
+            os.path.join(self.character_path, "Scenarios", scenario_file) if scenario_file else None, {}
+        )
+        prefix_data = _read_json(
+            os.path.join(self.character_path, "Prefix", prefix_file) if prefix_file else None, {}
+        )
+        self.scenario = (scenario_data.get("content") or "").strip()
+        # Scenario-scoped retrieval, e.g. {"perspective": ["Lore"], "source_folder": ["Chamber of Secrets"]}
+        self.memory_filter = scenario_data.get("memory_filter") or settings_data.get("memory_filter")
+        self.prefix = (prefix_data.get("content") or "").strip()
+
+        self.session_dir = os.path.join(CHARACTER_DIR, self.llm_character, "Sessions", self.session_name)
+        # Full history on disk; only a bounded window of recent turns in memory
+        self.history_store = HistoryStore(
+            self.session_dir, window_size=settings_data.get("history_window_size", 200)
+        )
+        self.conversation_history = self.history_store.recent()
+
+        self.episodic_index = None
+        if settings_data.get("episodic_memory", True):
+            self.episodic_index = EpisodicIndex(self.session_dir, get_embedder, embedder_model_id())
+            self.episodic_index.catch_up(self.history_store, self._user_name(), self._bot_name())
+
+    def _user_name(self):
+        return self.user_character_config.get("name", "You")
+
+    def _bot_name(self):
+        return self.llm_character_config.get("name", "Bot")
+
+    def _append_history(self, role, content):
+        entry = history_entry(role, content)
+        self.conversation_history.append(entry)
+        self.history_store.append(entry)
+        overflow = len(self.conversation_history) - self.history_store.window_size
+        if overflow > 0:
+            del self.conversation_history[:overflow]
+
+    def _finish_turn(self, user_message, reply):
+        self._append_history("assistant", reply)
+        if self.episodic_index:
+            self.episodic_index.add_exchange(
+                len(self.history_store) - 2, self._user_name(), user_message, self._bot_name(), reply
+            )
+
+    def save(self):
+        atomic_write_json(os.path.join(self.session_dir, "session_info.json"), self.session_data, indent=4)
+
+    def close(self):
+        if self.episodic_index:
+            self.episodic_index.close()
+        self.history_store.close()
+
+    def describe(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "session_name": self.session_name,
+            "llm_character": self.llm_character,
+            "user_character": self.user_character,
+            "messages": len(self.history_store),
+            "llm_usage": self.conversation_service.usage.snapshot(),
+        }
+
+    def build_turn_payload(self, user_message: str) -> dict:
+        """Runs retrieval and both summarizers, and returns the final generation payload."""
+        settings_data = dict(self.settings_data)
+        settings_data["character_path"] = self.character_path
+        memory_index, memory_mapping = get_memory_store(self.character_path)
+
+        settings_data["episodic_exclude_from"] = self.conversation_service.episodic_cutoff(len(self.history_store))
+        settings_data["memory_filter"] = self.memory_filter
+
+        memory_objects = []
+        if memory_index is not None or self.episodic_index is not None:
+            memory_objects, _debug = retrieve_relevant_memories(
+                user_message,
+                memory_index,
+                memory_mapping,
+                get_embedder(),
+                get_lemmatizer(),
+                settings_data,
+                False,
+                episodic_index=self.episodic_index,
+                memory_attributes=get_memory_attributes(self.character_path) if self.memory_filter else None
+            )
+            memory_objects = memory_objects or []
+
+        svc = self.conversation_service
+        _msgs_preview, filtered_history = svc.build_chat_messages(
+            self.conversation_history,
+            self.scenario,
+            self.prefix,
+            memory_objects,
+            self.llm_character_config,
+            self.user_character_config
+        )
+
+        raw_history = svc.build_raw_history_input(trimmed_history=filtered_history)
+        hist_summary_text = svc.summarize_text(
+            raw_text=raw_history,
+            settings_data=settings_data,
+            user_message=user_message,
+            prefix=self.prefix,
+        )
+
+        raw_mems = svc.build_raw_memories_input(
+            memories=memory_objects,
+            llm_char_name=self.llm_character,
+            user_message=user_message,
+        )
+        if memory_objects:
+            mems_summary_text = svc.summarize_memories(raw_mems, settings_data, user_message, self.llm_character)
+        else:
+            mems_summary_text = "(no relevant memories)"
+
+        system_content = svc._build_system_message(
+            self.scenario, self.prefix, [], self.llm_character_config, self.user_character_config
+        )
+        final_user_content = (
+            "Combined context to consider:\n"
+            "<<<MEMORY MONOLOGUE>>>\n"
+            f"{mems_summary_text}\n"
+            "<<<END MEMORY MONOLOGUE>>>\n\n"
+            "<<<ROLLING HISTORY SUMMARY>>>\n"
+            f"{hist_summary_text}\n"
+            "<<<END ROLLING HISTORY SUMMARY>>>\n\n"
+            "Now respond to my latest message while following the rules in the prefix.\n\n"
+            "Latest user message:\n"
+            f"{user_message}"
+        )
+
+        payload = svc.build_payload("", settings_data)
+        payload["messages"] = [
+            {"role": "system", "content": system_content},
+            {"role": "user", "content": final_user_content},
+        ]
+        return payload
+
+    def _begin_turn(self, user_message, cancel=None):
+        # Every LLM call of the turn shares one deadline
+        cancel = cancel or CancelToken()
+        cancel.set_deadline(self.settings_data.get("llm_turn_deadline", DEFAULT_TURN_DEADLINE))
+        self.active_cancel = cancel
+        self.conversation_service.use_cancel_token(cancel)
+        self.conversation_service.usage.begin_turn()
+        self._append_history("user", user_message)
+        return cancel
+
+    def _end_turn(self):
+        self.conversation_service.use_cancel_token(None)
+        self.active_cancel = None
+
+    def _abandon_turn(self, user_message):
+        """The turn failed: drop its unanswered user message so the history stays in pairs."""
+        last = self.conversation_history[-1] if self.conversation_history else None
+        if last and last.get("role") == "user" and last.get("content") == user_message:
+            self.conversation_history.pop()
+            self.history_store.pop_last()
+
+    def send(self, user_message: str, cancel=None) -> str:
+        """Runs one full turn and returns the character's reply; raises api_utils.LLMError if the backend fails."""
+        with self.turn_lock:
+            self._begin_turn(user_message, cancel)
+            try:
+                payload = self.build_turn_payload(user_message)
+                reply = self.conversation_service.fetch_reply(payload, self.conversation_history, user_message)
+            except Exception:
+                # Retrieval, summaries or generation failed: don't leave the message unanswered
+                self._abandon_turn(user_message)
+                raise
+            finally:
+                self._end_turn()
+            self._finish_turn(user_message, reply)
+            return reply
+
+    def stream(self, user_message: str, on_delta, cancel=None):
+        """Like send(), but calls on_delta(text) for each generated chunk."""
+        with self.turn_lock:
+            self._begin_turn(user_message, cancel)
+            parts = []
+            try:
+                payload = self.build_turn_payload(user_message)
+                for delta in self.conversation_service.stream_reply(payload):
+                    parts.append(delta)
+                    on_delta(delta)
+            except Exception as e:
+                if not parts or not isinstance(e, LLMError):
+                    self._abandon_turn(user_message)
+                    raise
+                # Keep what was already sent to the client
+                print(f"[Session] Reply stream cut short after {len(parts)} chunks.")
+            finally:
+                self._end_turn()
+            reply = "".join(parts)
+            self._finish_turn(user_message, reply)
+            return reply
+
+
+class SessionManager:
+    """
+    Owns every live session and the bounded worker pool that runs their turns.
+
+    At most `max_workers` turns talk to the LLM backend at once; further requests
+    queue in the executor instead of piling onto the backend. A session's turns
+    run one at a time: while one is running, the next waits in the session's own
+    queue and only enters the pool when it can start, so a client sending several
+    messages to one session never ties up workers other sessions need.
+    """
+
+    def __init__(self, settings_data=None, max_workers=None):
+        self.settings_data = settings_data if settings_data is not None else load_settings_file()
+        workers = max_workers or self.settings_data.get("server_llm_workers", 2)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="llm-worker")
+        if self.settings_data.get("asset_watcher", False):
+            get_asset_cache().start_watcher(CHARACTER_DIR)
+        self.sessions = {}
+        self._by_folder = {}   # (llm_character, session_name) -> live session (None while it opens)
+        self._lock = threading.Lock()
+
+    def create_session(self, session_data: dict) -> RoleplaySession:
+        session_data = dict(session_data)
+        session_data.pop("character_path", None)
+        for key in ("session_name", "llm_character", "user_character"):
+            _check_name(session_data.get(key), key)
+        for key in ("scenario_file", "prefix_file"):
+            if session_data.get(key):
+                _check_name(session_data[key], key)
+
+        character_dir = os.path.join(CHARACTER_DIR, session_data["llm_character"])
+        if not os.path.isdir(character_dir):
+            raise ValueError(f"Unknown character: {session_data['llm_character']}")
+
+        folder = self._folder_key(session_data)
+        with self._lock:
+            if folder in self._by_folder:
+                existing = self._by_folder[folder]
+                if existing is None:
+                    raise ValueError(f"Session '{session_data['session_name']}' is already being opened.")
+                raise SessionExistsError(existing)
+            self._by_folder[folder] = None
+        try:
+            session = RoleplaySession(dict(session_data), self.settings_data)
+            session.save()
+        except BaseException:
+            with self._lock:
+                del self._by_folder[folder]
+            raise
+        with self._lock:
+            self.sessions[session.session_id] = session
+            self._by_folder[folder] = session
+        print(f"[Server] Created session {session.session_id} ({session.session_name})")
+        return session
+
+    @staticmethod
+    def _folder_key(session_data):
+        return (
+            os.path.normcase(session_data.get("llm_character", "")),
+            os.path.normcase(session_data.get("session_name", "")),
+        )
+
+    def get_session(self, session_id: str) -> RoleplaySession | None:
+        with self._lock:
+            return self.sessions.get(session_id)
+
+    def close_session(self, session_id: str) -> bool:
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        with session.turn_lock:
+            session.close()
+        with self._lock:
+            self._by_folder.pop(self._folder_key(session.session_data), None)
+        return True
+
+    def list_sessions(self) -> list[dict]:
+        with self._lock:
+            return [s.describe() for s in self.sessions.values()]
+
+    def submit_send(self, session: RoleplaySession, user_message: str) -> Future:
+        return self._submit_turn(session, session.send, user_message)
+
+    def submit_stream(self, session: RoleplaySession, user_message: str, on_delta) -> Future:
+        return self._submit_turn(session, session.stream, user_message, on_delta)
+
+    def _submit_turn(self, session, fn, *args) -> Future:
+        """
+        Queue fn(*args, cancel=<CancelToken>) behind the session's running turn. The
+        Future settles with its result; cancel_turn(future) stops it, queued or running.
+        """
+        future = Future()
+        future.cancel_token = CancelToken()
+        with self._lock:
+            session.turn_queue.append((future, fn, args))
+            start = not session.turn_running
+            session.turn_running = True
+        if start:
+            self._start_next_turn(session)
+        return future
+
+    def _start_next_turn(self, session):
+        while True:
+            with self._lock:
+                if not session.turn_queue:
+                    session.turn_running = False
+                    return
+                future, fn, args = session.turn_queue.popleft()
+            # Skips turns whose request was cancelled while they waited
+            if future.set_running_or_notify_cancel():
+                break
+        try:
+            self.executor.submit(self._run_turn, session, future, fn, args)
+        except RuntimeError as e:
+            # Pool shut down: fail this turn and everything queued behind it
+            with self._lock:
+                waiting = [f for f, _fn, _args in session.turn_queue]
+                session.turn_queue.clear()
+                session.turn_running = False
+            future.set_exception(e)
+            for waiting_future in waiting:
+                if waiting_future.set_running_or_notify_cancel():
+                    waiting_future.set_exception(e)
+
+    def _run_turn(self, session, future, fn, args):
+        try:
+            result = fn(*args, cancel=future.cancel_token)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            self._start_next_turn(session)
+
+    @staticmethod
+    def cancel_turn(future):
+        """Drop a queued turn, or abort a running one's LLM requests (e.g. its client went away)."""
+        if not future.cancel():
+            future.cancel_token.cancel()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
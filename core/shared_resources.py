@@ -0,0 +1,137 @@
+"""
+shared_resources.py
+
+Process-wide cache for the heavy objects every roleplay session needs: the sentence
+embedder (from utils.model_registry), the lemmatizer, and each character's FAISS
+index + memory mapping (with
+the structured memory attributes used for filtered search).
+Sessions hold references to these instead of loading their own copies, so one
+process can host many sessions at the cost of a single set of models.
+
+A character's index and mapping are reloaded when memory_index.faiss or
+memory_mapping.json changes on disk (by mtime and size, like utils.asset_cache),
+so a long-running server picks up a re-run of the finalizer.
+
+Nothing heavy is imported until first use. warm_models() loads the models on a
+background thread right after the UI is up; a caller that needs a model before
+warm-up finishes simply waits for it.
+"""
+import os
+import json
+import threading
+
+from utils.model_registry import get_embedder, embedder_loaded, embedder_model_id, check_index_model
+from utils.memory_filters import MemoryAttributes
+from utils.vector_store import load_memory_index
+
+_lock = threading.Lock()
+_lemmatizer_lock = threading.Lock()
+_warm_thread = None
+_lemmatizer = None
+_memory_stores = {}       # character folder -> (stamp, (index, mapping))
+_memory_attributes = {}
+MEMORY_STORE_FILES = ("memory_index.faiss", "memory_mapping.json")
+
+
+def get_lemmatizer():
+    """Return the shared WordNetLemmatizer, creating it on first use."""
+    global _lemmatizer
+    with _lemmatizer_lock:
+        if _lemmatizer is None:
+            from nltk.stem import WordNetLemmatizer
+            lemmatizer = WordNetLemmatizer()
+            lemmatizer.lemmatize("warming")  # WordNet itself loads on the first call
+            _lemmatizer = lemmatizer
+        return _lemmatizer
+
+
+def models_ready() -> bool:
+    return embedder_loaded() and _lemmatizer is not None
+
+
+def warm_models(on_ready=None):
+    """
+    Load the embedder, the lemmatizer and faiss on a daemon thread (once per process).
+    on_ready() is called from that thread when everything is loaded.
+    """
+    global _warm_thread
+
+    def warm():
+        try:
+            import faiss  # noqa: F401  (first import costs a few hundred ms)
+            get_lemmatizer()
+            get_embedder()
+            print("[Resources] Models ready.")
+        except Exception as e:
+            print(f"[Warning] Background model warm-up failed: {e}")
+        if on_ready:
+            on_ready()
+
+    with _lock:
+        if _warm_thread is None:
+            _warm_thread = threading.Thread(target=warm, name="model-warmup", daemon=True)
+            _warm_thread.start()
+        return _warm_thread
+
+
+def _store_stamp(character_path):
+    stamp = []
+    for name in MEMORY_STORE_FILES:
+        try:
+            st = os.stat(os.path.join(character_path, name))
+            stamp.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def get_memory_store(character_path: str):
+    """
+    Return (memory_index, memory_mapping) for a character folder.
+
+    The pair is loaded once and shared by every session that uses the character,
+    until its files change on disk. Returns (None, []) if the character has not
+    been finalized yet.
+    """
+    key = os.path.abspath(character_path)
+    stamp = _store_stamp(character_path)
+    with _lock:
+        cached = _memory_stores.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        if cached is not None:
+            print(f"[Resources] Memory files of {character_path} changed; reloading.")
+            _memory_attributes.pop(key, None)
+
+        index_path = os.path.join(character_path, "memory_index.faiss")
+        mapping_path = os.path.join(character_path, "memory_mapping.json")
+        if not (os.path.exists(index_path) and os.path.exists(mapping_path)):
+            print(f"[Warning] Memory index or mapping file missing for {character_path}.")
+            store = (None, [])
+        else:
+            index = load_memory_index(character_path)
+            with open(mapping_path, "r", encoding="utf-8") as f:
+                mapping = json.load(f)
+            print(f"[Resources] Loaded memory index for {character_path} ({len(mapping)} memories).")
+            check_index_model(character_path)
+            store = (index, mapping)
+
+        _memory_stores[key] = (stamp, store)
+        return store
+
+
+def get_memory_attributes(character_path: str):
+    """Return the character's MemoryAttributes (None if it has no memories), loaded once per process."""
+    _index, mapping = get_memory_store(character_path)
+    key = os.path.abspath(character_path)
+    with _lock:
+        if key not in _memory_attributes:
+            _memory_attributes[key] = MemoryAttributes.load(character_path, mapping) if mapping else None
+        return _memory_attributes[key]
+
+
+def drop_memory_store(character_path: str):
+    """Forget a cached index/mapping (e.g. after the character is re-finalized)."""
+    with _lock:
+        _memory_stores.pop(os.path.abspath(character_path), None)
+        _memory_attributes.pop(os.path.abspath(character_path), None)
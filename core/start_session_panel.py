@@ -2,6 +2,7 @@ import customtkinter as ctk
 import os
 import json
 from tkinter import messagebox
+from utils.asset_cache import list_files
 
 class StartSessionPanel(ctk.CTkFrame):
     def __init__(self, parent, character_base_path, controller, start_callback):
@@ -68,8 +69,8 @@ class StartSessionPanel(ctk.CTkFrame):
         scenario_dir = os.path.join(char_path, "Scenarios")
         prefix_dir = os.path.join(char_path, "Prefix")
 
-        scenario_files = [f for f in os.listdir(scenario_dir) if f.endswith(".json")]
-        prefix_files = [f for f in os.listdir(prefix_dir) if f.endswith(".json")]
+        scenario_files = list_files(scenario_dir)
+        prefix_files = list_files(prefix_dir)
 
         self.scenario_dropdown.configure(values=scenario_files)
         self.prefix_dropdown.configure(values=prefix_files)
@@ -0,0 +1,108 @@
+"""
+turn_executor.py
+
+Runs a chat session's turns one at a time.
+
+A turn (retrieval, the summarizer calls and the final generation) is queued
+under a key describing what it answers. Turns execute in submission order on a
+single worker, so two turns never interleave their history writes, and
+submitting a key that is already queued or running returns the existing turn
+instead of starting a second, identical generation. Every turn carries a
+CancelToken: stop() aborts the in-flight HTTP request and drops queued turns,
+and a turn that runs past its deadline (counted from when it starts, not from
+when it was queued) fails with LLMDeadlineExceeded instead of hanging.
+
+Callbacks run on the Tk thread through the app's TaskScheduler.
+"""
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.api_utils import CancelToken
+
+DEFAULT_TURN_DEADLINE = 300
+
+
+class Turn:
+    def __init__(self, key, fn, args, on_done, on_error, on_cancelled, timeout=None):
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_cancelled = on_cancelled
+        self.cancel = CancelToken()
+        self.timeout = timeout
+        self.future = None
+
+
+class TurnExecutor:
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="turn")
+        self._lock = threading.Lock()
+        self._pending = []   # queued and running turns, oldest first
+        self._closed = False
+
+    def pending(self, key):
+        """The queued or running turn submitted under `key`, or None."""
+        with self._lock:
+            return next((t for t in self._pending if t.key == key), None)
+
+    def busy(self) -> bool:
+        with self._lock:
+            return bool(self._pending)
+
+    def submit(self, key, fn, *args, on_done=None, on_error=None, on_cancelled=None,
+               timeout=DEFAULT_TURN_DEADLINE) -> Turn:
+        """
+        Queue fn(*args, cancel=<CancelToken>) as a turn, allowed `timeout` seconds
+        once it starts (None: no limit). If a turn with the same key is already
+        pending it is returned instead and this submission is dropped.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("TurnExecutor is closed")
+            existing = next((t for t in self._pending if t.key == key), None)
+            if existing is not None:
+                print(f"[Turns] Already generating {key!r}; ignoring the duplicate request.")
+                return existing
+            turn = Turn(key, fn, args, on_done, on_error, on_cancelled, timeout)
+            self._pending.append(turn)
+        turn.future = self._worker.submit(self._run, turn)
+        return turn
+
+    def _run(self, turn):
+        result, error = None, None
+        if not turn.cancel.cancelled:
+            turn.cancel.set_deadline(turn.timeout)
+            try:
+                result = turn.fn(*turn.args, cancel=turn.cancel)
+            except Exception as e:
+                error = e
+                if not turn.cancel.cancelled:
+                    traceback.print_exc()
+        with self._lock:
+            self._pending.remove(turn)
+
+        if turn.cancel.cancelled:
+            callback, args = turn.on_cancelled, ()
+        elif error is not None:
+            callback, args = turn.on_error, (error,)
+        else:
+            callback, args = turn.on_done, (result,)
+        if callback is not None:
+            self.scheduler.call_soon(callback, *args)
+
+    def stop(self):
+        """Cancel the running turn (aborting its HTTP request) and every queued one."""
+        with self._lock:
+            turns = list(self._pending)
+        for turn in turns:
+            turn.cancel.cancel()
+        return len(turns)
+
+    def close(self):
+        self._closed = True
+        self.stop()
+        self._worker.shutdown(wait=False)
@@ -0,0 +1,183 @@
+"""
+start_server.py
+
+Entry point for hosting many roleplay sessions from one process over HTTP.
+All sessions share one embedder, lemmatizer and per-character memory index
+(see core/shared_resources.py); turns are run on a bounded worker pool.
+
+Endpoints (JSON in, JSON out):
+    GET    /sessions                 List live sessions
+    POST   /sessions                 Create a session (409 if that session is already open)
+                                     {"session_name", "llm_character", "user_character",
+                                      "scenario_file", "prefix_file"}
+    POST   /sessions/<id>/send       {"message"} -> {"reply"}
+                                     (502 if the model rejects the request, 503 if it is
+                                      unreachable, overloaded or past llm_turn_deadline)
+    POST   /sessions/<id>/stream     {"message"} -> text/event-stream of reply chunks
+    DELETE /sessions/<id>            Close a session (history stays on disk)
+"""
+import argparse
+import json
+import queue
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from core.session_host import SessionManager, SessionExistsError, load_settings_file
+from utils.api_utils import LLMError, LLMHTTPError
+
+_STREAM_DONE = object()
+
+
+class RoleplayRequestHandler(BaseHTTPRequestHandler):
+    manager: SessionManager = None
+
+    # --- Helpers ---
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length).decode("utf-8")) or {}
+        except (ValueError, json.JSONDecodeError):
+            return None
+
+    def _route(self):
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if not parts or parts[0] != "sessions":
+            return None, None
+        session_id = parts[1] if len(parts) > 1 else None
+        action = parts[2] if len(parts) > 2 else None
+        return session_id, action
+
+    def _get_session_or_404(self, session_id):
+        session = self.manager.get_session(session_id)
+        if session is None:
+            self._send_json(404, {"error": f"Unknown session: {session_id}"})
+        return session
+
+    # --- Verbs ---
+    def do_GET(self):
+        session_id, action = self._route()
+        if self.path.split("?")[0].rstrip("/") == "/sessions":
+            self._send_json(200, {"sessions": self.manager.list_sessions()})
+            return
+        if session_id and not action:
+            session = self._get_session_or_404(session_id)
+            if session:
+                self._send_json(200, session.describe())
+            return
+        self._send_json(404, {"error": "Not found"})
+
+    def do_DELETE(self):
+        session_id, action = self._route()
+        if session_id and not action and self.manager.close_session(session_id):
+            self._send_json(200, {"closed": session_id})
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        session_id, action = self._route()
+        data = self._read_json()
+        if data is None:
+            self._send_json(400, {"error": "Request body must be JSON."})
+            return
+
+        if session_id is None and self.path.split("?")[0].rstrip("/") == "/sessions":
+            try:
+                session = self.manager.create_session(data)
+            except SessionExistsError as e:
+                self._send_json(409, {"error": str(e), "session_id": e.session.session_id})
+                return
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(201, session.describe())
+            return
+
+        if action not in ("send", "stream"):
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        session = self._get_session_or_404(session_id)
+        if not session:
+            return
+
+        message = (data.get("message") or "").strip()
+        if not message:
+            self._send_json(400, {"error": "Missing 'message'."})
+            return
+
+        if action == "send":
+            try:
+                reply = self.manager.submit_send(session, message).result()
+            except LLMError as e:
+                status = 502 if isinstance(e, LLMHTTPError) and not e.retryable else 503
+                self._send_json(status, {"error": str(e), "retryable": status == 503})
+                return
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+                return
+            self._send_json(200, {"reply": reply})
+        else:
+            self._stream_reply(session, message)
+
+    def _stream_reply(self, session, message):
+        chunks = queue.Queue()
+        future = self.manager.submit_stream(session, message, chunks.put)
+        future.add_done_callback(lambda _f: chunks.put(_STREAM_DONE))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is _STREAM_DONE:
+                    break
+                self.wfile.write(f"data: {json.dumps({'delta': chunk})}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            error = future.exception()
+            if error:
+                self.wfile.write(f"data: {json.dumps({'error': str(error)})}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            print(f"[Server] Client disconnected during stream for session {session.session_id}; stopping the turn.")
+            # Free the worker and the backend instead of generating into a queue nobody reads
+            self.manager.cancel_turn(future)
+
+
+def main():
+    settings_data = load_settings_file()
+
+    parser = argparse.ArgumentParser(description="AI Roleplay Simulator multi-session server")
+    parser.add_argument("--host", default=settings_data.get("server_host", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=settings_data.get("server_port", 8765))
+    parser.add_argument("--workers", type=int, default=settings_data.get("server_llm_workers", 2),
+                        help="Maximum number of turns sent to the LLM backend at once")
+    args = parser.parse_args()
+
+    RoleplayRequestHandler.manager = SessionManager(settings_data, max_workers=args.workers)
+    server = ThreadingHTTPServer((args.host, args.port), RoleplayRequestHandler)
+    print(f"[Server] Listening on http://{args.host}:{args.port} ({args.workers} LLM worker(s))")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[Server] Shutting down.")
+    finally:
+        RoleplayRequestHandler.manager.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,18 @@ start_ui.py
 
 Entry point for launching the AI Roleplay Simulator UI.
 Initializes the RoleplayApp controller, registers all view frames, loads settings, and starts the main UI loop.
+Heavy models are warmed on a background thread once the window is up.
+Run with --profile-startup to print import and phase timings.
 """
+import sys
+
+# Must come before the app imports so they are timed
+from utils.startup_profiler import StartupProfiler
+profiler = StartupProfiler.from_argv(sys.argv)
 
 # Core application controller
 from core.app_controller import RoleplayApp
+from core.shared_resources import warm_models
 
 # CustomTkinter
 import customtkinter as ctk
@@ -20,6 +28,9 @@ from views.advanced_settings import AdvancedSettings
 ctk.set_appearance_mode("dark")
 
 if __name__ == "__main__":
+    if profiler:
+        profiler.mark("imports done")
+
     # Initialize main application controller
     app = RoleplayApp()
 
@@ -34,5 +45,20 @@ if __name__ == "__main__":
     # Show the Start Menu as the first visible frame
     app.show_frame("StartMenu")
 
+    if profiler:
+        profiler.mark("views built")
+
+    def on_models_warm():
+        profiler.mark("models warm")
+        profiler.report()
+
+    # Once the first frame is drawn, load the embedder/lemmatizer in the background
+    def on_first_idle():
+        if profiler:
+            profiler.mark("start menu interactive")
+        warm_models(on_ready=on_models_warm if profiler else None)
+
+    app.after_idle(on_first_idle)
+
     # Start the event loop
     app.mainloop()
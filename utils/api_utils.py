@@ -1,32 +1,391 @@
 import json
+import time
+import socket
+import threading
 import requests
 
-def call_llm_api(url, payload, show_debug=False, history=None, prompt=None):
+from utils.llm_usage import CallMeter, LLMResult
+
+CANCELLED_REPLY = "[Cancelled]"
+# Worth sending again (after a pause, or to another endpoint): the server is busy or briefly failing
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+CONNECT_TIMEOUT = 10
+HEADERS = {"Content-Type": "application/json"}
+# OpenAI-style servers only send a streamed request's token counts when asked
+STREAM_OPTIONS = {"include_usage": True}
+
+
+class LLMError(Exception):
+    """
+    A failed LLM request; str() is a bracketed message such as "[Error 503] ...".
+    `retryable` errors may succeed if sent again or to another endpoint.
+    """
+    retryable = False
+
+    def __init__(self, message, url=None):
+        super().__init__(message)
+        self.url = url
+
+
+class LLMConnectionError(LLMError):
+    retryable = True
+
+
+class LLMTimeoutError(LLMConnectionError):
+    pass
+
+
+class LLMHTTPError(LLMError):
+    def __init__(self, status, body, url=None, retry_after=None):
+        super().__init__(f"[Error {status}] {body}", url)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.status in RETRYABLE_STATUSES
+
+
+class LLMResponseError(LLMError):
+    """The server answered 200 with something that isn't a completion."""
+
+
+class LLMCancelled(LLMError):
+    def __init__(self, url=None):
+        super().__init__(CANCELLED_REPLY, url)
+
+
+class LLMDeadlineExceeded(LLMError):
+    def __init__(self, url=None):
+        super().__init__("[Error] The turn ran past its deadline (llm_turn_deadline).", url)
+
+
+class CircuitOpenError(LLMError):
+    """Every endpoint that could take the call is failing and cooling down."""
+
+
+class CancelToken:
+    """
+    Aborts the LLM requests it is passed to. cancel() may be called from any
+    thread: it closes the sockets of requests in flight, so a read blocked on the
+    backend returns at once and the backend stops generating for a closed client.
+    """
+
+    def __init__(self, timeout=None):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._responses = []
+        self.deadline = None
+        self.set_deadline(timeout)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def set_deadline(self, seconds):
+        """Requests made with this token must finish within `seconds` from now (None/0: no limit)."""
+        self.deadline = time.monotonic() + float(seconds) if seconds else None
+
+    def remaining(self):
+        """Seconds left before the deadline, or None without one."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self, url=None):
+        """Raise LLMCancelled / LLMDeadlineExceeded if the token says to stop."""
+        if self.cancelled:
+            raise LLMCancelled(url)
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise LLMDeadlineExceeded(url)
+
+    def wait(self, seconds) -> bool:
+        """Sleep up to `seconds`; True if cancelled meanwhile."""
+        return self._event.wait(seconds)
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            responses = list(self._responses)
+        for response in responses:
+            _abort_response(response)
+
+    def _track(self, response):
+        with self._lock:
+            self._responses.append(response)
+        if self.cancelled:
+            _abort_response(response)
+
+    def _untrack(self, response):
+        with self._lock:
+            if response in self._responses:
+                self._responses.remove(response)
+
+
+def _abort_response(response):
+    # Shutting the socket down (not just closing the response) wakes a read blocked in another thread
+    try:
+        response.raw._connection.sock.shutdown(socket.SHUT_RDWR)
+    except Exception:
+        pass
+    try:
+        response.close()
+    except Exception:
+        pass
+
+
+def _reply_from_json(response, url=None, meter=None):
+    try:
+        data = response.json()
+    except (ValueError, json.JSONDecodeError):
+        raise LLMResponseError("[Error] Invalid JSON in API response.", url)
+    if meter is not None:
+        meter.observe(data)
+
+    # Try OpenAI-style chat format first
+    try:
+        return data["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        pass
+
+    # Fallback: some servers return "text"
+    try:
+        return data["choices"][0]["text"]
+    except (KeyError, IndexError, TypeError):
+        raise LLMResponseError("[Error] Unrecognized API response format.", url)
+
+
+def _raise_for_status(response, url):
+    if response.status_code == 200:
+        return
+    retry_after = None
+    try:
+        retry_after = float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        pass
+    raise LLMHTTPError(response.status_code, response.text, url, retry_after)
+
+
+def _choices_from_json(response, meter=None):
+    """Every choice's content in a (non-streamed) reply requested with `n`."""
+    try:
+        data = response.json()
+        choices = data["choices"]
+    except (ValueError, KeyError, TypeError):
+        return []
+    if meter is not None:
+        meter.observe(data)
+    replies = []
+    for choice in choices:
+        content = (choice.get("message") or {}).get("content")
+        if content is None:
+            content = choice.get("text")
+        if isinstance(content, str):
+            replies.append(content)
+    return replies
+
+
+def _iter_sse_deltas(response, with_index=False, meter=None):
+    """
+    Content deltas of an OpenAI-style server-sent event stream ((choice index, delta)
+    with_index). A CallMeter sees every chunk, including the final usage-only one.
+    """
+    for raw_line in response.iter_lines(decode_unicode=True):
+        if not raw_line or not raw_line.startswith("data:"):
+            continue
+        data_str = raw_line[len("data:"):].strip()
+        if data_str == "[DONE]":
+            return
+        try:
+            data = json.loads(data_str)
+        except (ValueError, json.JSONDecodeError):
+            continue
+        if meter is not None:
+            meter.observe(data)
+
+        try:
+            choice = data["choices"][0]
+        except (KeyError, IndexError, TypeError):
+            continue
+        delta = (choice.get("delta") or {}).get("content")
+        if delta is None:
+            delta = choice.get("text")
+        if delta:
+            if meter is not None:
+                meter.first_token()
+            yield (choice.get("index", 0), delta) if with_index else delta
+
+
+def request_llm(url, payload, cancel=None) -> LLMResult:
     """
-    Sends a POST request to the LLM API with the given payload and returns the model's response.
+    One completion request: the reply text as an LLMResult (with its token usage
+    and timing), or an LLMError subclass raised.
+
+    With a CancelToken the reply is streamed and assembled here, so the request
+    has an open socket to abort from the first byte, and the token's deadline
+    bounds the wait.
     """
-    headers = {"Content-Type": "application/json"}
+    if cancel is not None:
+        cancel.check(url)
+        return _request_cancellable(url, payload, cancel)
 
+    meter = CallMeter(url)
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        if response.status_code == 200:
+        response = requests.post(url, headers=HEADERS, json=payload, timeout=(CONNECT_TIMEOUT, None))
+    except requests.Timeout as e:
+        raise LLMTimeoutError(f"[Connection Error] {e}", url)
+    except Exception as e:
+        raise LLMConnectionError(f"[Connection Error] {e}", url)
+    _raise_for_status(response, url)
+    return meter.result(_reply_from_json(response, url, meter))
+
+
+def _request_cancellable(url, payload, cancel):
+    body = dict(payload)
+    body["stream"] = True
+    body["stream_options"] = STREAM_OPTIONS
+    meter = CallMeter(url)
+
+    try:
+        with requests.post(url, headers=HEADERS, json=body, stream=True,
+                           timeout=(CONNECT_TIMEOUT, cancel.remaining())) as response:
+            cancel._track(response)
             try:
-                data = response.json()
-            except (ValueError, json.JSONDecodeError):
-                return "[Error] Invalid JSON in API response."
+                _raise_for_status(response, url)
+                if "text/event-stream" not in response.headers.get("Content-Type", ""):
+                    # Server ignored "stream" and sent one JSON reply
+                    return meter.result(_reply_from_json(response, url, meter))
+                parts = []
+                for delta in _iter_sse_deltas(response, meter=meter):
+                    cancel.check(url)
+                    parts.append(delta)
+            finally:
+                cancel._untrack(response)
+    except LLMError:
+        raise
+    except Exception as e:
+        cancel.check(url)
+        if isinstance(e, requests.Timeout):
+            raise LLMTimeoutError(f"[Connection Error] {e}", url)
+        raise LLMConnectionError(f"[Connection Error] {e}", url)
+    # An aborted stream can also just end early
+    cancel.check(url)
+    return meter.result("".join(parts))
+
+
+def _call_with_n(url, payload, n, cancel=None):
+    """
+    All replies the backend returns for one request with "n": n (fewer, or [], if it
+    ignores `n`). Failures raise like request_llm; a non-retryable LLMHTTPError
+    usually means the server rejects `n`. The request's usage covers every choice,
+    so it is attached to the first one.
+    """
+    body = dict(payload)
+    body["n"] = n
+    meter = CallMeter(url)
+    if cancel is None:
+        try:
+            response = requests.post(url, headers=HEADERS, json=body, timeout=(CONNECT_TIMEOUT, None))
+        except requests.Timeout as e:
+            raise LLMTimeoutError(f"[Connection Error] {e}", url)
+        except Exception as e:
+            raise LLMConnectionError(f"[Connection Error] {e}", url)
+        _raise_for_status(response, url)
+        return _with_usage(_choices_from_json(response, meter), meter)
 
-            # Try OpenAI-style chat format first
+    cancel.check(url)
+    body["stream"] = True
+    body["stream_options"] = STREAM_OPTIONS
+    try:
+        with requests.post(url, headers=HEADERS, json=body, stream=True,
+                           timeout=(CONNECT_TIMEOUT, cancel.remaining())) as response:
+            cancel._track(response)
             try:
-                return data["choices"][0]["message"]["content"]
-            except (KeyError, IndexError, TypeError):
-                pass
+                _raise_for_status(response, url)
+                if "text/event-stream" not in response.headers.get("Content-Type", ""):
+                    return _with_usage(_choices_from_json(response, meter), meter)
+                parts = {}
+                for index, delta in _iter_sse_deltas(response, with_index=True, meter=meter):
+                    cancel.check(url)
+                    parts.setdefault(index, []).append(delta)
+            finally:
+                cancel._untrack(response)
+    except LLMError:
+        raise
+    except Exception as e:
+        cancel.check(url)
+        if isinstance(e, requests.Timeout):
+            raise LLMTimeoutError(f"[Connection Error] {e}", url)
+        raise LLMConnectionError(f"[Connection Error] {e}", url)
+    cancel.check(url)
+    return _with_usage(["".join(parts[i]) for i in sorted(parts)], meter)
+
 
-            # Fallback: some servers return "text"
+def _with_usage(replies, meter):
+    # One request, one LLMResult: the other choices are plain text so usage is counted once
+    if not replies:
+        return []
+    return [meter.result(replies[0])] + replies[1:]
+
+
+def call_llm_candidates(url, payload, n, use_n=True, cancel=None, call_one=None):
+    """
+    The reply to one payload plus whatever alternatives come with it for free:
+    with use_n (and n > 1) a single request asks for `n` choices with the OpenAI
+    `n` parameter, so the list holds 1..n entries. Alternatives the backend doesn't
+    return (many local servers ignore `n`) are not waited for here; the caller
+    generates them in the background. If the backend rejects `n`, or returns no
+    choices, one plain request is made through call_one(payload) (default
+    request_llm). Retryable failures, cancellation and the deadline raise.
+    """
+    if call_one is None:
+        call_one = lambda p: request_llm(url, p, cancel)
+    if n > 1 and use_n:
+        try:
+            replies = _call_with_n(url, payload, n, cancel)
+        except LLMError as e:
+            if e.retryable or isinstance(e, (LLMCancelled, LLMDeadlineExceeded)):
+                raise
+            print(f"[Retry] Backend rejected n={n} ({str(e)[:80]}); requesting a single reply.")
+            replies = []
+        if replies:
+            return replies[:n]
+    return [call_one(payload)]
+
+
+def stream_llm_api(url, payload, cancel=None, meter=None):
+    """
+    Sends a streaming request (OpenAI-style server-sent events) and yields the
+    content deltas as they arrive. Failures raise the same LLMError subclasses as
+    request_llm, before or after the first delta; a cancelled stream just ends.
+    Pass a CallMeter to collect the stream's usage and timing.
+    """
+    body = dict(payload)
+    body["stream"] = True
+    body["stream_options"] = STREAM_OPTIONS
+    read_timeout = cancel.remaining() if cancel is not None else None
+
+    try:
+        with requests.post(url, headers=HEADERS, json=body, stream=True,
+                           timeout=(CONNECT_TIMEOUT, read_timeout)) as response:
+            if cancel is not None:
+                cancel._track(response)
             try:
-                return data["choices"][0]["text"]
-            except (KeyError, IndexError, TypeError):
-                return "[Error] Unrecognized API response format."
-        else:
-            return f"[Error {response.status_code}] {response.text}"
+                _raise_for_status(response, url)
+                for delta in _iter_sse_deltas(response, meter=meter):
+                    if cancel is not None:
+                        if cancel.cancelled:
+                            return
+                        cancel.check(url)
+                    yield delta
+            finally:
+                if cancel is not None:
+                    cancel._untrack(response)
+    except LLMError:
+        raise
     except Exception as e:
-        return f"[Connection Error] {e}"
\ No newline at end of file
+        if cancel is not None and cancel.cancelled:
+            return
+        if isinstance(e, requests.Timeout):
+            raise LLMTimeoutError(f"[Connection Error] {e}", url)
+        raise LLMConnectionError(f"[Connection Error] {e}", url)
@@ -0,0 +1,168 @@
+"""
+asset_cache.py
+
+Process-wide cache for the small JSON assets of a character folder: character
+configs, scenarios, prefixes, memory templates and alias maps, plus the
+scenario/prefix file listings.
+
+Every entry remembers the (mtime, size) of its file, so an edit made by another
+tool (or the Character Creator) is picked up on the next read at the cost of one
+os.stat. With the optional watcher running (start_watcher, needs the `watchdog`
+package), files under the watched folder are served from memory without even the
+stat; change events invalidate them.
+
+Returned objects are shared: treat them as read-only and copy before editing.
+"""
+import os
+import json
+import threading
+
+from utils.file_utils import atomic_write_json
+
+_MISSING = object()
+
+
+class AssetCache:
+    def __init__(self):
+        self._entries = {}   # abspath -> (stat key, value)
+        self._lock = threading.Lock()
+        self._observer = None
+        self._watched_roots = []
+
+    # --- Internals ---
+    @staticmethod
+    def _stat_key(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _is_watched(self, path):
+        return self._observer is not None and any(
+            path == root or path.startswith(root + os.sep) for root in self._watched_roots
+        )
+
+    def _lookup(self, key, path, load):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+        if entry is not _MISSING and self._is_watched(path):
+            return entry[1]
+
+        stat_key = self._stat_key(path)
+        if entry is not _MISSING and entry[0] == stat_key:
+            return entry[1]
+
+        value = load(path) if stat_key is not None else None
+        with self._lock:
+            self._entries[key] = (stat_key, value)
+        return value
+
+    @staticmethod
+    def _load_json(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[WARN] Could not read {path}: {e}")
+            return None
+
+    # --- Public API ---
+    def read_json(self, path, default=None):
+        """Parsed JSON of `path` (cached), or `default` if it is missing or invalid."""
+        path = os.path.abspath(path)
+        value = self._lookup(("json", path), path, self._load_json)
+        return default if value is None else value
+
+    def list_files(self, folder, suffix=".json"):
+        """Sorted names of the files in `folder` ending with `suffix` ([] if it doesn't exist)."""
+        folder = os.path.abspath(folder)
+
+        def load(path):
+            return sorted(f for f in os.listdir(path) if f.endswith(suffix))
+
+        return list(self._lookup(("dir", folder, suffix), folder, load) or [])
+
+    def write_json(self, path, data, indent=2):
+        """Atomically write `data` as JSON and refresh the cached copy."""
+        atomic_write_json(path, data, indent=indent)
+        self.invalidate(path)
+
+    def invalidate(self, path=None):
+        """Forget one file (and its folder's listings), or everything when path is None."""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                return
+            path = os.path.abspath(path)
+            folder = os.path.dirname(path)
+            for key in list(self._entries):
+                if key[1] in (path, folder):
+                    del self._entries[key]
+
+    def start_watcher(self, root):
+        """
+        Watch `root` recursively and drop cache entries when files change there.
+        Returns False (stat-based checks stay in effect) if watchdog is unavailable.
+        """
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            print("[Assets] watchdog not installed; asset changes are detected by mtime.")
+            return False
+
+        cache = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                cache.invalidate(event.src_path)
+                dest = getattr(event, "dest_path", None)
+                if dest:
+                    cache.invalidate(dest)
+
+        root = os.path.abspath(root)
+        with self._lock:
+            if self._observer is None:
+                self._observer = Observer()
+                self._observer.daemon = True
+                self._observer.start()
+            if root in self._watched_roots:
+                return True
+            self._observer.schedule(_Handler(), root, recursive=True)
+            self._watched_roots.append(root)
+        # Anything cached before the watch started may already be stale
+        self.invalidate()
+        print(f"[Assets] Watching {root} for changes.")
+        return True
+
+    def stop_watcher(self):
+        with self._lock:
+            observer, self._observer = self._observer, None
+            self._watched_roots = []
+        if observer is not None:
+            observer.stop()
+            observer.join(timeout=2)
+
+
+_cache = AssetCache()
+
+
+def get_asset_cache() -> AssetCache:
+    return _cache
+
+
+def read_json(path, default=None):
+    return _cache.read_json(path, default)
+
+
+def list_files(folder, suffix=".json"):
+    return _cache.list_files(folder, suffix)
+
+
+def write_json(path, data, indent=2):
+    _cache.write_json(path, data, indent)
+
+
+def invalidate(path=None):
+    _cache.invalidate(path)
@@ -1,6 +1,66 @@
 import datetime
 import json
 
+from utils.llm_usage import STAGES, STAGE_LABELS, throughput
+
+def format_token_cache_line(token_cache: dict) -> str:
+    """One-line summary of TokenCounter.stats() for the debug reports."""
+    return (
+        f"Token Counter ({token_cache.get('tokenizer', '?')}): {token_cache.get('hits', 0)} hits / "
+        f"{token_cache.get('misses', 0)} misses / {token_cache.get('estimated', 0)} estimated "
+        f"({token_cache.get('hit_rate', 0.0):.0%} hit rate, {token_cache.get('entries', 0)} cached)"
+    )
+
+def format_embedding_cache_line(embedding_cache: dict) -> str:
+    """One-line summary of EmbeddingCache.stats() for the debug reports."""
+    disk = f", {embedding_cache.get('disk_hits', 0)} from disk" if embedding_cache.get("disk") else ""
+    return (
+        f"Query Embeddings ({embedding_cache.get('model', '?')}): {embedding_cache.get('hits', 0)} hits{disk} / "
+        f"{embedding_cache.get('misses', 0)} encoded "
+        f"({embedding_cache.get('hit_rate', 0.0):.0%} hit rate, {embedding_cache.get('entries', 0)} cached)"
+    )
+
+def format_usage_bucket_line(label: str, bucket: dict) -> str:
+    """One line of UsageTracker.snapshot(): token spend, time and prefill/decode throughput of a stage."""
+    calls = bucket.get("calls", 0)
+    line = (
+        f"{label}: {calls} call{'s' if calls != 1 else ''}, {bucket.get('prompt_tokens', 0)} prompt + "
+        f"{bucket.get('completion_tokens', 0)} completion tokens, {bucket.get('latency', 0.0):.1f}s"
+    )
+    prefill, decode = throughput(bucket)
+    if prefill is not None or decode is not None:
+        rates = []
+        if prefill is not None:
+            rates.append(f"prefill {prefill:.0f} tok/s")
+        if decode is not None:
+            rates.append(f"decode {decode:.1f} tok/s")
+        line += f" ({', '.join(rates)})"
+    if bucket.get("unreported"):
+        line += f" [{bucket['unreported']} without usage]"
+    return line
+
+def format_llm_usage_lines(llm_usage: dict) -> list[str]:
+    """Per-stage LLM usage of the last turn and of the session, for the debug reports."""
+    lines = []
+    for scope, title in (("turn", "Last Turn"), ("session", f"Session, {llm_usage.get('turns', 0)} turns")):
+        stages = llm_usage.get(scope) or {}
+        if not stages:
+            continue
+        lines.append(f"--- LLM Usage ({title}) ---")
+        for stage in STAGES:
+            if stage in stages:
+                lines.append(format_usage_bucket_line(STAGE_LABELS[stage], stages[stage]))
+        total = stages.get("total")
+        if total:
+            lines.append(format_usage_bucket_line("Total", total))
+            if total.get("models"):
+                lines.append(f"Models: {', '.join(total['models'])}")
+    turns = llm_usage.get("turns", 0)
+    session_total = (llm_usage.get("session") or {}).get("total")
+    if turns and session_total:
+        lines.append(f"Prompt Tokens per Turn (avg): {session_total.get('prompt_tokens', 0) / turns:.0f}")
+    return lines
+
 # For chat display
 def generate_basic_debug_report(
     payload: dict,
@@ -27,6 +87,17 @@ def generate_basic_debug_report(
     lines.append(
         f"Used for Rolling Memory: {token_stats.get('rolling_used_tokens', 0)}"
     )
+    token_cache = token_stats.get("token_cache")
+    if token_cache:
+        lines.append(format_token_cache_line(token_cache))
+    embedding_cache = token_stats.get("embedding_cache")
+    if embedding_cache:
+        lines.append(format_embedding_cache_line(embedding_cache))
+    llm_usage = token_stats.get("llm_usage")
+    if llm_usage:
+        lines.append("")
+        lines.extend(format_llm_usage_lines(llm_usage))
+        lines.append("")
 
     # Memory parameters
     lines.append(f"Top K (Chunks): {payload.get('top_k', '???')}")
@@ -75,7 +146,10 @@ def generate_advanced_debug_report(
     prefix_tokens=None,
     memory_tokens=None,
     available_for_rolling=None,
-    rolling_used_tokens=None
+    rolling_used_tokens=None,
+    token_cache=None,
+    embedding_cache=None,
+    llm_usage=None
 ) -> str:
     lines = [f"=== Advanced Debug Report ==="]
     lines.append(f"Generated at: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
@@ -88,6 +162,14 @@ def generate_advanced_debug_report(
     lines.append(f"Memory Chunks: {memory_tokens or 0} tokens")
     lines.append(f"Available for Rolling Memory: {available_for_rolling or 0}")
     lines.append(f"Used for Rolling Memory: {rolling_used_tokens or 0}")
+    if token_cache:
+        lines.append(format_token_cache_line(token_cache))
+    if embedding_cache:
+        lines.append(format_embedding_cache_line(embedding_cache))
+    if llm_usage:
+        lines.append("")
+        lines.extend(format_llm_usage_lines(llm_usage))
+        lines.append("")
 
     # Characters
     lines.append("--- Character Info ---")
@@ -0,0 +1,207 @@
+"""
+embedding_cache.py
+
+Cache for query embeddings, keyed by (model id, normalized text).
+
+Texts are Unicode-normalized and whitespace-collapsed before keying; they are
+also lowercased, but only for models registered as uncased, so a cased model
+(`embedder_path`) keeps separate vectors for "Harry" and "harry".
+
+Retries and stock messages ("Continue", "What happens next?") embed the exact
+same text again and again; a cache hit returns the stored vector without running
+the transformer at all. The in-memory tier is an LRU; an optional SQLite tier
+(`embedding_cache_path` in settings) keeps vectors across restarts.
+"""
+import re
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_MAX_ENTRIES = 2048
+
+# embedder object -> (model id, uncased) (registered by whoever loads the embedder)
+_model_ids = weakref.WeakKeyDictionary()
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def normalize_text(text: str, lowercase: bool = False) -> str:
+    """Unicode-normalize and collapse whitespace; lowercase too when the model is uncased."""
+    text = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text or "")).strip()
+    return text.lower() if lowercase else text
+
+
+def register_embedder(embedder, model_id: str, uncased: bool = False):
+    """Associate an embedder with the model id its cache entries are keyed by."""
+    try:
+        _model_ids[embedder] = (model_id, uncased)
+    except TypeError:
+        pass
+
+
+def _registration(embedder):
+    try:
+        return _model_ids.get(embedder)
+    except TypeError:
+        return None
+
+
+def model_id_for(embedder) -> str:
+    registered = _registration(embedder)
+    return registered[0] if registered else f"{type(embedder).__name__}@{id(embedder):x}"
+
+
+def is_uncased(embedder) -> bool:
+    """Whether the embedder was registered as lowercasing its input (unknown models count as cased)."""
+    registered = _registration(embedder)
+    return bool(registered and registered[1])
+
+
+class EmbeddingCache:
+    """LRU of embeddings for one model, with an optional SQLite tier behind it."""
+
+    def __init__(self, model_id, max_entries=DEFAULT_MAX_ENTRIES, disk_path=None, lowercase=False):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.lowercase = lowercase
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_path:
+            self.attach_disk(disk_path)
+
+    def attach_disk(self, path):
+        with self._lock:
+            if self._db is not None:
+                return
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings ("
+                    "model TEXT, key BLOB, dim INTEGER, vector BLOB, PRIMARY KEY (model, key))"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"[Warning] Embedding disk cache unavailable: {e}")
+                self._db = None
+
+    def _key(self, normalized: str) -> bytes:
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+    def _get(self, key):
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return vector
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT dim, vector FROM embeddings WHERE model = ? AND key = ?", (self.model_id, key)
+            ).fetchone()
+            if row:
+                vector = np.frombuffer(row[1], dtype="float32").reshape(row[0]).copy()
+                self._put_memory(key, vector)
+                self.disk_hits += 1
+                return vector
+        return None
+
+    def _put_memory(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def encode(self, embedder, texts, **encode_kwargs) -> np.ndarray:
+        """
+        Drop-in for embedder.encode(texts) returning a float32 array. Only texts
+        missing from both tiers reach the model, in a single batch.
+        """
+        keys = [self._key(normalize_text(t, self.lowercase) + "\x00" + repr(sorted(encode_kwargs.items()))) for t in texts]
+        vectors = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                vectors[i] = self._get(key)
+                if vectors[i] is None:
+                    missing.setdefault(key, []).append(i)
+
+        if missing:
+            batch = [texts[positions[0]] for positions in missing.values()]
+            encoded = np.asarray(embedder.encode(batch, **encode_kwargs), dtype="float32")
+            with self._lock:
+                self.misses += len(batch)
+                for (key, positions), vector in zip(missing.items(), encoded):
+                    self._put_memory(key, vector)
+                    for i in positions:
+                        vectors[i] = vector
+                if self._db is not None:
+                    try:
+                        self._db.executemany(
+                            "INSERT OR REPLACE INTO embeddings (model, key, dim, vector) VALUES (?, ?, ?, ?)",
+                            [(self.model_id, key, len(v), v.tobytes()) for key, v in zip(missing, encoded)],
+                        )
+                        self._db.commit()
+                    except sqlite3.Error as e:
+                        print(f"[Warning] Could not write embedding disk cache: {e}")
+
+        return np.stack(vectors).astype("float32", copy=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "model": self.model_id,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._memory),
+                "disk": self._db is not None,
+                "hit_rate": ((self.hits + self.disk_hits) / lookups) if lookups else 0.0,
+            }
+
+
+def get_embedding_cache(embedder, settings_data: dict | None = None) -> EmbeddingCache:
+    """Shared cache for an embedder's model; attaches the disk tier if settings name a path."""
+    model_id = model_id_for(embedder)
+    settings_data = settings_data or {}
+    with _caches_lock:
+        cache = _caches.get(model_id)
+        if cache is None:
+            try:
+                max_entries = int(settings_data.get("embedding_cache_size", DEFAULT_MAX_ENTRIES))
+            except (ValueError, TypeError):
+                max_entries = DEFAULT_MAX_ENTRIES
+            cache = EmbeddingCache(model_id, max_entries, lowercase=is_uncased(embedder))
+            _caches[model_id] = cache
+    disk_path = settings_data.get("embedding_cache_path")
+    if disk_path:
+        cache.attach_disk(disk_path)
+    return cache
+
+
+def embedding_cache_stats() -> dict | None:
+    """Stats of every model's cache combined (None before the first lookup)."""
+    with _caches_lock:
+        caches = list(_caches.values())
+    if not caches:
+        return None
+    if len(caches) == 1:
+        return caches[0].stats()
+    merged = {"model": ", ".join(c.model_id for c in caches), "hits": 0, "disk_hits": 0,
+              "misses": 0, "entries": 0, "disk": False}
+    for cache in caches:
+        s = cache.stats()
+        for key in ("hits", "disk_hits", "misses", "entries"):
+            merged[key] += s[key]
+        merged["disk"] = merged["disk"] or s["disk"]
+    lookups = merged["hits"] + merged["disk_hits"] + merged["misses"]
+    merged["hit_rate"] = ((merged["hits"] + merged["disk_hits"]) / lookups) if lookups else 0.0
+    return merged
@@ -0,0 +1,269 @@
+"""
+episodic_memory.py
+
+Per-session episodic memory: every completed user/assistant exchange is embedded
+in the background and added to a session-local FAISS index, so turns that have
+fallen out of the rolling history window can still be recalled by similarity.
+
+Storage (inside the session folder) is append-only, like history.jsonl:
+  episodic.jsonl        one mapping entry per exchange (same shape as memory_mapping.json)
+  episodic_vectors.f32  the matching normalized embeddings, float32, row-major
+  episodic_meta.json    embedding dimension and model name
+The in-memory index is rebuilt from the vectors file on open (an IndexFlatIP
+over a few thousand rows builds in milliseconds).
+"""
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils.file_utils import atomic_write_json
+from utils.token_utils import count_tokens
+
+EPISODIC_MAPPING_FILE = "episodic.jsonl"
+EPISODIC_VECTORS_FILE = "episodic_vectors.f32"
+EPISODIC_META_FILE = "episodic_meta.json"
+
+
+def exchange_memory(turn_index, user_name, user_text, bot_name, bot_text) -> dict:
+    """Mapping entry for one exchange; reads like a first-hand character memory."""
+    prompt_text = (
+        "[PERSPECTIVE: First Hand]\n"
+        f"Earlier in this conversation:\n{user_name}: {user_text.strip()}\n{bot_name}: {bot_text.strip()}"
+    )
+    return {
+        "memory_id": f"Turn {turn_index // 2 + 1}",
+        "prompt_text": prompt_text,
+        "search_text": f"{user_text.strip()}\n{bot_text.strip()}",
+        "tags": [],
+        "importance": None,
+        "perspective": "First Hand",
+        "source": "episodic",
+        "turn_index": turn_index,
+        "token_count": count_tokens(prompt_text),
+    }
+
+
+class EpisodicIndex:
+    """
+    Session-local vector index over past exchanges.
+
+    add_exchange() and discard_from() run on a single background worker, in the
+    order they were called, so the UI thread never waits on the embedder and a
+    retry's discard can never overtake the add it invalidates.
+    """
+
+    def __init__(self, session_dir, embedder, model_name=""):
+        self.session_dir = session_dir
+        # The embedder, or a function returning it (resolved on the worker, so
+        # opening a session never waits for a model that is still loading)
+        self._embedder = embedder
+        self.model_name = model_name
+        self.mapping_path = os.path.join(session_dir, EPISODIC_MAPPING_FILE)
+        self.vectors_path = os.path.join(session_dir, EPISODIC_VECTORS_FILE)
+        self.meta_path = os.path.join(session_dir, EPISODIC_META_FILE)
+
+        self.dim = None
+        self.index = None
+        self.mapping = []
+        self._mapping_offsets = []   # byte offset of each mapping line
+        self._lock = threading.Lock()
+        self._closed = False
+        self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="episodic")
+
+        os.makedirs(session_dir, exist_ok=True)
+        self._load()
+
+    @property
+    def embedder(self):
+        if not hasattr(self._embedder, "encode"):
+            self._embedder = self._embedder()
+        return self._embedder
+
+    # --- Setup ---
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if self.model_name and meta.get("model") and meta["model"] != self.model_name:
+                print("[Episodic] Embedder changed; rebuilding the session's episodic index.")
+                self._reset_files()
+                return
+            self.dim = int(meta["dim"])
+
+            offset = 0
+            if os.path.exists(self.mapping_path):
+                with open(self.mapping_path, "rb") as f:
+                    for raw in f:
+                        if not raw.endswith(b"\n"):
+                            break
+                        self._mapping_offsets.append(offset)
+                        self.mapping.append(json.loads(raw))
+                        offset += len(raw)
+
+            vectors = np.zeros((0, self.dim), dtype="float32")
+            if os.path.exists(self.vectors_path):
+                vectors = np.fromfile(self.vectors_path, dtype="float32")
+                vectors = vectors[: (vectors.size // self.dim) * self.dim].reshape(-1, self.dim)
+
+            # A crash between the two appends can leave one file a row ahead; keep the common prefix
+            rows = min(len(self.mapping), len(vectors))
+            self._mapping_offsets.append(offset)  # end of the last complete line
+            self._truncate_files(rows)
+            del self.mapping[rows:]
+            del self._mapping_offsets[rows:]
+            vectors = vectors[:rows]
+
+            self._build_index(vectors)
+            print(f"[Episodic] Loaded {len(self.mapping)} past exchange(s).")
+        except Exception as e:
+            print(f"[Warning] Could not load episodic index, starting fresh: {e}")
+            self._reset_files()
+
+    def _build_index(self, vectors):
+        import faiss
+        self.index = faiss.IndexFlatIP(self.dim)
+        if len(vectors):
+            self.index.add(np.ascontiguousarray(vectors))
+
+    def _reset_files(self):
+        for path in (self.mapping_path, self.vectors_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.dim = None
+        self.index = None
+        self.mapping = []
+        self._mapping_offsets = []
+
+    def _truncate_files(self, rows):
+        """Cut both files back to their first `rows` entries (no-op when already that size)."""
+        mapping_size = self._mapping_offsets[rows] if rows < len(self._mapping_offsets) else 0
+        for path, size in ((self.mapping_path, mapping_size), (self.vectors_path, rows * self.dim * 4)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    # --- Writes (run on the worker) ---
+    def _add(self, memories):
+        # A live turn can be queued while catch-up is still walking the same range
+        last = self.last_turn_index()
+        memories = [m for m in memories if m["turn_index"] > last]
+        if not memories:
+            return
+        vectors = self.embedder.encode(
+            [m["search_text"] for m in memories], convert_to_numpy=True, normalize_embeddings=True
+        ).astype("float32")
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                atomic_write_json(self.meta_path, {"dim": self.dim, "model": self.model_name})
+                self._build_index(np.zeros((0, self.dim), dtype="float32"))
+
+            offset = os.path.getsize(self.mapping_path) if os.path.exists(self.mapping_path) else 0
+            lines = []
+            for memory in memories:
+                line = (json.dumps(memory, ensure_ascii=False) + "\n").encode("utf-8")
+                self._mapping_offsets.append(offset)
+                offset += len(line)
+                lines.append(line)
+            # Vectors first: on a crash, a vector without its mapping line is dropped on load
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self.mapping_path, "ab") as f:
+                f.write(b"".join(lines))
+            self.index.add(vectors)
+            self.mapping.extend(memories)
+
+    def _catch_up(self, history_store, user_name, bot_name, batch_size=32):
+        start = self.last_turn_index() + 1
+        total = len(history_store)
+        pending = []
+        previous = history_store.get_range(start - 1, start)[0] if start > 0 else None
+        for page_start in range(start, total, history_store.page_size):
+            if self._closed:
+                return
+            for offset, entry in enumerate(history_store.get_range(page_start, page_start + history_store.page_size)):
+                index = page_start + offset
+                if previous and previous.get("role") == "user" and entry.get("role") == "assistant" and index - 1 >= start:
+                    pending.append(exchange_memory(index - 1, user_name, previous.get("content", ""),
+                                                   bot_name, entry.get("content", "")))
+                    if len(pending) >= batch_size:
+                        self._add(pending)
+                        pending = []
+                previous = entry
+        if pending:
+            self._add(pending)
+
+    def _discard_from(self, turn_index):
+        with self._lock:
+            keep = len(self.mapping)
+            while keep and self.mapping[keep - 1].get("turn_index", -1) >= turn_index:
+                keep -= 1
+            if keep == len(self.mapping):
+                return
+            import faiss
+            self._truncate_files(keep)
+            self.index.remove_ids(faiss.IDSelectorRange(keep, self.index.ntotal))
+            del self.mapping[keep:]
+            del self._mapping_offsets[keep:]
+
+    def _run(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"[Episodic] {fn.__name__} failed: {e}")
+
+    # --- Public API ---
+    def add_exchange(self, turn_index, user_name, user_text, bot_name, bot_text):
+        """Queue one finished exchange (turn_index = absolute index of its user message)."""
+        memory = exchange_memory(turn_index, user_name, user_text, bot_name, bot_text)
+        return self._worker.submit(self._run, self._add, [memory])
+
+    def discard_from(self, turn_index):
+        """Queue removal of every exchange whose user message is at turn_index or later."""
+        return self._worker.submit(self._run, self._discard_from, turn_index)
+
+    def last_turn_index(self) -> int:
+        with self._lock:
+            return self.mapping[-1].get("turn_index", -1) if self.mapping else -1
+
+    def catch_up(self, history_store, user_name, bot_name):
+        """Queue indexing of stored exchanges that predate the episodic index (older sessions)."""
+        return self._worker.submit(self._run, self._catch_up, history_store, user_name, bot_name)
+
+    def search(self, query_embedding, k, exclude_from=None):
+        """
+        Returns [(similarity, memory)] for the k best exchanges, skipping those whose
+        user message index is >= exclude_from (still inside the rolling window).
+        """
+        with self._lock:
+            if self.index is None or not self.mapping or k <= 0:
+                return []
+            candidates = len(self.mapping)
+            if exclude_from is not None:
+                # Entries are in turn order, so the excluded ones are a suffix
+                while candidates and self.mapping[candidates - 1].get("turn_index", -1) >= exclude_from:
+                    candidates -= 1
+            if not candidates:
+                return []
+            query = np.ascontiguousarray(query_embedding, dtype="float32").reshape(1, -1)
+            query = query / max(float(np.linalg.norm(query)), 1e-12)
+            # Excluded rows are the newest ones, so over-fetch by that many
+            fetch = min(self.index.ntotal, k + (len(self.mapping) - candidates))
+            D, I = self.index.search(query, fetch)
+            results = []
+            for score, idx in zip(D[0], I[0]):
+                if 0 <= idx < candidates:
+                    results.append((float(score), self.mapping[idx]))
+                if len(results) >= k:
+                    break
+            return results
+
+    def close(self):
+        """Finish queued exchanges (an unfinished catch-up resumes next time the session opens)."""
+        self._closed = True
+        self._worker.shutdown(wait=True)
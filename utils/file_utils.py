@@ -0,0 +1,66 @@
+"""
+file_utils.py
+
+Crash-safe file helpers shared by the session store and the views.
+"""
+import os
+import json
+import time
+
+
+def atomic_write_text(path: str, text: str):
+    """
+    Write `text` to `path` so readers only ever see the old or the new file:
+    write a temp file in the same folder, fsync it, then rename it into place.
+    """
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def atomic_write_json(path: str, data, indent=2):
+    atomic_write_text(path, json.dumps(data, indent=indent, ensure_ascii=False))
+
+
+class AppendLog:
+    """
+    Append-only text file kept open between writes.
+
+    Every write is flushed to the OS (so a crash of the app loses nothing); fsync
+    is batched every `fsync_every` writes or `fsync_interval` seconds, so a power
+    loss loses at most the last batch.
+    """
+
+    def __init__(self, path, fsync_every=8, fsync_interval=5.0):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.fsync_every = max(1, int(fsync_every))
+        self.fsync_interval = fsync_interval
+        self._file = open(path, "a", encoding="utf-8")
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def write(self, text: str):
+        self._file.write(text)
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        if self._file and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file:
+            self.sync()
+            self._file.close()
+            self._file = None
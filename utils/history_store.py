@@ -0,0 +1,370 @@
+"""
+history_store.py
+
+Unbounded, paged, crash-safe conversation history for a session.
+
+Every message is appended as one JSON line to <session>/history.jsonl (the
+journal), so nothing is ever dropped and saving costs O(1) per turn. Appends are
+flushed immediately and fsync'd in batches, so a crash loses at most the last
+batch. Every `snapshot_every` messages (and on close) the page index is compacted
+into history.snapshot.json with an atomic rename, so reopening a long session only
+reads the journal written since the snapshot plus the recent window.
+
+Only the most recent `window_size` messages are kept in memory; older messages
+are read back a page at a time (for scrolling the transcript or summarizing old
+turns) using a sparse index of page start offsets, which keeps RAM constant no
+matter how long the campaign runs.
+
+A record that cannot be decoded (e.g. garbage left by a crash between batched
+fsyncs) is logged and skipped rather than making the session unopenable; it is
+not counted, so message indices stay consistent with what can be read.
+"""
+import os
+import json
+import time
+import zlib
+import threading
+from collections import OrderedDict, deque
+
+from utils.file_utils import atomic_write_json
+
+HISTORY_FILE = "history.jsonl"
+SNAPSHOT_FILE = "history.snapshot.json"
+DEFAULT_WINDOW_SIZE = 1000
+DEFAULT_PAGE_SIZE = 50
+
+
+def _decode_record(raw, offset):
+    """One journal line as a message dict, or None (logged) if it is corrupt."""
+    try:
+        entry = json.loads(raw)
+    except (ValueError, UnicodeDecodeError) as e:
+        print(f"[History] Skipping unreadable record at byte {offset}: {e}")
+        return None
+    if not isinstance(entry, dict):
+        print(f"[History] Skipping malformed record at byte {offset}.")
+        return None
+    return entry
+
+
+class HistoryStore:
+    def __init__(self, session_dir, window_size=DEFAULT_WINDOW_SIZE, page_size=DEFAULT_PAGE_SIZE,
+                 cached_pages=4, fsync_every=8, fsync_interval=5.0, snapshot_every=100):
+        self.session_dir = session_dir
+        self.path = os.path.join(session_dir, HISTORY_FILE)
+        self.snapshot_path = os.path.join(session_dir, SNAPSHOT_FILE)
+        self.window_size = max(1, int(window_size))
+        self.page_size = max(1, int(page_size))
+        self.cached_pages = cached_pages
+        self.fsync_every = max(1, int(fsync_every))
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = max(1, int(snapshot_every))
+
+        self.count = 0
+        self._size = 0                                    # bytes of complete records in the journal
+        self._page_offsets = []                           # byte offset of every page_size-th message
+        self._recent = deque(maxlen=self.window_size)     # newest messages
+        self._recent_offsets = deque(maxlen=self.window_size)
+        self._page_cache = OrderedDict()
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._since_snapshot = 0
+        self._snapshot_size = 0                           # journal bytes covered by the snapshot
+        # Turns append from worker threads while the transcript pages in from the Tk thread
+        self._lock = threading.RLock()
+
+        os.makedirs(session_dir, exist_ok=True)
+        self._migrate_chat_json()
+        self._open()
+        self._file = open(self.path, "ab")
+
+    # --- Setup ---
+    def _migrate_chat_json(self):
+        """Sessions saved before history.jsonl existed keep their history in chat.json."""
+        if os.path.exists(self.path):
+            return
+        chat_path = os.path.join(self.session_dir, "chat.json")
+        history = []
+        if os.path.exists(chat_path):
+            try:
+                with open(chat_path, "r", encoding="utf-8") as f:
+                    history = json.load(f).get("conversation_history", [])
+            except Exception as e:
+                print(f"[Warning] Could not migrate chat.json history: {e}")
+        with open(self.path, "w", encoding="utf-8") as f:
+            for entry in history:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if history:
+            print(f"[History] Migrated {len(history)} message(s) from chat.json")
+
+    def _open(self):
+        """Restore the page index from the snapshot (if valid), index the journal tail, fill the window."""
+        if not self._load_snapshot():
+            self.count = 0
+            self._size = 0
+            self._page_offsets = []
+            self._snapshot_size = 0
+        self._index_tail()
+        self._fill_recent()
+
+    def _load_snapshot(self) -> bool:
+        if not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snap = json.load(f)
+            if snap.get("page_size") != self.page_size:
+                return False
+            size = int(snap["size"])
+            last_offset = int(snap["last_offset"])
+            if os.path.getsize(self.path) < size:
+                return False
+            # The last record the snapshot covers must still be byte-for-byte the same
+            with open(self.path, "rb") as f:
+                f.seek(last_offset)
+                if zlib.crc32(f.read(size - last_offset)) != snap["last_crc"]:
+                    return False
+            self.count = int(snap["count"])
+            self._size = size
+            self._page_offsets = list(snap["page_offsets"])
+            self._snapshot_size = size
+            return True
+        except Exception as e:
+            print(f"[History] Ignoring unusable snapshot: {e}")
+            return False
+
+    def _index_tail(self):
+        """Index records after the snapshot (the whole journal without one)."""
+        with open(self.path, "rb") as f:
+            f.seek(self._size)
+            offset = self._size
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # torn final write
+                if raw.strip() and _decode_record(raw, offset) is not None:
+                    if self.count % self.page_size == 0:
+                        self._page_offsets.append(offset)
+                    self.count += 1
+                offset += len(raw)
+                self._size = offset
+
+        if os.path.getsize(self.path) > self._size:
+            # Drop the incomplete trailing record so the next append starts on a clean line
+            with open(self.path, "r+b") as fix:
+                fix.truncate(self._size)
+            print("[History] Dropped incomplete trailing record.")
+
+    def _fill_recent(self):
+        """Decode the newest window_size messages, reading from the nearest page boundary."""
+        self._recent.clear()
+        self._recent_offsets.clear()
+        if not self.count:
+            return
+        first = max(0, self.count - self.window_size)
+        page_no = first // self.page_size
+        index = page_no * self.page_size
+        offset = self._page_offsets[page_no]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while index < self.count:
+                raw = f.readline()
+                if not raw:
+                    break
+                entry = _decode_record(raw, offset) if raw.strip() else None
+                if entry is not None:
+                    if index >= first:
+                        self._recent.append(entry)
+                        self._recent_offsets.append(offset)
+                    index += 1
+                offset += len(raw)
+
+    # --- Durability ---
+    def sync(self):
+        """fsync every record appended so far."""
+        if self._file and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def compact(self):
+        """Sync the journal and atomically replace the snapshot of the page index."""
+        with self._lock:
+            self.sync()
+            last_offset = self._recent_offsets[-1] if self._recent_offsets else 0
+            with open(self.path, "rb") as f:
+                f.seek(last_offset)
+                last_crc = zlib.crc32(f.read(self._size - last_offset))
+            atomic_write_json(self.snapshot_path, {
+                "count": self.count,
+                "size": self._size,
+                "page_size": self.page_size,
+                "page_offsets": self._page_offsets,
+                "last_offset": last_offset,
+                "last_crc": last_crc,
+            }, indent=None)
+            self._snapshot_size = self._size
+            self._since_snapshot = 0
+
+    # --- Writes ---
+    def append(self, entry: dict):
+        with self._lock:
+            self._invalidate_pages_from(self.count)
+            offset = self._size
+            if self.count % self.page_size == 0:
+                self._page_offsets.append(offset)
+            data = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+            self._recent.append(entry)
+            self._recent_offsets.append(offset)
+            self.count += 1
+
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self.sync()
+            self._since_snapshot += 1
+            if self._since_snapshot >= self.snapshot_every:
+                self.compact()
+
+    def truncate(self, length: int):
+        """Drop every message at index >= length. Only the in-memory window can be dropped."""
+        with self._lock:
+            drop = self.count - length
+            if drop <= 0:
+                return
+            if drop > len(self._recent):
+                raise ValueError("Can only truncate messages inside the in-memory window.")
+
+            cut_offset = self._recent_offsets[-drop]
+            for _ in range(drop):
+                self._recent.pop()
+                self._recent_offsets.pop()
+            self.count = length
+            self._size = cut_offset
+            del self._page_offsets[(length + self.page_size - 1) // self.page_size:]
+            self._invalidate_pages_from(length)
+
+            self._file.flush()
+            self._file.truncate(cut_offset)
+            self._unsynced += 1
+
+            if not self._recent and self.count:
+                # Window emptied out; refill it from disk
+                self._fill_recent()
+            if cut_offset < self._snapshot_size:
+                # The snapshot describes records that no longer exist
+                self.compact()
+
+    def pop_last(self) -> dict | None:
+        with self._lock:
+            if not self.count:
+                return None
+            entry = self._recent[-1]
+            self.truncate(self.count - 1)
+            return entry
+
+    def rewrite_from(self, index: int, entries: list):
+        """Replace messages [index:] with `entries` (e.g. after editing a recent reply)."""
+        with self._lock:
+            self.truncate(index)
+            for entry in entries:
+                self.append(entry)
+
+    def flush(self):
+        if self._file:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self.compact()
+                self._file.close()
+                self._file = None
+
+    # --- Reads ---
+    def __len__(self):
+        return self.count
+
+    @property
+    def window_start(self) -> int:
+        """Absolute index of the oldest message held in memory."""
+        return self.count - len(self._recent)
+
+    def recent(self) -> list:
+        with self._lock:
+            return list(self._recent)
+
+    def _invalidate_pages_from(self, index):
+        first_page = index // self.page_size
+        for page_no in [p for p in self._page_cache if p >= first_page]:
+            del self._page_cache[page_no]
+
+    def load_page(self, page_no: int) -> list:
+        """Messages [page_no * page_size, (page_no + 1) * page_size), read from disk."""
+        with self._lock:
+            if page_no < 0 or page_no >= len(self._page_offsets):
+                return []
+            if page_no in self._page_cache:
+                self._page_cache.move_to_end(page_no)
+                return self._page_cache[page_no]
+
+            self.flush()
+            wanted = min(self.page_size, self.count - page_no * self.page_size)
+            page = []
+            with open(self.path, "rb") as f:
+                offset = self._page_offsets[page_no]
+                f.seek(offset)
+                while len(page) < wanted:
+                    line = f.readline()
+                    if not line:
+                        break
+                    entry = _decode_record(line, offset) if line.strip() else None
+                    if entry is not None:
+                        page.append(entry)
+                    offset += len(line)
+
+            self._page_cache[page_no] = page
+            while len(self._page_cache) > self.cached_pages:
+                self._page_cache.popitem(last=False)
+            return page
+
+    def get_range(self, start: int, stop: int) -> list:
+        """Messages [start:stop] by absolute index, from memory when possible."""
+        with self._lock:
+            start = max(0, start)
+            stop = min(self.count, stop)
+            if start >= stop:
+                return []
+
+            window_start = self.window_start
+            if start >= window_start:
+                recent = self._recent
+                return [recent[i - window_start] for i in range(start, stop)]
+
+            out = []
+            index = start
+            while index < stop:
+                if index >= window_start:
+                    out.extend(self.get_range(index, stop))
+                    break
+                page_no = index // self.page_size
+                page = self.load_page(page_no)
+                page_start = page_no * self.page_size
+                take_to = min(stop, page_start + len(page))
+                out.extend(page[index - page_start:take_to - page_start])
+                if take_to <= index:
+                    break
+                index = take_to
+            return out
+
+    def iter_pages(self, stop: int | None = None):
+        """Yield (start_index, messages) page by page, oldest first, up to `stop`."""
+        stop = self.count if stop is None else min(stop, self.count)
+        for page_no in range((stop + self.page_size - 1) // self.page_size):
+            start = page_no * self.page_size
+            yield start, self.get_range(start, min(stop, start + self.page_size))
@@ -0,0 +1,142 @@
+"""
+history_window.py
+
+Token-budgeted rolling history window.
+
+Each history entry carries its own "token_count" (set once, when the entry is
+appended), and TokenBudgetWindow keeps running cumulative sums over those counts.
+Picking the newest slice of history that fits a token budget is then a binary
+search instead of re-tokenizing and walking the whole history on every turn.
+"""
+from bisect import bisect_left
+from utils.token_utils import count_tokens, count_tokens_many
+
+
+def history_entry(role: str, content: str) -> dict:
+    """Create a conversation history entry with its token count attached."""
+    return {"role": role, "content": content, "token_count": count_tokens(content or "")}
+
+
+def update_entry_content(entry: dict, content: str):
+    """Replace an entry's content (e.g. after an edit) and refresh its token count."""
+    entry["content"] = content
+    entry["token_count"] = count_tokens(content or "")
+
+
+def ensure_token_counts(history: list):
+    """Fill in token_count for entries saved before counts were stored (one batched count)."""
+    missing = [e for e in history if not isinstance(e.get("token_count"), int)]
+    if not missing:
+        return
+    counts = count_tokens_many([e.get("content", "") or "" for e in missing])
+    for entry, count in zip(missing, counts):
+        entry["token_count"] = count
+
+
+class TokenBudgetWindow:
+    """
+    Cumulative token counts aligned with a conversation history list.
+
+    sync() only does work for entries appended or removed since the last call.
+    Dropping the oldest entries in place (the in-memory history is a bounded
+    window over the on-disk store) just advances an offset. A different list
+    object (e.g. a freshly loaded session) triggers a rebuild from the stored
+    per-entry counts, which needs no tokenization.
+    """
+
+    # How far the oldest entry may have moved before we give up and rebuild
+    MAX_FRONT_SHIFT = 16
+
+    def __init__(self):
+        self._cumulative = [0]   # _cumulative[i] = tokens in entries[:i]
+        self._counts = []
+        self._entries = []
+        self._offset = 0         # entries dropped from the front of the history
+        self._history_id = None
+
+    def _rebuild(self, history):
+        self._cumulative = [0]
+        self._counts = []
+        self._entries = []
+        self._offset = 0
+        self._history_id = id(history)
+        self._extend(history, 0)
+
+    def _extend(self, history, start):
+        new_entries = history[start:]
+        ensure_token_counts(new_entries)
+        total = self._cumulative[-1]
+        for entry in new_entries:
+            count = entry["token_count"]
+            total += count
+            self._counts.append(count)
+            self._entries.append(entry)
+            self._cumulative.append(total)
+
+    def _truncate(self, length):
+        cut = self._offset + length
+        del self._counts[cut:]
+        del self._entries[cut:]
+        del self._cumulative[cut + 1:]
+
+    def _advance_front(self, history) -> bool:
+        first = history[0]
+        limit = min(len(self._entries), self._offset + self.MAX_FRONT_SHIFT + 1)
+        for k in range(self._offset, limit):
+            if self._entries[k] is first:
+                self._offset = k
+                if self._offset > 1024 and self._offset * 2 > len(self._entries):
+                    # Compact occasionally so the arrays stay proportional to the window
+                    del self._counts[:self._offset]
+                    del self._entries[:self._offset]
+                    del self._cumulative[:self._offset]
+                    self._offset = 0
+                return True
+        return False
+
+    def sync(self, history: list):
+        """Bring the sums in line with `history`. O(changed entries) in the common case."""
+        if id(history) != self._history_id or not history:
+            self._rebuild(history)
+            return
+        if self._offset >= len(self._entries) or self._entries[self._offset] is not history[0]:
+            if not self._advance_front(history):
+                self._rebuild(history)
+                return
+
+        n = len(self._counts) - self._offset
+        if len(history) < n:
+            self._truncate(len(history))
+            n = len(history)
+
+        # Edits only ever touch the newest entries; re-check the last two
+        for i in range(max(0, n - 2), n):
+            if history[i].get("token_count") != self._counts[self._offset + i]:
+                self._truncate(i)
+                n = i
+                break
+
+        if len(history) > n:
+            self._extend(history, n)
+
+    @property
+    def total_tokens(self) -> int:
+        return self._cumulative[-1] - self._cumulative[self._offset]
+
+    def suffix_tokens(self, start: int) -> int:
+        """Tokens in history[start:]."""
+        return self._cumulative[-1] - self._cumulative[self._offset + start]
+
+    def window_start(self, history: list, available_tokens: int) -> int:
+        """
+        Index of the oldest entry in the newest slice of `history` that fits in
+        `available_tokens`. The newest entry is always included, even if it alone
+        exceeds the budget.
+        """
+        self.sync(history)
+        n = len(self._counts) - self._offset
+        if n == 0:
+            return 0
+        # Smallest j with total - cumulative[j] <= available
+        j = bisect_left(self._cumulative, self._cumulative[-1] - available_tokens, lo=self._offset)
+        return min(j - self._offset, n - 1)
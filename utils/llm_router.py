@@ -0,0 +1,352 @@
+"""
+llm_router.py
+
+Spreads LLM calls over a pool of OpenAI-compatible endpoints.
+
+Configured with "llm_endpoints" in config/advanced_settings.json; without it
+every call goes to the single "llm_url", as before:
+
+    "llm_endpoints": [
+        {"url": "http://localhost:1234/v1/chat/completions", "roles": ["reply"]},
+        {"url": "http://localhost:1235/v1/chat/completions", "roles": ["summary"],
+         "model": "qwen2.5-1.5b-instruct"}
+    ]
+
+Roles are "reply" (final generation and Try Again candidates) and "summary"
+(the rolling-history and memory summarizers), so the cheap summaries don't
+queue behind the expensive reply. An endpoint without "roles" serves both, and
+its "model" (if set) replaces the payload's model name.
+
+Each call goes to the endpoint for its role with the fewest requests in flight.
+Retryable failures (connection errors, timeouts, 408/429/5xx) fail over to the
+next endpoint; once every endpoint has failed, the call is retried up to
+MAX_ATTEMPTS rounds with jittered exponential backoff (honouring Retry-After),
+within the turn's deadline. Each endpoint has a circuit breaker: after
+BREAKER_THRESHOLD consecutive failures it is skipped for BREAKER_COOLDOWN
+seconds, then a single trial request decides whether it is back. With several
+endpoints a background probe (GET <base>/models every HEALTH_INTERVAL seconds)
+also reopens recovered servers early.
+"""
+import json
+import time
+import random
+import threading
+
+import requests
+
+from utils.api_utils import (
+    request_llm, stream_llm_api, _call_with_n,
+    LLMError, LLMHTTPError, LLMCancelled, LLMDeadlineExceeded, CircuitOpenError,
+)
+
+ROLES = ("reply", "summary")
+HEALTH_INTERVAL = 30
+PROBE_TIMEOUT = 3
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 30.0
+
+
+class CircuitBreaker:
+    """closed -> (threshold failures) -> open -> (cooldown) -> half_open -> one trial -> closed/open."""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow(self, now) -> bool:
+        if self.state == "open" and now - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+            self._trial_in_flight = False
+        if self.state == "half_open":
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+        return self.state == "closed"
+
+    def success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def failure(self, now):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.threshold:
+            self.state = "open"
+            self.opened_at = now
+
+    def release(self):
+        # The request ended without saying anything about the server (e.g. cancelled)
+        self._trial_in_flight = False
+
+
+class Endpoint:
+    def __init__(self, url, roles=None, model=None):
+        self.url = url.strip()
+        self.roles = set(roles or ROLES)
+        self.model = model
+        self.outstanding = 0
+        self.last_used = 0.0
+        self.breaker = CircuitBreaker()
+
+    @property
+    def healthy(self):
+        return self.breaker.state != "open"
+
+    @property
+    def models_url(self):
+        # .../v1/chat/completions -> .../v1/models
+        for suffix in ("/chat/completions", "/completions"):
+            if self.url.endswith(suffix):
+                return self.url[: -len(suffix)] + "/models"
+        return self.url
+
+    def prepare(self, payload):
+        if not self.model:
+            return payload
+        payload = dict(payload)
+        payload["model"] = self.model
+        return payload
+
+    def __repr__(self):
+        return f"Endpoint({self.url}, roles={sorted(self.roles)}, breaker={self.breaker.state}, outstanding={self.outstanding})"
+
+
+class LLMRouter:
+    def __init__(self, endpoints, health_interval=HEALTH_INTERVAL):
+        self.endpoints = endpoints
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._prober = None
+        if len(endpoints) > 1 and health_interval:
+            self._prober = threading.Thread(target=self._probe_loop, name="llm-health", daemon=True)
+            self._prober.start()
+
+    @classmethod
+    def from_settings(cls, llm_url, endpoints=None):
+        pool = []
+        for spec in endpoints or []:
+            if isinstance(spec, str):
+                spec = {"url": spec}
+            if not isinstance(spec, dict) or not spec.get("url"):
+                print(f"[Router] Ignoring invalid endpoint entry: {spec!r}")
+                continue
+            roles = [r for r in spec.get("roles") or ROLES if r in ROLES]
+            pool.append(Endpoint(spec["url"], roles or ROLES, spec.get("model")))
+        if not pool:
+            pool.append(Endpoint(llm_url or "http://localhost:1234/v1/chat/completions"))
+        return cls(pool)
+
+    # --- Dispatch ---
+    def _candidates_for(self, role):
+        """Endpoints to try for `role`, best first: closed breaker, fewest in flight, least recently used."""
+        with self._lock:
+            serving = [e for e in self.endpoints if role in e.roles] or list(self.endpoints)
+            return sorted(serving, key=lambda e: (not e.healthy, e.outstanding, e.last_used))
+
+    def _begin(self, endpoint) -> bool:
+        """Reserve a request on `endpoint`, unless its circuit breaker refuses it."""
+        with self._lock:
+            now = time.monotonic()
+            if not endpoint.breaker.allow(now):
+                return False
+            endpoint.outstanding += 1
+            endpoint.last_used = now
+            return True
+
+    def _end(self, endpoint, error=None, verdict=True):
+        with self._lock:
+            endpoint.outstanding -= 1
+            breaker = endpoint.breaker
+            if not verdict or isinstance(error, (LLMCancelled, LLMDeadlineExceeded)):
+                breaker.release()
+            elif error is None or (isinstance(error, LLMHTTPError) and not error.retryable):
+                # The server answered, even if it rejected this request
+                breaker.success()
+            elif error.retryable:
+                was_open = breaker.state == "open"
+                breaker.failure(time.monotonic())
+                if breaker.state == "open" and not was_open:
+                    print(f"[Router] {endpoint.url} failed {breaker.failures}x ({str(error)[:80]}); "
+                          f"pausing it for {breaker.cooldown:.0f}s.")
+            else:
+                breaker.release()
+
+    def _backoff(self, role, attempt, error, cancel):
+        """Sleep before retry round `attempt` (full jitter, at least Retry-After), within the deadline."""
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after:
+            delay = max(delay, min(retry_after, BACKOFF_MAX))
+        print(f"[Router] {role} call failed ({str(error)[:80]}); retrying in {delay:.1f}s "
+              f"(attempt {attempt + 1}/{MAX_ATTEMPTS}).")
+        if cancel is None:
+            time.sleep(delay)
+            return
+        remaining = cancel.remaining()
+        if remaining is not None and remaining <= delay:
+            raise LLMDeadlineExceeded(getattr(error, "url", None))
+        if cancel.wait(delay):
+            raise LLMCancelled(getattr(error, "url", None))
+
+    def call(self, role, payload, cancel=None):
+        """
+        One completion for `role`: the reply text, or the last LLMError once failover,
+        retries and the deadline are exhausted. Non-retryable errors are raised at once.
+        """
+        error = None
+        for attempt in range(MAX_ATTEMPTS):
+            if attempt:
+                self._backoff(role, attempt, error, cancel)
+            tried = False
+            for endpoint in self._candidates_for(role):
+                if not self._begin(endpoint):
+                    continue
+                tried = True
+                try:
+                    reply = request_llm(endpoint.url, endpoint.prepare(payload), cancel)
+                except LLMError as e:
+                    self._end(endpoint, e)
+                    if not e.retryable:
+                        raise
+                    error = e
+                    continue
+                self._end(endpoint)
+                return reply
+            if not tried:
+                error = CircuitOpenError(f"[Error] Every LLM endpoint for '{role}' is failing; "
+                                         f"they are paused for up to {BREAKER_COOLDOWN:.0f}s.")
+        raise error
+
+    def candidates(self, role, payload, n, use_n=True, cancel=None):
+        """
+        Like api_utils.call_llm_candidates: one `n` request goes to the least busy
+        endpoint. If it fails, is rejected or returns nothing, the endpoint is released
+        and exactly one call() fetches a single reply with the usual retries and failover.
+        """
+        endpoint = None
+        if n > 1 and use_n:
+            endpoint = next((e for e in self._candidates_for(role) if self._begin(e)), None)
+        replies = []
+        if endpoint is not None:
+            try:
+                replies = _call_with_n(endpoint.url, endpoint.prepare(payload), n, cancel)
+            except LLMError as e:
+                self._end(endpoint, e)
+                if isinstance(e, (LLMCancelled, LLMDeadlineExceeded)):
+                    raise
+                reason = "failed" if e.retryable else "was rejected"
+                print(f"[Router] {role} request for {n} choices {reason} ({str(e)[:80]}); asking for one reply.")
+            else:
+                self._end(endpoint)
+        if replies:
+            return replies[:n]
+        return [self.call(role, payload, cancel)]
+
+    def stream(self, role, payload, cancel=None, meter=None):
+        """
+        Streamed completion for `role`; fails over only while nothing has been yielded
+        yet, and raises an LLMError if no endpoint could start the stream. A CallMeter
+        collects the usage of the stream that succeeds.
+        """
+        error = CircuitOpenError(f"[Error] Every LLM endpoint for '{role}' is failing; "
+                                 f"they are paused for up to {BREAKER_COOLDOWN:.0f}s.")
+        for endpoint in self._candidates_for(role):
+            if cancel is not None:
+                cancel.check(endpoint.url)
+            if not self._begin(endpoint):
+                continue
+            if meter is not None:
+                meter.url = endpoint.url
+            yielded = False
+            try:
+                for delta in stream_llm_api(endpoint.url, endpoint.prepare(payload), cancel, meter):
+                    yielded = True
+                    yield delta
+            except LLMError as e:
+                self._end(endpoint, e)
+                if yielded or not e.retryable:
+                    raise
+                error = e
+                continue
+            except BaseException:
+                # The consumer stopped reading (or crashed); says nothing about the server
+                self._end(endpoint, verdict=False)
+                raise
+            self._end(endpoint)
+            return
+        raise error
+
+    # --- Health ---
+    def probe(self):
+        """
+        Check every idle endpoint once (GET <base>/models). A paused server that answers
+        gets its trial early; a failed probe counts as one failure towards its breaker.
+        Endpoints with requests in flight are skipped: a busy single-slot server may
+        simply be too slow to answer, and its real requests already report failures.
+        """
+        for endpoint in list(self.endpoints):
+            with self._lock:
+                if endpoint.outstanding > 0:
+                    continue
+            try:
+                response = requests.get(endpoint.models_url, timeout=PROBE_TIMEOUT)
+                up = response.status_code < 500
+            except Exception:
+                up = False
+            with self._lock:
+                breaker = endpoint.breaker
+                if up and breaker.state == "open":
+                    print(f"[Router] {endpoint.url} answers again; sending it a trial request.")
+                    breaker.state = "half_open"
+                    breaker.release()
+                elif not up and breaker.state == "closed":
+                    breaker.failure(time.monotonic())
+                    if breaker.state == "open":
+                        print(f"[Router] {endpoint.url} failed {breaker.failures}x, the last a health check; "
+                              f"pausing it for {breaker.cooldown:.0f}s.")
+
+    def _probe_loop(self):
+        while not self._stop.wait(self.health_interval):
+            self.probe()
+
+    def status(self) -> list:
+        with self._lock:
+            return [
+                {"url": e.url, "roles": sorted(e.roles), "model": e.model, "breaker": e.breaker.state,
+                 "outstanding": e.outstanding, "failures": e.breaker.failures}
+                for e in self.endpoints
+            ]
+
+    def close(self):
+        self._stop.set()
+
+
+_router = None
+_router_key = None
+_router_lock = threading.Lock()
+
+
+def get_llm_router(llm_url, endpoints=None) -> LLMRouter:
+    """Process-wide router for the current settings; rebuilt when the endpoint settings change."""
+    global _router, _router_key
+    key = json.dumps([llm_url, endpoints], sort_keys=True, default=str)
+    with _router_lock:
+        if _router is None or key != _router_key:
+            if _router is not None:
+                _router.close()
+            _router = LLMRouter.from_settings(llm_url, endpoints)
+            _router_key = key
+            if len(_router.endpoints) > 1:
+                print(f"[Router] {len(_router.endpoints)} LLM endpoints: "
+                      + ", ".join(f"{e.url} ({'/'.join(sorted(e.roles))})" for e in _router.endpoints))
+        return _router
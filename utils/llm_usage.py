@@ -0,0 +1,178 @@
+"""
+llm_usage.py
+
+Token usage and timing of LLM calls, for sizing the backend.
+
+request_llm returns an LLMResult: the reply text (a str, so callers that only
+want the text are unchanged) plus what the call cost: prompt/completion tokens
+from the OpenAI "usage" block, the model that answered, total latency and time
+to first token. Streamed requests ask for usage with stream_options; when the
+server also sends llama.cpp-style "timings", its own prefill and decode times
+are used instead of the client-side clock.
+
+A UsageTracker adds results up per stage (history summary, memory summary,
+final reply, background alternatives) for the current turn and the session.
+"""
+import time
+import threading
+
+STAGES = ("history_summary", "memory_summary", "reply", "alternatives")
+STAGE_LABELS = {
+    "history_summary": "History Summary",
+    "memory_summary": "Memory Summary",
+    "reply": "Final Reply",
+    "alternatives": "Try Again Alternatives",
+}
+
+
+class LLMResult(str):
+    """A reply's text, with the usage and timing of the request that produced it."""
+
+    def __new__(cls, text, model=None, usage=None, latency=None, ttft=None, timings=None, url=None):
+        result = super().__new__(cls, text or "")
+        result.model = model
+        result.usage = usage or {}
+        result.latency = latency
+        result.ttft = ttft
+        result.timings = timings or {}
+        result.url = url
+        return result
+
+    @property
+    def prompt_tokens(self):
+        return self.usage.get("prompt_tokens")
+
+    @property
+    def completion_tokens(self):
+        return self.usage.get("completion_tokens")
+
+    @property
+    def prefill_seconds(self):
+        """Time spent reading the prompt: the server's own figure, else time to first token."""
+        if self.timings.get("prompt_ms") is not None:
+            return self.timings["prompt_ms"] / 1000
+        return self.ttft
+
+    @property
+    def decode_seconds(self):
+        """Time spent generating after the first token."""
+        if self.timings.get("predicted_ms") is not None:
+            return self.timings["predicted_ms"] / 1000
+        if self.latency is not None and self.ttft is not None:
+            return max(0.0, self.latency - self.ttft)
+        return None
+
+    def as_dict(self) -> dict:
+        return {
+            "model": self.model,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "latency": self.latency,
+            "ttft": self.ttft,
+            "prefill_seconds": self.prefill_seconds,
+            "decode_seconds": self.decode_seconds,
+        }
+
+
+class CallMeter:
+    """Times one request and collects the model/usage/timings fields the server sends back."""
+
+    def __init__(self, url=None):
+        self.url = url
+        self.started = time.monotonic()
+        self.first_at = None
+        self.model = None
+        self.usage = None
+        self.timings = None
+
+    def first_token(self):
+        if self.first_at is None:
+            self.first_at = time.monotonic()
+
+    def observe(self, data):
+        """Pick usage fields out of a JSON reply or one streamed chunk (usage comes in the last one)."""
+        if not isinstance(data, dict):
+            return
+        if data.get("model"):
+            self.model = data["model"]
+        if isinstance(data.get("usage"), dict):
+            self.usage = data["usage"]
+        if isinstance(data.get("timings"), dict):
+            self.timings = data["timings"]
+
+    def result(self, text) -> LLMResult:
+        ttft = self.first_at - self.started if self.first_at is not None else None
+        return LLMResult(
+            text, self.model, self.usage, time.monotonic() - self.started, ttft, self.timings, self.url
+        )
+
+
+def _empty_bucket():
+    return {
+        "calls": 0, "unreported": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency": 0.0,
+        "prefill_tokens": 0, "prefill_seconds": 0.0, "decode_tokens": 0, "decode_seconds": 0.0,
+        "models": [],
+    }
+
+
+def _add(bucket, result):
+    bucket["calls"] += 1
+    bucket["latency"] += result.latency or 0.0
+    if result.model and result.model not in bucket["models"]:
+        bucket["models"].append(result.model)
+    prompt, completion = result.prompt_tokens, result.completion_tokens
+    if prompt is None and completion is None:
+        bucket["unreported"] += 1
+        return
+    bucket["prompt_tokens"] += prompt or 0
+    bucket["completion_tokens"] += completion or 0
+    # Throughput only from calls whose tokens and times are both known
+    if prompt and result.prefill_seconds:
+        bucket["prefill_tokens"] += prompt
+        bucket["prefill_seconds"] += result.prefill_seconds
+    if completion and result.decode_seconds:
+        bucket["decode_tokens"] += completion
+        bucket["decode_seconds"] += result.decode_seconds
+
+
+class UsageTracker:
+    """Per-stage LLM usage of the current turn and of the whole session. Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.turns = 0
+            self.turn = {}
+            self.session = {}
+
+    def begin_turn(self):
+        with self._lock:
+            self.turns += 1
+            self.turn = {}
+
+    def record(self, stage, result):
+        """Count `result` under `stage`; anything that isn't an LLMResult is ignored."""
+        if not isinstance(result, LLMResult):
+            return
+        with self._lock:
+            for stages in (self.turn, self.session):
+                _add(stages.setdefault(stage, _empty_bucket()), result)
+                _add(stages.setdefault("total", _empty_bucket()), result)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "turns": self.turns,
+                "turn": {k: dict(v, models=list(v["models"])) for k, v in self.turn.items()},
+                "session": {k: dict(v, models=list(v["models"])) for k, v in self.session.items()},
+            }
+
+
+def throughput(bucket):
+    """(prefill tokens/s, decode tokens/s) of a usage bucket; None where nothing was measured."""
+    prefill = bucket["prefill_tokens"] / bucket["prefill_seconds"] if bucket.get("prefill_seconds") else None
+    decode = bucket["decode_tokens"] / bucket["decode_seconds"] if bucket.get("decode_seconds") else None
+    return prefill, decode
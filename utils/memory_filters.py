@@ -0,0 +1,172 @@
+"""
+memory_filters.py
+
+Structured memory attributes and search-time filtering.
+
+The finalizer stores each memory's perspective, importance and source folder
+(the top-level folder under Personal_Memories, e.g. "Chamber of Secrets") as
+small integer arrays in memory_attributes.npz, row-aligned with the FAISS index.
+A filter such as {"perspective": ["Lore"], "source_folder": ["Chamber of Secrets"]}
+(from the scenario's "memory_filter") is turned into the matching ids once, and
+FAISS only scores those rows instead of the whole bank.
+"""
+import os
+import re
+
+import numpy as np
+
+ATTRIBUTES_FILE = "memory_attributes.npz"
+
+PERSPECTIVES = ("Unknown", "First Hand", "Second Hand", "Lore")
+IMPORTANCE_LEVELS = ("Unknown", "Low", "Medium", "High")
+FILTER_KEYS = ("perspective", "importance", "source_folder")
+
+
+def normalize_perspective(value) -> str:
+    """Map free-form perspective text onto PERSPECTIVES ('Unknown' if it matches none)."""
+    v = str(value or "").strip().lower()
+    if "first" in v:
+        return "First Hand"
+    if "second" in v:
+        return "Second Hand"
+    if "lore" in v:
+        return "Lore"
+    return "Unknown"
+
+
+def memory_perspective(memory: dict) -> str:
+    """
+    Perspective of a mapping entry: the structured field written by the finalizer,
+    else the [PERSPECTIVE: ...] header of prompt_text (characters finalized earlier).
+    """
+    for key in ("perspective", "__perspective__", "Perspective", "PERSPECTIVE"):
+        val = memory.get(key)
+        if isinstance(val, str) and val.strip():
+            perspective = normalize_perspective(val)
+            if perspective != "Unknown":
+                return perspective
+
+    m = re.search(r"\[PERSPECTIVE:\s*([^\]]+)\]", memory.get("prompt_text") or "", flags=re.IGNORECASE)
+    return normalize_perspective(m.group(1)) if m else "Unknown"
+
+
+def _importance_code(value) -> int:
+    v = str(value or "").strip().lower()
+    for code, level in enumerate(IMPORTANCE_LEVELS):
+        if v == level.lower():
+            return code
+    return 0
+
+
+class MemoryAttributes:
+    """Per-memory attribute codes, row i describing FAISS id i."""
+
+    def __init__(self, perspective, importance, source, sources):
+        self.perspective = np.asarray(perspective, dtype="int8")
+        self.importance = np.asarray(importance, dtype="int8")
+        self.source = np.asarray(source, dtype="int16")
+        self.sources = [str(s) for s in sources]   # source code -> folder name
+
+    def __len__(self):
+        return len(self.perspective)
+
+    @classmethod
+    def from_mapping(cls, memory_mapping):
+        sources = [""]
+        source_codes = {"": 0}
+        perspective, importance, source = [], [], []
+        for memory in memory_mapping:
+            perspective.append(PERSPECTIVES.index(memory_perspective(memory)))
+            importance.append(_importance_code(memory.get("importance")))
+            folder = memory.get("source_folder") or ""
+            if folder not in source_codes:
+                source_codes[folder] = len(sources)
+                sources.append(folder)
+            source.append(source_codes[folder])
+        return cls(perspective, importance, source, sources)
+
+    @classmethod
+    def load(cls, character_path, memory_mapping):
+        """Read memory_attributes.npz, rebuilding from the mapping if it is missing or stale."""
+        path = os.path.join(character_path, ATTRIBUTES_FILE)
+        if os.path.exists(path):
+            try:
+                with np.load(path, allow_pickle=False) as data:
+                    attributes = cls(data["perspective"], data["importance"], data["source"], data["sources"])
+                if len(attributes) == len(memory_mapping):
+                    return attributes
+                print(f"[Warning] {ATTRIBUTES_FILE} does not match the memory mapping; rebuilding it.")
+            except Exception as e:
+                print(f"[Warning] Could not read {path}: {e}")
+        return cls.from_mapping(memory_mapping)
+
+    def save(self, path):
+        np.savez(
+            path,
+            perspective=self.perspective,
+            importance=self.importance,
+            source=self.source,
+            sources=np.array(self.sources, dtype=str),
+        )
+
+    def select_ids(self, memory_filter):
+        """
+        Ids matching `memory_filter` ({attribute: value or [values]}; values of one
+        attribute are OR-ed, attributes AND-ed). Returns None when nothing is filtered.
+        """
+        if not memory_filter:
+            return None
+        mask = np.ones(len(self), dtype=bool)
+        filtered = False
+        for key, values in memory_filter.items():
+            if key not in FILTER_KEYS:
+                print(f"[Memory Retrieval] Ignoring unknown memory_filter key: {key}")
+                continue
+            if isinstance(values, str):
+                values = [values]
+            if not values:
+                continue
+            if key == "perspective":
+                codes, column = [PERSPECTIVES.index(normalize_perspective(v)) for v in values], self.perspective
+            elif key == "importance":
+                codes, column = [_importance_code(v) for v in values], self.importance
+            else:
+                wanted = {str(v).strip().lower() for v in values}
+                codes, column = [c for c, s in enumerate(self.sources) if s.lower() in wanted], self.source
+            mask &= np.isin(column, codes)
+            filtered = True
+        return np.flatnonzero(mask).astype("int64") if filtered else None
+
+
+def filtered_search(index, queries, k, allowed_ids=None):
+    """
+    index.search restricted to `allowed_ids` through a FAISS ID selector, so rows
+    outside the filter are never scored. On FAISS builds without search parameters
+    it over-fetches in growing rounds (k*4, k*16, ...) and masks the results,
+    searching the whole bank only if the allowed ids are still too rare.
+    """
+    if allowed_ids is None:
+        return index.search(queries, k)
+    k = max(1, min(k, len(allowed_ids)))
+    import faiss
+    try:
+        selector = faiss.IDSelectorBatch(allowed_ids)
+        return index.search(queries, k, params=faiss.SearchParameters(sel=selector))
+    except (TypeError, AttributeError, RuntimeError) as e:
+        print(f"[Memory Retrieval] ID selector unsupported ({e}); filtering after search.")
+
+    fetch = k * 4
+    while True:
+        fetch = min(fetch, index.ntotal)
+        D_all, I_all = index.search(queries, fetch)
+        keep = np.isin(I_all, allowed_ids)
+        if fetch >= index.ntotal or keep.sum(axis=1).min() >= k:
+            break
+        fetch *= 4
+    D = np.full((len(queries), k), -np.inf, dtype="float32")
+    I = np.full((len(queries), k), -1, dtype="int64")
+    for row in range(len(queries)):
+        hits = np.flatnonzero(keep[row])[:k]
+        D[row, :len(hits)] = D_all[row, hits]
+        I[row, :len(hits)] = I_all[row, hits]
+    return D, I
@@ -0,0 +1,65 @@
+"""
+memory_records.py
+
+Pre-rendered memory records.
+
+The finalizer resolves each memory's template once and stores the results in
+memory_mapping.json: `template_used`, `perspective` and `annotated_lines` (the
+"<prompt instruction>: <value>" line of every Prompt/Both field that has
+prompt instructions). Prompt assembly then joins prompt_text and those lines
+instead of opening template files each turn.
+"""
+
+
+def prompt_fields(template_doc: dict) -> list[tuple[str, str]]:
+    """
+    From a template document, return [(label, prompt_instructions)] for fields
+    whose usage is 'Prompt' or 'Both' AND that define prompt_instructions.
+    """
+    results = []
+    for fld in (template_doc or {}).get("fields", []):
+        usage = (fld.get("usage") or "").strip().lower()
+        if usage not in ("prompt", "both"):
+            continue
+        instr = (fld.get("prompt_instructions") or "").strip()
+        if not instr:
+            continue
+        label = fld.get("label")
+        if not isinstance(label, str) or not label.strip():
+            continue
+        results.append((label, instr))
+    return results
+
+
+def annotated_lines(memory: dict, pairs: list[tuple[str, str]]) -> list[str]:
+    """'instruction: value' lines for a memory (labels matched case-insensitively, empty values skipped)."""
+    by_label = {k.strip().lower(): v for k, v in memory.items() if isinstance(k, str)}
+    lines = []
+    for label, instr in pairs:
+        label_clean = label.strip().lower()
+        if label_clean == "prompt_text":
+            continue  # already the body of the block
+        val = memory.get(label, by_label.get(label_clean))
+        if val is None:
+            continue
+        if isinstance(val, (list, tuple)):
+            val_str = ", ".join(str(x).strip() for x in val if str(x).strip())
+        else:
+            val_str = str(val).strip()
+        if val_str:
+            lines.append(f"{instr.strip()}: {val_str}")
+    return lines
+
+
+def format_memory_block(prompt_text: str, lines: list[str]) -> str:
+    return "\n".join([(prompt_text or "").strip()] + list(lines or [])).strip()
+
+
+def memory_block(memory: dict) -> str | None:
+    """
+    The memory's rendered block without any template I/O, or None for records
+    finalized before annotations were stored (callers fall back to the template).
+    """
+    if "annotated_lines" in memory:
+        return format_memory_block(memory.get("prompt_text"), memory["annotated_lines"])
+    return None
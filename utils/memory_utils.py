@@ -3,13 +3,16 @@ memory_utils.py
 
 Provides vector-based memory retrieval using FAISS with keyword boosting.
 Used to retrieve character memories relevant to the current user message by combining
-semantic similarity with lemmatized tag overlap for fine-tuned selection.
+semantic similarity with lemmatized tag overlap for fine-tuned selection. A scenario's
+memory_filter restricts the search to matching memories before FAISS scores anything.
+Past exchanges from the session's episodic index are recalled alongside, with their own budget.
 """
 import re
-import faiss
 import numpy as np
 import os
-import json
+from utils.embedding_cache import get_embedding_cache
+from utils.memory_filters import MemoryAttributes, filtered_search
+from utils.asset_cache import read_json
 
 def load_stopwords(file_path="config/Filtered_Words_List.txt") -> set:
     if not os.path.exists(file_path):
@@ -19,6 +22,69 @@ def load_stopwords(file_path="config/Filtered_Words_List.txt") -> set:
     with open(file_path, "r", encoding="utf-8") as f:
         return {line.strip().lower() for line in f if line.strip()}
 
+def reciprocal_rank_fusion(D, I, limit, rrf_k=60):
+    """
+    Merge per-query FAISS results (rows of D/I) into one ranking by reciprocal-rank
+    fusion: each hit scores 1 / (rrf_k + rank). Returns (D, I) shaped like a single
+    search result, where D holds each memory's best similarity across the queries.
+    """
+    fused = {}
+    best_similarity = {}
+    for scores, ids in zip(D, I):
+        for rank, (score, idx) in enumerate(zip(scores, ids)):
+            if idx < 0:
+                continue  # fewer results than requested
+            idx = int(idx)
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (rrf_k + rank + 1)
+            best_similarity[idx] = max(best_similarity.get(idx, float("-inf")), float(score))
+
+    ranked = sorted(fused, key=fused.get, reverse=True)[:limit]
+    return (
+        np.array([[best_similarity[idx] for idx in ranked]], dtype="float32"),
+        np.array([ranked], dtype="int64"),
+    )
+
+def reconstruct_vectors(index, ids):
+    """Stored vectors for the given ids as one float32 matrix (None if the index can't reconstruct)."""
+    try:
+        ids = np.asarray(ids, dtype="int64")
+        try:
+            return np.asarray(index.reconstruct_batch(ids), dtype="float32")
+        except (AttributeError, TypeError):
+            return np.vstack([index.reconstruct(int(i)) for i in ids]).astype("float32")
+    except Exception as e:
+        print(f"[Memory Retrieval] Cannot reconstruct vectors for MMR, skipping it: {e}")
+        return None
+
+def mmr_select(vectors, relevance, k, mmr_lambda=0.7):
+    """
+    Greedy maximal-marginal-relevance selection. Pairwise cosine similarities come
+    from one matmul; each step then picks the candidate maximizing
+    lambda * relevance - (1 - lambda) * (max similarity to anything already picked).
+    Returns candidate positions in pick order.
+    """
+    n = len(relevance)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarity = unit @ unit.T
+    relevance = np.asarray(relevance, dtype="float32")
+
+    first = int(np.argmax(relevance))
+    picked = [first]
+    taken = np.zeros(n, dtype=bool)
+    taken[first] = True
+    max_similarity = similarity[first].copy()
+    while len(picked) < k:
+        marginal = mmr_lambda * relevance - (1.0 - mmr_lambda) * max_similarity
+        marginal[taken] = -np.inf
+        nxt = int(np.argmax(marginal))
+        picked.append(nxt)
+        taken[nxt] = True
+        np.maximum(max_similarity, similarity[nxt], out=max_similarity)
+    return picked
+
 def retrieve_relevant_memories(
     user_message,
     memory_index,
@@ -26,7 +92,9 @@ def retrieve_relevant_memories(
     embedder,
     lemmatizer,
     settings_data,
-    debug_mode=False
+    debug_mode=False,
+    episodic_index=None,
+    memory_attributes=None
 ):
     top_k = settings_data.get("top_k", 5)
     similarity_threshold = settings_data.get("similarity_threshold", 0.7)
@@ -37,10 +105,32 @@ def retrieve_relevant_memories(
     except (ValueError, TypeError):
         top_k = 5
 
-    if not memory_index or not memory_mapping:
+    # MMR re-ranks a larger candidate pool so near-duplicate chunks don't crowd out the rest
+    use_mmr = settings_data.get("mmr", True)
+    try:
+        mmr_lambda = float(settings_data.get("mmr_lambda", 0.7))
+        mmr_pool = int(settings_data.get("mmr_candidate_pool", top_k * 3))
+    except (ValueError, TypeError):
+        mmr_lambda, mmr_pool = 0.7, top_k * 3
+    candidate_k = max(top_k, mmr_pool) if use_mmr else top_k
+
+    has_memories = bool(memory_index) and bool(memory_mapping)
+    if not has_memories and episodic_index is None:
         print("[Memory Retrieval] Index or mapping missing.")
         return "", []
 
+    # Scenario-scoped retrieval: only ids matching the filter are searched
+    allowed_ids = None
+    memory_filter = settings_data.get("memory_filter")
+    if has_memories and memory_filter:
+        if memory_attributes is None or len(memory_attributes) != len(memory_mapping):
+            memory_attributes = MemoryAttributes.from_mapping(memory_mapping)
+        allowed_ids = memory_attributes.select_ids(memory_filter)
+        if allowed_ids is not None:
+            print(f"[Memory Retrieval] Filter {memory_filter}: searching {len(allowed_ids)} of {len(memory_mapping)} memories")
+            if not len(allowed_ids):
+                has_memories = False
+
     # Load stopwords (only once per call)
     stopwords = load_stopwords()
 
@@ -54,10 +144,25 @@ def retrieve_relevant_memories(
 
     # === Step 1: Extract questions and emphasize them ===
     question_sentences = [s.strip() for s in re.split(r'(?<=[?!.])\s+', user_message) if s.strip().rstrip('"\'').endswith('?')]
-    emphasized_input = " ".join(question_sentences + [user_message])
-    query_embedding = embedder.encode([emphasized_input]).astype("float32")
-
-    D, I = memory_index.search(query_embedding, top_k) 
+    multi_query = settings_data.get("multi_query", True) and question_sentences
+    if multi_query:
+        # One query per question plus the whole message, embedded as one batch
+        queries = list(dict.fromkeys(question_sentences + [user_message]))
+    else:
+        queries = [" ".join(question_sentences + [user_message])]
+    # Retries and repeated messages hit the cache and skip the forward pass
+    query_matrix = get_embedding_cache(embedder, settings_data).encode(embedder, queries)
+    query_embedding = query_matrix[-1:]
+
+    if not has_memories:
+        D, I = np.zeros((1, 0), dtype="float32"), np.zeros((1, 0), dtype="int64")
+    elif len(queries) > 1:
+        # One batched search for every query, merged by reciprocal-rank fusion
+        D_all, I_all = filtered_search(memory_index, query_matrix, candidate_k * 2, allowed_ids)
+        D, I = reciprocal_rank_fusion(D_all, I_all, candidate_k, settings_data.get("rrf_k", 60))
+        print(f"[Memory Retrieval] Multi-query: {len(queries)} queries fused into {len(I[0])} candidates")
+    else:
+        D, I = filtered_search(memory_index, query_matrix, candidate_k, allowed_ids)
 
     print("\n[DEBUG] FAISS Query Results")
     print ("Scores:", D[0]) 
@@ -97,7 +202,7 @@ def retrieve_relevant_memories(
     for dist, idx in zip(D[0], I[0]):
         print(f"\n[DEBUG] Checking index {idx} (score: {dist:.4f})")
 
-        if idx >= len(memory_mapping):
+        if idx < 0 or idx >= len(memory_mapping):
             print("  [SKIP] Index out of range.")
             continue
 
@@ -133,7 +238,7 @@ def retrieve_relevant_memories(
         print("   Passed threshold" if score >= similarity_threshold else " Rejected")
 
         if score >= similarity_threshold:
-            results.append((score, memory, matched, dist, boost, tag_to_words))
+            results.append((score, memory, matched, dist, boost, tag_to_words, idx))
             print("   Passed threshold")
         else:
             print("   Rejected: similarity below threshold")
@@ -151,7 +256,18 @@ def retrieve_relevant_memories(
     selected = []
     debug_lines = []
 
-    for score, memory, matched, dist, boost, tag_to_words in results[:top_k]:
+    if use_mmr and len(results) > 1:
+        pool = results[:candidate_k]
+        vectors = reconstruct_vectors(memory_index, [r[6] for r in pool])
+        if vectors is not None:
+            # Raw similarity, on the same cosine scale as the redundancy term: each tag boost adds
+            # memory_boost, which would outweigh any redundancy penalty. Boosts already shaped the pool.
+            order = mmr_select(vectors, [r[3] for r in pool], top_k, mmr_lambda)
+            results = [pool[i] for i in order]
+            if debug_mode:
+                debug_lines.append(f"MMR: picked {len(order)} of {len(pool)} candidates (lambda {mmr_lambda})")
+
+    for score, memory, matched, dist, boost, tag_to_words, _idx in results[:top_k]:
         selected.append(memory)
         if debug_mode:
             debug_lines.append (f"Chunk: Score = {dist:.4f}, Boost = {boost:.2f}, Total = {score: 4f}")
@@ -161,10 +277,18 @@ def retrieve_relevant_memories(
             debug_lines.append(f"  Matched words: {', '.join(sorted(matched)) or '(none)'}")
             debug_lines.append("")
 
+    # === Past exchanges from this session (separate budget from character memories) ===
+    episodic_selected, episodic_debug = retrieve_episodic_memories(query_embedding, episodic_index, settings_data)
+    selected.extend(episodic_selected)
+    if debug_mode:
+        debug_lines.extend(episodic_debug)
+
     # === Inject alias clarifications for roots actually mentioned in user input ===
     if selected and mentioned_clarifications:
         clarification_block = "\n\n" + "\n".join(mentioned_clarifications)
-        selected[0]["prompt_text"] += clarification_block
+        # Copy before editing: the mapping is shared across turns and sessions
+        selected[0] = dict(selected[0])
+        selected[0]["prompt_text"] = selected[0].get("prompt_text", "") + clarification_block
 
         print("\n[DEBUG] Injected Alias Clarifications (only once):")
         for line in mentioned_clarifications:
@@ -180,13 +304,44 @@ def retrieve_relevant_memories(
 
     return selected, debug_lines if debug_mode else []
 
-def load_alias_map(character_path):
-    alias_path = os.path.join(character_path, "alias_map.json")
-    if not os.path.exists(alias_path):
-        return {}
+def retrieve_episodic_memories(query_embedding, episodic_index, settings_data):
+    """
+    Recall past exchanges of this session that are no longer in the rolling window.
+
+    Budgeted separately from character memories: at most `episodic_top_k` exchanges
+    and `episodic_max_tokens` tokens, above `episodic_similarity_threshold`.
+    """
+    if episodic_index is None:
+        return [], []
     try:
-        with open(alias_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"[WARN] Failed to load alias map: {e}")
-        return {}
\ No newline at end of file
+        top_k = int(settings_data.get("episodic_top_k", 3))
+        threshold = float(settings_data.get("episodic_similarity_threshold", 0.45))
+        max_tokens = int(settings_data.get("episodic_max_tokens", 800))
+    except (ValueError, TypeError):
+        top_k, threshold, max_tokens = 3, 0.45, 800
+    if top_k <= 0:
+        return [], []
+
+    hits = episodic_index.search(query_embedding, top_k, settings_data.get("episodic_exclude_from"))
+
+    selected = []
+    used_tokens = 0
+    debug_lines = ["--- Episodic Recall (past exchanges) ---"]
+    for score, memory in hits:
+        tokens = memory.get("token_count", 0)
+        if score < threshold:
+            debug_lines.append(f"  {memory.get('memory_id')}: {score:.4f} rejected (threshold {threshold})")
+            continue
+        if used_tokens + tokens > max_tokens:
+            debug_lines.append(f"  {memory.get('memory_id')}: {score:.4f} skipped (token budget {max_tokens})")
+            continue
+        used_tokens += tokens
+        selected.append(memory)
+        debug_lines.append(f"  {memory.get('memory_id')}: {score:.4f} recalled ({tokens} tokens)")
+
+    print(f"[Episodic] Recalled {len(selected)} past exchange(s), {used_tokens} tokens.")
+    debug_lines.append(f"Recalled {len(selected)} past exchange(s) using {used_tokens}/{max_tokens} tokens.")
+    return selected, debug_lines
+
+def load_alias_map(character_path):
+    return read_json(os.path.join(character_path, "alias_map.json"), {})
\ No newline at end of file
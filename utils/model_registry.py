@@ -0,0 +1,167 @@
+"""
+model_registry.py
+
+The one place the sentence embedder is resolved and loaded.
+
+The chat app, the headless server and the Character Creator's finalizer all get
+the embedder from here, so queries and memory indexes are embedded by the same
+weights and a process never holds two copies. The model is resolved in order:
+  1) "embedder_path" in config/advanced_settings.json
+  2) the copy bundled with the Character Creator (works offline)
+  3) the hub name, all-MiniLM-L6-v2 (needs network or an HF cache)
+
+With "embedder_backend": "onnx" the same weights run on ONNX Runtime instead of
+PyTorch (int8-quantized unless "onnx_quantize" is false, "onnx_threads" threads);
+see utils/onnx_embedder.py. If onnxruntime is unavailable the PyTorch model is used.
+
+Every model has a fingerprint (a hash of its config files and weights). The
+finalizer records it next to the FAISS index in memory_index_meta.json, and
+loaders compare it with the active model so a stale index is reported instead
+of silently returning unrelated memories.
+"""
+import os
+import hashlib
+import threading
+
+from utils.asset_cache import read_json
+from utils.embedding_cache import register_embedder
+from utils.file_utils import atomic_write_json
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETTINGS_PATH = os.path.join(ROOT_DIR, "config", "advanced_settings.json")
+EMBEDDER_NAME = "all-MiniLM-L6-v2"
+BUNDLED_EMBEDDER_DIR = os.path.join(
+    ROOT_DIR, "Character Creator", "all-MiniLM-L6-v2-main", "all-MiniLM-L6-v2-main"
+)
+INDEX_META_FILE = "memory_index_meta.json"
+
+WEIGHT_FILES = ("model.safetensors", "pytorch_model.bin")
+CONFIG_FILES = ("config.json", "modules.json", "sentence_bert_config.json", "tokenizer.json", "1_Pooling/config.json")
+_SAMPLE_BYTES = 1 << 20  # weights are hashed by size plus their first and last MiB
+
+_lock = threading.Lock()
+_embedder = None
+_fingerprints = {}
+
+
+def _has_weights(path) -> bool:
+    return any(os.path.exists(os.path.join(path, name)) for name in WEIGHT_FILES)
+
+
+def resolve_embedder_source() -> str:
+    """Local folder (or hub name) of the embedder this process uses."""
+    override = (read_json(SETTINGS_PATH, {}) or {}).get("embedder_path")
+    if override:
+        return override
+    if os.path.isdir(BUNDLED_EMBEDDER_DIR) and _has_weights(BUNDLED_EMBEDDER_DIR):
+        return BUNDLED_EMBEDDER_DIR
+    return EMBEDDER_NAME
+
+
+def model_fingerprint(source: str) -> str:
+    """Stable content hash of a local model folder; hub names fingerprint as 'hub:<name>'."""
+    if not os.path.isdir(source):
+        return f"hub:{source}"
+    if source in _fingerprints:
+        return _fingerprints[source]
+
+    digest = hashlib.sha256()
+    for name in CONFIG_FILES:
+        path = os.path.join(source, name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(name.encode("utf-8") + b"\0" + f.read())
+    for name in WEIGHT_FILES:
+        path = os.path.join(source, name)
+        if not os.path.exists(path):
+            continue
+        size = os.path.getsize(path)
+        digest.update(f"{name}\0{size}".encode("utf-8"))
+        with open(path, "rb") as f:
+            digest.update(f.read(_SAMPLE_BYTES))
+            if size > _SAMPLE_BYTES:
+                f.seek(max(_SAMPLE_BYTES, size - _SAMPLE_BYTES))
+                digest.update(f.read())
+    _fingerprints[source] = digest.hexdigest()[:16]
+    return _fingerprints[source]
+
+
+def embedder_is_uncased(source: str, embedder=None) -> bool:
+    """True if the model lowercases its input ("do_lower_case" in its tokenizer config)."""
+    config = read_json(os.path.join(source, "tokenizer_config.json"), None) if os.path.isdir(source) else None
+    if isinstance(config, dict) and "do_lower_case" in config:
+        return bool(config["do_lower_case"])
+    return bool(getattr(getattr(embedder, "tokenizer", None), "do_lower_case", False))
+
+
+def embedder_model_id() -> str:
+    """'<model name>@<fingerprint>': keys embedding caches and episodic indexes."""
+    source = resolve_embedder_source()
+    return f"{os.path.basename(os.path.normpath(source))}@{model_fingerprint(source)}"
+
+
+def _load_onnx(source, settings):
+    quantized = settings.get("onnx_quantize", True)
+    try:
+        from utils.onnx_embedder import load_onnx_embedder
+        embedder = load_onnx_embedder(source, embedder_model_id(), quantized, settings.get("onnx_threads", 0))
+    except Exception as e:
+        print(f"[Warning] ONNX embedder unavailable, using PyTorch: {e}")
+        return None, None
+    return embedder, "onnx-int8" if quantized else "onnx"
+
+
+def get_embedder():
+    """Return the process-wide embedder (SentenceTransformer or OnnxEmbedder), loading it on first use."""
+    global _embedder
+    with _lock:
+        if _embedder is None:
+            source = resolve_embedder_source()
+            settings = read_json(SETTINGS_PATH, {}) or {}
+            embedder, backend = None, None
+            if settings.get("embedder_backend", "torch") == "onnx":
+                embedder, backend = _load_onnx(source, settings)
+            if embedder is None:
+                from sentence_transformers import SentenceTransformer
+                embedder = SentenceTransformer(source)
+            print(f"[Resources] Loaded embedder: {source}" + (f" ({backend})" if backend else ""))
+            # Quantized vectors differ slightly, so they get their own query-cache entries
+            register_embedder(
+                embedder, embedder_model_id() + (f"+{backend}" if backend else ""),
+                uncased=embedder_is_uncased(source, embedder),
+            )
+            _embedder = embedder
+        return _embedder
+
+
+def embedder_loaded() -> bool:
+    return _embedder is not None
+
+
+def write_index_meta(folder, dim, count, **extra):
+    """Record which model built a character's memory index, plus storage details (called by the finalizer)."""
+    source = resolve_embedder_source()
+    atomic_write_json(os.path.join(folder, INDEX_META_FILE), {
+        "model": os.path.basename(os.path.normpath(source)),
+        "fingerprint": model_fingerprint(source),
+        "dim": int(dim),
+        "count": int(count),
+        **extra,
+    })
+
+
+def check_index_model(folder) -> bool:
+    """
+    False (with a warning) if the character's index was built by different weights
+    than the active embedder. Indexes finalized before fingerprints pass unchecked.
+    """
+    meta = read_json(os.path.join(folder, INDEX_META_FILE))
+    if not meta:
+        return True
+    fingerprint = model_fingerprint(resolve_embedder_source())
+    if meta.get("fingerprint") != fingerprint:
+        print(f"[Warning] Memory index in {folder} was built with embedder {meta.get('model')} "
+              f"({meta.get('fingerprint')}), but the active embedder is {fingerprint}. "
+              "Re-run the finalizer so memories and queries use the same model.")
+        return False
+    return True
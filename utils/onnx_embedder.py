@@ -0,0 +1,286 @@
+"""
+onnx_embedder.py
+
+Optional ONNX Runtime backend for the sentence embedder (set "embedder_backend":
+"onnx" in advanced_settings.json). The registry's model is exported once to
+config/onnx/<model id>/ and, by default, dynamically quantized to int8, which
+runs several times faster than PyTorch on CPU-only hosts. OnnxEmbedder.encode()
+matches the SentenceTransformer.encode() arguments the app uses (mean pooling,
+L2 normalization), so it drops in anywhere the embedder is used. Like the
+SentenceTransformer pipeline, it normalizes by default when the model's
+modules.json ends in a Normalize module (query scores are compared against
+similarity_threshold, so unnormalized vectors would pass almost everything).
+
+Needs onnxruntime and tokenizers at runtime; exporting also needs torch and
+transformers (already installed alongside sentence-transformers).
+
+Command line (from the project root):
+  python -m utils.onnx_embedder export      export + quantize the active model
+  python -m utils.onnx_embedder check       cosine agreement with the fp32 PyTorch model
+  python -m utils.onnx_embedder benchmark   per-query latency and batch throughput of both
+Add --character <name> to check/benchmark on that character's memories.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+ONNX_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "onnx")
+FP32_FILE = "model.onnx"
+INT8_FILE = "model_int8.onnx"
+DEFAULT_MAX_SEQ_LENGTH = 256
+
+SAMPLE_TEXTS = [
+    "Do you remember the first time we met?",
+    "What happened in the Chamber of Secrets?",
+    "Continue",
+    "He drew his wand and stepped into the dark corridor, listening for footsteps.",
+    "Tell me about your friends and what you did together last summer.",
+    "Why were you so nervous during the interview?",
+    "The castle grounds were covered in snow, and the lake had frozen over.",
+    "Who taught you how to fly a broomstick?",
+]
+
+
+def _hub_id(source):
+    # The registry's bare hub name is the sentence-transformers organisation's model
+    if os.path.isdir(source) or "/" in source:
+        return source
+    return f"sentence-transformers/{source}"
+
+
+def _max_seq_length(source):
+    config_path = os.path.join(source, "sentence_bert_config.json")
+    if os.path.exists(config_path):
+        with open(config_path, "r", encoding="utf-8") as f:
+            return int(json.load(f).get("max_seq_length", DEFAULT_MAX_SEQ_LENGTH))
+    return DEFAULT_MAX_SEQ_LENGTH
+
+
+def _pipeline_normalizes(source) -> bool:
+    """Whether the SentenceTransformer pipeline of `source` (its modules.json) L2-normalizes its output."""
+    path = os.path.join(source, "modules.json")
+    if not os.path.exists(path):
+        try:
+            from huggingface_hub import hf_hub_download
+            path = hf_hub_download(_hub_id(source), "modules.json")
+        except Exception as e:
+            print(f"[ONNX] Could not read modules.json for {source} ({e}); assuming normalized output.")
+            return True
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            modules = json.load(f)
+    except Exception as e:
+        print(f"[ONNX] Could not read {path} ({e}); assuming normalized output.")
+        return True
+    return any(str(m.get("type", "")).endswith(".Normalize") for m in modules)
+
+
+def export_dir_for(model_id):
+    return os.path.join(ONNX_DIR, model_id.replace("/", "_").replace(":", "_"))
+
+
+def export_onnx(source, out_dir, quantize=True, opset=14):
+    """Export the transformer of `source` to ONNX (plus an int8 copy) and save its tokenizer."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    print(f"[ONNX] Exporting {source} to {out_dir}...")
+    tokenizer = AutoTokenizer.from_pretrained(_hub_id(source))
+    model = AutoModel.from_pretrained(_hub_id(source)).eval()
+
+    dummy = tokenizer(["export this sentence"], return_tensors="pt")
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in dummy]
+    axes = {0: "batch", 1: "sequence"}
+    fp32_path = os.path.join(out_dir, FP32_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(dummy[n] for n in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={**{n: axes for n in input_names}, "last_hidden_state": axes},
+            opset_version=opset,
+        )
+    tokenizer.save_pretrained(out_dir)
+    with open(os.path.join(out_dir, "export_info.json"), "w", encoding="utf-8") as f:
+        json.dump({"source": source, "max_seq_length": _max_seq_length(source), "opset": opset,
+                   "normalize": _pipeline_normalizes(source)}, f, indent=2)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32_path, os.path.join(out_dir, INT8_FILE), weight_type=QuantType.QInt8)
+    print("[ONNX] Export complete.")
+
+
+class OnnxEmbedder:
+    """Mean-pooled sentence embeddings from an exported transformer, on ONNX Runtime (CPU)."""
+
+    def __init__(self, model_path, tokenizer_path, max_seq_length=DEFAULT_MAX_SEQ_LENGTH, threads=0,
+                 normalize=False):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = int(threads)
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.model_path = model_path
+        self.normalize = normalize  # the exported pipeline ends in a Normalize module
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_seq_length)
+        self.tokenizer.enable_padding()
+
+        dim = self.session.get_outputs()[0].shape[-1]
+        self.dim = dim if isinstance(dim, int) else int(self._run(["dimension probe"]).shape[1])
+
+    @classmethod
+    def from_export(cls, out_dir, quantized=True, threads=0):
+        with open(os.path.join(out_dir, "export_info.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        model_file = INT8_FILE if quantized else FP32_FILE
+        normalize = info.get("normalize")
+        if normalize is None:
+            # Exported before the flag was recorded
+            normalize = _pipeline_normalizes(info.get("source", ""))
+        return cls(
+            os.path.join(out_dir, model_file),
+            os.path.join(out_dir, "tokenizer.json"),
+            info.get("max_seq_length", DEFAULT_MAX_SEQ_LENGTH),
+            threads,
+            normalize,
+        )
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _run(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype="int64")
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype="int64")
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]
+        mask = attention_mask[..., None].astype("float32")
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, normalize_embeddings=False, **_ignored):
+        """
+        Same contract as SentenceTransformer.encode for the arguments the app passes:
+        output is normalized if asked to or if the model's pipeline normalizes.
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        result = np.zeros((len(texts), self.dim), dtype="float32")
+        # Longest first, so each batch pads to texts of similar length
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            result[batch] = self._run([texts[i] for i in batch])
+        if normalize_embeddings or self.normalize:
+            result /= np.maximum(np.linalg.norm(result, axis=1, keepdims=True), 1e-12)
+        return result[0] if single else result
+
+
+def load_onnx_embedder(source, model_id, quantized=True, threads=0):
+    """OnnxEmbedder for the registry's model, exporting it on first use."""
+    out_dir = export_dir_for(model_id)
+    needed = INT8_FILE if quantized else FP32_FILE
+    if not os.path.exists(os.path.join(out_dir, needed)):
+        export_onnx(source, out_dir, quantize=quantized)
+    return OnnxEmbedder.from_export(out_dir, quantized, threads)
+
+
+# --- Accuracy check and benchmark ---
+def accuracy_check(reference, candidate, texts) -> dict:
+    """
+    Agreement of two embedders' default encode() output (what query retrieval uses):
+    cosine similarity of the vectors, and the ratio of their lengths, since the
+    scores are compared against absolute thresholds.
+    """
+    raw_a = np.asarray(reference.encode(texts, convert_to_numpy=True), dtype="float32")
+    raw_b = np.asarray(candidate.encode(texts, convert_to_numpy=True), dtype="float32")
+    norm_a = np.maximum(np.linalg.norm(raw_a, axis=1), 1e-12)
+    norm_b = np.linalg.norm(raw_b, axis=1)
+    a = raw_a / norm_a[:, None]
+    b = raw_b / np.maximum(norm_b, 1e-12)[:, None]
+    cosine = (a * b).sum(axis=1)
+    norm_ratio = norm_b / norm_a
+    # Retrieval only cares that neighbours stay the same: compare each text's top match
+    same_top = float(np.mean((a @ a.T).argsort(axis=1)[:, -2] == (b @ b.T).argsort(axis=1)[:, -2])) if len(texts) > 2 else 1.0
+    return {"texts": len(texts), "min_cosine": float(cosine.min()), "mean_cosine": float(cosine.mean()),
+            "max_norm_error": float(np.abs(norm_ratio - 1).max()), "same_nearest_neighbour": same_top}
+
+
+def benchmark(embedder, texts, repeats=3) -> dict:
+    """Per-query latency (one text per call, like a chat turn) and batch throughput (like the finalizer)."""
+    embedder.encode(texts[:2], convert_to_numpy=True)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for text in texts:
+            embedder.encode([text], convert_to_numpy=True, normalize_embeddings=True)
+    per_query = (time.perf_counter() - start) / (repeats * len(texts))
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        embedder.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    batch = (time.perf_counter() - start) / repeats
+    return {"per_query_ms": per_query * 1000, "batch_texts_per_sec": len(texts) / batch}
+
+
+def _texts_for(character):
+    if not character:
+        return SAMPLE_TEXTS
+    path = os.path.join("Character", character, "memory_mapping.json")
+    with open(path, "r", encoding="utf-8") as f:
+        texts = [m.get("search_text") or m.get("prompt_text", "") for m in json.load(f)]
+    return [t for t in texts if t.strip()] or SAMPLE_TEXTS
+
+
+def main(argv=None):
+    from utils import model_registry
+
+    parser = argparse.ArgumentParser(description="ONNX embedder export, accuracy check and benchmark.")
+    parser.add_argument("command", choices=("export", "check", "benchmark"))
+    parser.add_argument("--character", help="use this character's memories as test texts")
+    parser.add_argument("--threads", type=int, default=0, help="ONNX Runtime intra-op threads (0 = all cores)")
+    parser.add_argument("--fp32", action="store_true", help="use the unquantized export")
+    args = parser.parse_args(argv)
+
+    source = model_registry.resolve_embedder_source()
+    model_id = model_registry.embedder_model_id()
+    if args.command == "export":
+        export_onnx(source, export_dir_for(model_id), quantize=not args.fp32)
+        return 0
+
+    from sentence_transformers import SentenceTransformer
+    reference = SentenceTransformer(source)
+    candidate = load_onnx_embedder(source, model_id, quantized=not args.fp32, threads=args.threads)
+    texts = _texts_for(args.character)
+
+    if args.command == "check":
+        result = accuracy_check(reference, candidate, texts)
+        print(f"[ONNX] {result['texts']} texts: cosine to fp32 min {result['min_cosine']:.4f}, "
+              f"mean {result['mean_cosine']:.4f}; vector length off by up to {result['max_norm_error']:.2%}; "
+              f"same nearest neighbour {result['same_nearest_neighbour']:.1%}")
+        return 0 if result["min_cosine"] >= 0.98 and result["max_norm_error"] <= 0.02 else 1
+
+    for label, embedder in (("torch fp32", reference), ("onnx " + ("fp32" if args.fp32 else "int8"), candidate)):
+        result = benchmark(embedder, texts)
+        print(f"[ONNX] {label:>10}: {result['per_query_ms']:.2f} ms/query, "
+              f"{result['batch_texts_per_sec']:.1f} texts/s batched")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
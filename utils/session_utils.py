@@ -51,6 +51,5 @@ def load_session(chat_view, file_path=None):
         chat_view.conversation_history = []
 
     chat_view.chat_initialized = False
-    chat_view.load_session_assets(force_reload=True)
-    chat_view.render_conversation_to_display()
+    chat_view.load_session_assets(force_reload=True, on_loaded=chat_view.render_conversation_to_display)
     chat_view.entry.delete("1.0", "end")
\ No newline at end of file
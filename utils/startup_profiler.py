@@ -0,0 +1,86 @@
+"""
+startup_profiler.py
+
+Opt-in startup profile: `python start_ui.py --profile-startup`.
+
+Times the first import of every module (self time, summed per top-level
+package, like `python -X importtime` but aggregated) and named startup phases,
+then prints one report once the UI is interactive. Background model warm-up
+reports its own phase when it finishes.
+"""
+import sys
+import time
+import builtins
+import threading
+
+PROFILE_FLAG = "--profile-startup"
+
+
+class StartupProfiler:
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.phases = []          # (label, seconds since start)
+        self.imports = {}         # top-level package -> self time in seconds
+        self._stack = []          # child time accumulated by each in-progress import
+        self._original_import = None
+        self._thread = threading.main_thread()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_argv(cls, argv=None):
+        """Installed profiler if the flag is on the command line (the flag is removed), else None."""
+        argv = sys.argv if argv is None else argv
+        if PROFILE_FLAG not in argv:
+            return None
+        argv.remove(PROFILE_FLAG)
+        profiler = cls()
+        profiler.install()
+        return profiler
+
+    # --- Import timing ---
+    def install(self):
+        if self._original_import is None:
+            self._original_import = builtins.__import__
+            builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original_import
+        # Only first-time absolute imports on the main thread are interesting (and cheap to skip)
+        if level or name in sys.modules or threading.current_thread() is not self._thread:
+            return original(name, globals, locals, fromlist, level)
+
+        self._stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            total = time.perf_counter() - start
+            child = self._stack.pop()
+            top = name.partition(".")[0]
+            self.imports[top] = self.imports.get(top, 0.0) + (total - child)
+            if self._stack:
+                self._stack[-1] += total
+
+    # --- Phases ---
+    def mark(self, label):
+        with self._lock:
+            self.phases.append((label, time.perf_counter() - self.t0))
+
+    def report(self, top_n=15):
+        self.uninstall()
+        with self._lock:
+            phases = list(self.phases)
+        lines = ["", "=== Startup Profile ==="]
+        for label, at in phases:
+            lines.append(f"  {at * 1000:8.1f} ms  {label}")
+        total_imports = sum(self.imports.values())
+        lines.append(f"--- Imports by package (self time, {total_imports * 1000:.1f} ms total) ---")
+        for package, seconds in sorted(self.imports.items(), key=lambda kv: kv[1], reverse=True)[:top_n]:
+            lines.append(f"  {seconds * 1000:8.1f} ms  {package}")
+        lines.append("=== End ===")
+        print("\n".join(lines))
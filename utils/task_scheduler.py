@@ -0,0 +1,94 @@
+"""
+task_scheduler.py
+
+Runs disk and model work off the Tk main thread.
+
+One small thread pool executes tasks (index reads, JSON parsing, history
+loading, retrieval and LLM calls); their results, errors and progress updates
+are queued and handed back to callbacks on the Tk thread by a short after()
+poll, so callbacks may touch widgets and view state freely. Worker code must
+not: anything that needs the UI goes through call_soon().
+"""
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 2
+POLL_MS = 30
+
+
+class TaskScheduler:
+    def __init__(self, widget, max_workers=DEFAULT_WORKERS, poll_ms=POLL_MS):
+        self.widget = widget
+        self.poll_ms = poll_ms
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tk-task")
+        self._callbacks = queue.SimpleQueue()
+        self._tk_thread = threading.current_thread()
+        self._poll_id = None
+        self._closed = False
+        self._poll()
+
+    # --- Tk-thread side ---
+    def _poll(self):
+        while True:
+            try:
+                fn, args = self._callbacks.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"[Scheduler] UI callback {getattr(fn, '__name__', fn)} failed: {e}")
+                traceback.print_exc()
+        if not self._closed:
+            self._poll_id = self.widget.after(self.poll_ms, self._poll)
+
+    def on_tk_thread(self) -> bool:
+        return threading.current_thread() is self._tk_thread
+
+    def call_soon(self, fn, *args):
+        """Run fn(*args) on the Tk thread (immediately if already there). Safe from any thread."""
+        if self.on_tk_thread():
+            fn(*args)
+        else:
+            self._callbacks.put((fn, args))
+
+    # --- Submitting work ---
+    def run(self, fn, *args, on_done=None, on_error=None, on_progress=None):
+        """
+        Run fn(*args) on a worker thread and return its Future.
+
+        on_done(result) / on_error(exception) are called on the Tk thread. If
+        on_progress is given, fn also receives a `progress` keyword: a callable
+        that forwards its arguments to on_progress on the Tk thread.
+        """
+        kwargs = {}
+        if on_progress is not None:
+            kwargs["progress"] = lambda *a: self._callbacks.put((on_progress, a))
+
+        def task():
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if on_error is not None:
+                    self._callbacks.put((on_error, (e,)))
+                else:
+                    print(f"[Scheduler] Task {getattr(fn, '__name__', fn)} failed: {e}")
+                    traceback.print_exc()
+                raise
+            if on_done is not None:
+                self._callbacks.put((on_done, (result,)))
+            return result
+
+        return self._executor.submit(task)
+
+    def shutdown(self):
+        self._closed = True
+        if self._poll_id is not None:
+            try:
+                self.widget.after_cancel(self._poll_id)
+            except Exception:
+                pass
+            self._poll_id = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,12 +1,340 @@
-from transformers import AutoTokenizer
+"""
+token_utils.py
 
-# Initialize once and reuse
-tokenizer = AutoTokenizer.from_pretrained("Intel/neural-chat-7b-v3-1", trust_remote_code=True)
+Token counting for prompt budgeting.
 
-def count_tokens(text: str) -> int:
-    if not isinstance(text, str):
-        return 0
+Tokenizers are resolved from the configured `model` in advanced_settings.json and
+loaded lazily on a background thread the first time a count is requested, so
+importing the app never pays for transformers. Until the tokenizer is ready (or
+when none can be loaded, e.g. offline without a cache) counts come from a fast
+character-ratio estimator that is calibrated against real counts once available.
+"""
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+SETTINGS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "advanced_settings.json")
+LOCAL_TOKENIZER_DIR = os.path.join(os.path.dirname(SETTINGS_PATH), "tokenizers")
+DEFAULT_TOKENIZER = "Intel/neural-chat-7b-v3-1"
+
+# Substring of the configured model name -> tokenizer repo on the HF hub.
+# Checked in order, so more specific names come first.
+MODEL_TOKENIZERS = [
+    ("neural-chat", "Intel/neural-chat-7b-v3-1"),
+    ("mistral-nemo", "mistralai/Mistral-Nemo-Instruct-2407"),
+    ("mixtral", "mistralai/Mixtral-8x7B-Instruct-v0.1"),
+    ("mistral", "mistralai/Mistral-7B-Instruct-v0.2"),
+    ("qwen2.5", "Qwen/Qwen2.5-7B-Instruct"),
+    ("qwen", "Qwen/Qwen2-7B-Instruct"),
+    ("phi-3", "microsoft/Phi-3-mini-4k-instruct"),
+]
+
+
+def _read_settings() -> dict:
     try:
-        return len(tokenizer.encode(text.strip(), add_special_tokens=False))
+        with open(SETTINGS_PATH, "r", encoding="utf-8") as f:
+            return json.load(f) or {}
     except Exception:
-        return 0
\ No newline at end of file
+        return {}
+
+
+def resolve_tokenizer_source(model_name: str, settings_data: dict | None = None) -> str:
+    """
+    Map a configured model name to a tokenizer location. Order of preference:
+      1) "tokenizer_map" override in advanced_settings.json
+      2) a local folder config/tokenizers/<model name>
+      3) the MODEL_TOKENIZERS table
+      4) DEFAULT_TOKENIZER
+    """
+    name = (model_name or "").strip()
+    overrides = (settings_data if settings_data is not None else _read_settings()).get("tokenizer_map") or {}
+    if name in overrides:
+        return overrides[name]
+
+    if name:
+        local_dir = os.path.join(LOCAL_TOKENIZER_DIR, name)
+        if os.path.isdir(local_dir):
+            return local_dir
+
+    lowered = name.lower()
+    for needle, source in MODEL_TOKENIZERS:
+        if needle in lowered:
+            return source
+    return DEFAULT_TOKENIZER
+
+
+class TokenEstimator:
+    """
+    Character-ratio token estimate used when no real tokenizer is available.
+    The ratio starts at a typical English value for BPE tokenizers and is
+    recalibrated from every real count the counter observes.
+    """
+
+    def __init__(self, chars_per_token=3.8):
+        self.chars_per_token = chars_per_token
+        self._chars = 0
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def estimate(self, text: str) -> int:
+        if not text:
+            return 0
+        return max(1, int(round(len(text) / self.chars_per_token)))
+
+    def calibrate(self, text: str, real_count: int):
+        if not text or real_count <= 0:
+            return
+        with self._lock:
+            self._chars += len(text)
+            self._tokens += real_count
+            # Ignore the first few samples; tiny strings skew the ratio
+            if self._tokens >= 200:
+                self.chars_per_token = self._chars / self._tokens
+
+
+class TokenizerRegistry:
+    """Loads tokenizers on first use in a background thread, one per source."""
+
+    def __init__(self):
+        self._tokenizers = {}   # source -> tokenizer, or None if loading failed
+        self._loading = {}      # source -> threading.Event
+        self._lock = threading.Lock()
+
+    def _load(self, source, done):
+        tokenizer = None
+        try:
+            from transformers import AutoTokenizer
+            try:
+                # Prefer the local cache so offline starts never hit the network
+                tokenizer = AutoTokenizer.from_pretrained(source, local_files_only=True, trust_remote_code=True)
+            except Exception:
+                tokenizer = AutoTokenizer.from_pretrained(source, trust_remote_code=True)
+            print(f"[Tokenizer] Loaded tokenizer: {source}")
+        except Exception as e:
+            print(f"[Tokenizer] Could not load '{source}', using estimator instead: {e}")
+        with self._lock:
+            self._tokenizers[source] = tokenizer
+        done.set()
+
+    def get(self, source):
+        """Returns the tokenizer if it is ready, else None (and starts loading it)."""
+        with self._lock:
+            if source in self._tokenizers:
+                return self._tokenizers[source]
+            if source not in self._loading:
+                done = threading.Event()
+                self._loading[source] = done
+                threading.Thread(target=self._load, args=(source, done), daemon=True).start()
+        return None
+
+    def wait(self, source, timeout=None):
+        """Blocks until the tokenizer has finished loading (or failed). Returns it or None."""
+        self.get(source)
+        with self._lock:
+            done = self._loading.get(source)
+        if done:
+            done.wait(timeout)
+        with self._lock:
+            return self._tokenizers.get(source)
+
+
+class TokenCounter:
+    """
+    Token counter with an LRU cache keyed by a hash of the text.
+
+    The same strings (history entries, scenario, prefix, memory text) are counted
+    on every turn, so after the first turn almost every count is a cache hit.
+    count_many() sends all cache misses through one batch encode call. Estimated
+    counts are never cached, so real counts replace them once the tokenizer loads.
+    """
+
+    def __init__(self, source, registry, estimator, max_entries=8192):
+        self.source = source
+        self.registry = registry
+        self.estimator = estimator
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.estimated = 0
+
+    @property
+    def tokenizer(self):
+        return self.registry.get(self.source)
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def _lookup(self, key):
+        with self._lock:
+            count = self._cache.get(key)
+            if count is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+            return count
+
+    def _store(self, key, count):
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = count
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _estimate(self, text):
+        with self._lock:
+            self.estimated += 1
+        return self.estimator.estimate(text)
+
+    def count(self, text: str) -> int:
+        if not isinstance(text, str):
+            return 0
+        text = text.strip()
+        if not text:
+            return 0
+
+        key = self._key(text)
+        count = self._lookup(key)
+        if count is not None:
+            return count
+
+        count = self._encode_len(text)
+        if count is None:
+            return self._estimate(text)
+        self._store(key, count)
+        self.estimator.calibrate(text, count)
+        return count
+
+    def _encode_len(self, text):
+        tokenizer = self.tokenizer
+        if tokenizer is None:
+            return None
+        try:
+            return len(tokenizer.encode(text, add_special_tokens=False))
+        except Exception:
+            return None
+
+    def count_many(self, texts) -> list[int]:
+        """Counts a list of texts, batch-encoding only the ones not already cached."""
+        results = [0] * len(texts)
+        pending = {}  # key -> (text, [positions])
+
+        for i, text in enumerate(texts):
+            if not isinstance(text, str) or not text.strip():
+                continue
+            text = text.strip()
+            key = self._key(text)
+            count = self._lookup(key)
+            if count is not None:
+                results[i] = count
+            elif key in pending:
+                pending[key][1].append(i)
+            else:
+                pending[key] = (text, [i])
+
+        if not pending:
+            return results
+
+        keys = list(pending)
+        batch = [pending[k][0] for k in keys]
+        tokenizer = self.tokenizer
+        counts = [None] * len(batch)
+        if tokenizer is not None:
+            try:
+                encoded = tokenizer(batch, add_special_tokens=False)["input_ids"]
+                counts = [len(ids) for ids in encoded]
+            except Exception:
+                counts = [self._encode_len(t) for t in batch]
+
+        for key, text, count in zip(keys, batch, counts):
+            if count is None:
+                count = self._estimate(text)
+            else:
+                self._store(key, count)
+                self.estimator.calibrate(text, count)
+            for i in pending[key][1]:
+                results[i] = count
+
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "tokenizer": self.source if self.registry.get(self.source) is not None else "estimator",
+                "hits": self.hits,
+                "misses": self.misses,
+                "estimated": self.estimated,
+                "entries": len(self._cache),
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+tokenizer_registry = TokenizerRegistry()
+token_estimator = TokenEstimator()
+
+_counters = {}          # model name -> its TokenCounter, resolved once per settings load
+_source_counters = {}   # tokenizer source -> TokenCounter; models sharing a tokenizer share its cache
+_settings = None        # settings the model names are resolved against
+_active_model = None
+_counters_lock = threading.Lock()
+
+
+def set_active_model(model_name: str, settings_data: dict | None = None):
+    """
+    Select the tokenizer used by count_tokens (called when settings are applied).
+    `settings_data` is the just-loaded settings; tokenizer sources are resolved
+    again against it on next use.
+    """
+    global _active_model, _settings
+    with _counters_lock:
+        _active_model = (model_name or "").strip()
+        _settings = settings_data
+        _counters.clear()
+
+
+def get_token_counter(model_name: str | None = None) -> TokenCounter:
+    """Return the shared TokenCounter for a model (default: the configured model)."""
+    global _active_model, _settings
+    with _counters_lock:
+        if model_name is None:
+            if _active_model is None:
+                _settings = _read_settings()
+                _active_model = (_settings.get("model") or "").strip()
+            model_name = _active_model
+
+        counter = _counters.get(model_name)
+        if counter is not None:
+            return counter
+        if _settings is None:
+            _settings = _read_settings()
+        source = resolve_tokenizer_source(model_name, _settings)
+        counter = _source_counters.get(source)
+        if counter is None:
+            counter = TokenCounter(source, tokenizer_registry, token_estimator)
+            _source_counters[source] = counter
+        _counters[model_name] = counter
+        return counter
+
+
+def warm_tokenizer():
+    """Start loading the active model's tokenizer in the background without blocking."""
+    get_token_counter().tokenizer
+
+
+def wait_for_tokenizer(timeout=None) -> bool:
+    """Block until the active model's tokenizer is loaded. Returns False if it is unavailable."""
+    counter = get_token_counter()
+    return tokenizer_registry.wait(counter.source, timeout) is not None
+
+
+def count_tokens(text: str) -> int:
+    return get_token_counter().count(text)
+
+
+def count_tokens_many(texts) -> list[int]:
+    return get_token_counter().count_many(texts)
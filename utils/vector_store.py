@@ -0,0 +1,134 @@
+"""
+vector_store.py
+
+Storage formats for a character's memory index (memory_index.faiss).
+
+  flat   exact float32 vectors (IndexFlatIP), 1.5 KB per 384-dim memory
+  sq8    8-bit scalar quantization, 4x smaller
+  pq     product quantization, `pq_m` bytes per memory (48 by default, 32x smaller)
+
+The format is chosen per character with "index_type" in character_config.json
+(large shared lore banks are the use case). For sq8/pq the finalizer also writes
+the exact vectors to memory_vectors.f32 unless "refine" is false. They are
+memory-mapped rather than loaded, and only the rows of the compressed index's
+top candidates are read to re-score them exactly, so resident memory stays at
+the compressed size while the final ranking matches a flat index.
+"""
+import os
+
+import numpy as np
+
+from utils.asset_cache import read_json
+
+INDEX_FILE = "memory_index.faiss"
+VECTORS_FILE = "memory_vectors.f32"
+INDEX_TYPES = ("flat", "sq8", "pq")
+DEFAULT_PQ_M = 48
+DEFAULT_REFINE_FACTOR = 4
+# k-means wants ~39 training points per centroid; PQ uses 256 centroids per sub-quantizer
+PQ_MIN_TRAIN = 256 * 39
+
+
+def build_index(vectors, index_type="flat", pq_m=DEFAULT_PQ_M):
+    """Build (and train, if needed) an inner-product index over `vectors`. Returns (index, type used)."""
+    import faiss
+
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n, dim = vectors.shape
+    if index_type not in INDEX_TYPES:
+        print(f"[WARN] Unknown index_type '{index_type}', using flat.")
+        index_type = "flat"
+    if index_type == "pq" and n < PQ_MIN_TRAIN:
+        print(f"[INFO] {n} memories are too few to train PQ (needs {PQ_MIN_TRAIN}); using sq8.")
+        index_type = "sq8"
+    if index_type == "pq" and dim % pq_m:
+        pq_m = max(m for m in range(1, pq_m + 1) if dim % m == 0)
+        print(f"[INFO] pq_m must divide the dimension {dim}; using {pq_m}.")
+
+    if index_type == "sq8":
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+    elif index_type == "pq":
+        index = faiss.IndexPQ(dim, pq_m, 8, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+    else:
+        index = faiss.IndexFlatIP(dim)
+    if n:
+        index.add(vectors)
+    return index, index_type
+
+
+def save_exact_vectors(folder, vectors):
+    # Written aside and renamed, so a running chat app never maps a half-written file
+    path = os.path.join(folder, VECTORS_FILE)
+    np.ascontiguousarray(vectors, dtype="float32").tofile(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def remove_exact_vectors(folder):
+    path = os.path.join(folder, VECTORS_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class RefinedIndex:
+    """
+    A compressed FAISS index whose top `k * refine_factor` candidates are
+    re-scored against exact vectors memory-mapped from disk. Exposes the parts of
+    the index API retrieval uses (search, reconstruct, reconstruct_batch, ntotal, d).
+    """
+
+    def __init__(self, index, vectors_path, refine_factor=DEFAULT_REFINE_FACTOR):
+        self.index = index
+        self.d = index.d
+        self.refine_factor = max(1, int(refine_factor))
+        self.vectors = np.memmap(vectors_path, dtype="float32", mode="r").reshape(-1, index.d)
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    def search(self, queries, k, params=None):
+        queries = np.ascontiguousarray(queries, dtype="float32")
+        k_base = max(1, min(self.index.ntotal, k * self.refine_factor))
+        if params is None:
+            D_base, I_base = self.index.search(queries, k_base)
+        else:
+            D_base, I_base = self.index.search(queries, k_base, params=params)
+
+        D = np.full((len(queries), k), -np.inf, dtype="float32")
+        I = np.full((len(queries), k), -1, dtype="int64")
+        for row, ids in enumerate(I_base):
+            ids = ids[ids >= 0]
+            if not len(ids):
+                continue
+            exact = self.vectors[ids] @ queries[row]   # reads only these rows from disk
+            best = np.argsort(-exact)[:k]
+            D[row, :len(best)] = exact[best]
+            I[row, :len(best)] = ids[best]
+        return D, I
+
+    def reconstruct(self, i):
+        return np.array(self.vectors[int(i)])
+
+    def reconstruct_batch(self, ids):
+        return np.array(self.vectors[np.asarray(ids, dtype="int64")])
+
+
+def load_memory_index(folder):
+    """
+    Read a character's memory index, wrapped in RefinedIndex when it is compressed
+    and its exact vectors were saved alongside.
+    """
+    import faiss
+    from utils.model_registry import INDEX_META_FILE
+
+    index = faiss.read_index(os.path.join(folder, INDEX_FILE))
+    meta = read_json(os.path.join(folder, INDEX_META_FILE), {}) or {}
+    vectors_path = os.path.join(folder, VECTORS_FILE)
+    if meta.get("index_type", "flat") == "flat" or not os.path.exists(vectors_path):
+        return index
+    if os.path.getsize(vectors_path) != index.ntotal * index.d * 4:
+        print(f"[Warning] {vectors_path} does not match the index; searching without exact re-ranking.")
+        return index
+    return RefinedIndex(index, vectors_path, meta.get("refine_factor", DEFAULT_REFINE_FACTOR))
@@ -11,6 +11,7 @@ import traceback
 from tkinter import filedialog, messagebox
 import customtkinter as ctk
 from core.app_controller import CenteredFrame
+from utils.token_utils import set_active_model, warm_tokenizer
 DEFAULT_SETTINGS_PATH = "config/advanced_settings.json"
 
 class AdvancedSettings(CenteredFrame):
@@ -148,6 +149,7 @@ class AdvancedSettings(CenteredFrame):
     def get_debug_color(self): return self.debug_color_entry.get().strip()
     def get_theme_color(self): return self.ui_theme_color_entry.get().strip()
     def get_llm_url(self): return self.llm_url_entry.get().strip()
+    def get_llm_endpoints(self): return self.settings.get("llm_endpoints")
     def get_model_name(self): return self.model_entry.get().strip()
     def get_max_tokens(self):
         if self.get_no_token_limit():
@@ -259,7 +261,9 @@ class AdvancedSettings(CenteredFrame):
             dict: All advanced settings, used for saving or injecting into model prompts.
         """
         max_tokens = self.get_max_tokens()
-        return {
+        # Keys without a widget (set directly in the settings file) pass through unchanged
+        settings = dict(self.settings)
+        settings.update({
             "no_token_limit": self.get_no_token_limit(),
             "chat_history_length": self.get_chat_history_length(),
             "temperature": self.get_temperature(),
@@ -280,7 +284,8 @@ class AdvancedSettings(CenteredFrame):
             "auto_scroll": self.get_auto_scroll(),
             "save_path": self.get_save_path(),
             "clear_console_on_send": self.clear_console_var.get()
-        }
+        })
+        return settings
 
     def set_slider_and_entry(self, slider, entry, value):
         try:
@@ -299,6 +304,8 @@ class AdvancedSettings(CenteredFrame):
         applies the visual theming and updates controller-level shared colors.
         """
         try:
+            self.settings.update(data)
+
             max_tokens = data.get("max_tokens") or 2048
             self.max_tokens_entry.delete(0, "end")
             self.max_tokens_entry.insert(0, str(max_tokens))
@@ -339,6 +346,10 @@ class AdvancedSettings(CenteredFrame):
             self.save_path_entry.delete(0, "end")
             self.save_path_entry.insert(0, data.get("save_path", ""))
 
+            # Token counts follow the configured model; start loading its tokenizer now
+            set_active_model(data.get("model", "mistral-nemo-instruct-2407"), data)
+            warm_tokenizer()
+
             self.no_token_limit_var.set(data.get("no_token_limit", False))
             self.auto_scroll_var.set(data.get("auto_scroll", True))
             self.clear_console_var.set(data.get("clear_console_on_send", True))
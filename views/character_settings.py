@@ -9,10 +9,10 @@ Allows loading/saving of scenarios and prefix instructions from/to separate
 text files for easier reuse and editing.
 """
 import os
-import json
 from tkinter import filedialog, messagebox
 import customtkinter as ctk
 from utils.token_utils import count_tokens
+from utils.asset_cache import read_json, write_json
 CHARACTER_DIR = "Character"
 
 class CharacterSettings(ctk.CTkFrame):
@@ -112,10 +112,9 @@ class CharacterSettings(ctk.CTkFrame):
         name = self.character_folder_map.get(display_name, display_name)
         path = os.path.join(CHARACTER_DIR, name, "character_config.json")
         if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                self.scenario_box.delete("1.0", "end")
-                self.prefix_box.delete("1.0", "end")
+            data = read_json(path, {})
+            self.scenario_box.delete("1.0", "end")
+            self.prefix_box.delete("1.0", "end")
 
     def save_character(self):
         """
@@ -129,12 +128,8 @@ class CharacterSettings(ctk.CTkFrame):
         path = os.path.join(CHARACTER_DIR, name)
         os.makedirs(path, exist_ok=True)
         config_path = os.path.join(path, "character_config.json")
-        config = {}
-        if os.path.exists(config_path):
-            with open(config_path, "r", encoding="utf-8") as f:
-                config = json.load(f)
-        with open(config_path, "w", encoding="utf-8") as f:
-            json.dump(config, f, indent=2)
+        config = dict(read_json(config_path, {}))
+        write_json(config_path, config, indent=2)
 
         # Update ChatView if this character is currently active
         current_char = self.controller.selected_character
@@ -153,11 +148,10 @@ class CharacterSettings(ctk.CTkFrame):
         os.makedirs(scenario_dir, exist_ok=True)
         file_path = filedialog.askopenfilename(initialdir=scenario_dir, title="Select Scenario File", filetypes=[("JSON Files", "*.json")])
         if file_path:
-            with open(file_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                text = data.get("content", "")
-                self.scenario_box.delete("1.0", "end")
-                self.scenario_box.insert("end", text)
+            data = read_json(file_path, {})
+            text = data.get("content", "")
+            self.scenario_box.delete("1.0", "end")
+            self.scenario_box.insert("end", text)
 
     def save_scenario_to_file(self):
         """
@@ -180,8 +174,7 @@ class CharacterSettings(ctk.CTkFrame):
                 "content": text,
                 "token_count": token_count
             }
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(json_data, f, indent=2)
+            write_json(file_path, json_data, indent=2)
 
     def load_prefix_from_file(self):
         """
@@ -193,11 +186,10 @@ class CharacterSettings(ctk.CTkFrame):
         os.makedirs(prefix_dir, exist_ok=True)
         file_path = filedialog.askopenfilename(initialdir=prefix_dir, title="Select Prefix File", filetypes=[("JSON Files", "*.json")])
         if file_path:
-            with open(file_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                text = data.get("content", "")
-                self.prefix_box.delete("1.0", "end")
-                self.prefix_box.insert("end", text)
+            data = read_json(file_path, {})
+            text = data.get("content", "")
+            self.prefix_box.delete("1.0", "end")
+            self.prefix_box.insert("end", text)
 
     def save_prefix_to_file(self):
         # Saves the prefix textbox content to a text file in Character/<name>/Prefix/.
@@ -217,5 +209,4 @@ class CharacterSettings(ctk.CTkFrame):
                 "content": text,
                 "token_count": token_count
             }
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(json_data, f, indent=2)
+            write_json(file_path, json_data, indent=2)
@@ -1,46 +1,73 @@
 import json
 import os
-import threading
-import faiss
+import shutil
 import re
-from sentence_transformers import SentenceTransformer
-from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
-from nltk.stem import WordNetLemmatizer
 from tkinter import messagebox, filedialog
 import customtkinter as ctk
 from utils.memory_utils import retrieve_relevant_memories
+from utils.memory_filters import MemoryAttributes
+from utils.vector_store import load_memory_index
 from utils.session_utils import load_session
-from utils.api_utils import call_llm_api
+from utils.api_utils import CancelToken, LLMError, LLMHTTPError, LLMDeadlineExceeded, CircuitOpenError
+from utils.history_window import history_entry, update_entry_content
+from utils.history_store import HistoryStore, HISTORY_FILE, DEFAULT_WINDOW_SIZE
+from utils.file_utils import AppendLog, atomic_write_json
+from utils.asset_cache import read_json
 from core.conversation_service import ConversationService
+from core.turn_executor import TurnExecutor, DEFAULT_TURN_DEADLINE
+from views.transcript_renderer import TranscriptRenderer
+from core.shared_resources import get_embedder, get_lemmatizer, embedder_model_id, check_index_model
+from utils.episodic_memory import EpisodicIndex
 from utils.debug_utils import generate_basic_debug_report, generate_advanced_debug_report
 
 class ChatView(ctk.CTkFrame):
     def toggle_debug_mode(self):
         self.debug_mode = self.debug_toggle_var.get()
 
+    @property
+    def embedder(self):
+        return get_embedder()
+
+    @property
+    def lemmatizer(self):
+        return get_lemmatizer()
+
     def __init__(self, parent, controller):
         super().__init__(parent)
         self.controller = controller
         self.thinking_label = None
+        self.loading_label = None
 
         # --- Core state ---
         self.chat_initialized = False
         self.editing_reply = False
+        self.editing_index = None  # absolute history index of the reply being edited
         self._thinking_anim_id = None
         self._thinking_dots = 0
         self.last_prompt = None
-        self.conversation_history = []
+        self.conversation_history = []  # in-memory window; full history lives in history_store
+        self.history_store = None
+        self.printout_log = None  # printout.txt, kept open for the session
+        self.episodic_index = None  # past exchanges of this session, for long-range recall
         self.memory_index = None
         self.memory_mapping = []
+        self.memory_attributes = None
+        self.memory_filter = None  # scenario's "memory_filter" (scoped retrieval)
         self.prefix = ""
         self.scenario = ""
         self.llm_character = None  # Will be loaded from session
         self.user_character = None  # Will be loaded from session
+        self._load_token = 0  # bumped per session load/reset; stale background results are dropped
+        self.turns = None  # TurnExecutor of the open session
+        # Alternative replies for the newest turn ("reply_candidates" setting), so Try Again is instant
+        self.reply_candidates = []
+        self._candidates_turn = None  # absolute index of the user message they answer
+        self._refill_cancel = None
 
         # --- Services ---
         self.conversation_service = ConversationService(controller)
-        self.embedder = SentenceTransformer("all-MiniLM-L6-v2")
-        self.lemmatizer = WordNetLemmatizer()
+        # Models load in the background (see start_ui.py); self.embedder /
+        # self.lemmatizer only block if a turn needs them before they are ready
 
         # --- Theme + Colors ---
         font = self.get_ui_font()
@@ -69,6 +96,8 @@ class ChatView(ctk.CTkFrame):
         top_button_row = ctk.CTkFrame(inner)
         top_button_row.pack(fill="x", pady=(5, 0))
         ctk.CTkButton(top_button_row, text="Try Again", width=100, font=font, command=self.retry_last_response).pack(side="right", padx=10)
+        self.stop_button = ctk.CTkButton(top_button_row, text="Stop", width=100, font=font, command=self.stop_generation, state="disabled")
+        self.stop_button.pack(side="right", padx=10)
         self.edit_button = ctk.CTkButton(top_button_row, text="Edit Reply", width=100, font=font, command=self.toggle_edit_last_reply)
         self.edit_button.pack(side="right", padx=10)
         ctk.CTkButton(top_button_row, text="Back", width=100, font=font, command=self.confirm_back_to_main).pack(side="left", padx=10)
@@ -79,7 +108,6 @@ class ChatView(ctk.CTkFrame):
                                            border_color=accent_color, border_width=2)
         self.chat_display.pack(pady=10)
         self.chat_display.configure(state="disabled")
-        self.chat_display.tag_config("thinking_tag", foreground="#AAAAAA")
 
         # === Entry Box ===
         self.entry = ctk.CTkTextbox(inner, width=500, height=120, font=font, wrap="word",
@@ -91,6 +119,8 @@ class ChatView(ctk.CTkFrame):
         self.chat_display.tag_config("user", foreground=self.user_color)
         self.chat_display.tag_config("bot", foreground=self.character_color)
         self.chat_display.tag_config("debug", foreground=self.debug_color)
+        self.chat_display.tag_config("edit", background="#444444")  # subtle highlight
+        self.transcript = TranscriptRenderer(self.chat_display, self._speaker_label)
 
         # === Button Row ===
         button_row = ctk.CTkFrame(inner)
@@ -120,7 +150,8 @@ class ChatView(ctk.CTkFrame):
         payload = getattr(self, "last_payload_used", {})
         memory_debug_lines = getattr(self, "memory_debug_lines", [])
         selected_memories = getattr(self, "selected_memories", [])
-        token_stats = getattr(self.conversation_service, "last_token_stats", {})
+        token_stats = dict(getattr(self.conversation_service, "last_token_stats", {}))
+        token_stats["llm_usage"] = self.conversation_service.usage.snapshot()
         if self.debug_mode:
             debug_text = generate_basic_debug_report(
                 payload,
@@ -129,9 +160,7 @@ class ChatView(ctk.CTkFrame):
                 token_stats,
             )
             print(debug_text)
-            self.chat_display.configure(state="normal")
-            self.chat_display.insert("end", debug_text + "\n", "debug")
-            self.chat_display.configure(state="disabled")
+            self.transcript.set_block("debug", debug_text + "\n", "debug")
 
     def retry_last_response(self):
         if not hasattr(self, "last_built_prompt") or not hasattr(self, "last_payload_used") or not self.last_built_prompt or not self.last_payload_used:
@@ -140,63 +169,61 @@ class ChatView(ctk.CTkFrame):
         if not hasattr(self, "last_built_prompt") or not hasattr(self, "last_payload_used"):
             print("[Retry] Missing saved prompt or payload. Cannot retry.")
             return
-
-        self.chat_display.configure(state="normal")
-        content = self.chat_display.get("1.0", "end")
-
-        # Attempt to remove the last AI reply block
-        lines = content.strip().split("\n")
-        char_label = f"{self.controller.selected_character}:"
-
-        for i in range(len(lines) - 1, -1, -1):
-            if lines[i].startswith(char_label):
-                lines = lines[:i]
-                break
-        else:
-            print("[Retry] Warning: Could not find AI label to remove.")
+        if self.turns and self.turns.busy():
+            # The newest reply isn't in yet; retrying now would drop an older one
+            print("[Retry] A reply is already being generated.")
             return
 
-        # Trim the conversation history to remove the last assistant message
+        # Remove the last assistant message from the history and the display
         for i in range(len(self.conversation_history) - 1, -1, -1):
             if self.conversation_history[i]["role"] == "assistant":
-                self.conversation_history = self.conversation_history[:i]
+                index = self._history_base() + i
+                previous_reply = self.conversation_history[i].get("content", "")
+                self._truncate_history(i)
+                self.transcript.remove_from(index)
                 break
+        else:
+            print("[Retry] Warning: No AI reply to remove.")
+            return
 
-        self.render_conversation_to_display()
+        # A pre-generated alternative answers the same turn: swap it in without waiting
+        if self.reply_candidates and self._candidates_turn == self._last_history_index():
+            print(f"[Retry] Showing a pre-generated alternative ({len(self.reply_candidates) - 1} more cached).")
+            self._record_reply(self.reply_candidates.pop(0))
+            self._refill_candidates()
+            return
 
         # Launch a retry using the last used prompt and payload (same vector memory, same input)
         print("[Retry] Attempting to retry previous prompt.")
-        threading.Thread(
-            target=lambda: self._handle_llm_response(
-                self.last_built_prompt,
-                self.last_payload_used,
-                self.last_prompt  # this is just for debug tagging
-            )
-        ).start()
+        self._clear_candidates()
+        self._start_turn(
+            ("retry", self.last_prompt),
+            self._handle_llm_response,
+            self.last_built_prompt,
+            self.last_payload_used,
+            self.last_prompt,  # this is just for debug tagging
+            self.controller.frames["AdvancedSettings"].get_all_settings(),
+            # Stopped or failed: put the reply that was being replaced back
+            on_cancelled=lambda: self._record_reply(previous_reply),
+        )
 
     def toggle_edit_last_reply(self):
-        self.chat_display.configure(state="normal")
-        content = self.chat_display.get("1.0", "end").strip().split("\n")
-
-        char_label = f"{self.controller.selected_character}:"
-
         if not self.editing_reply:
-            # Enter editing mode: find and highlight last AI line
-            for i in range(len(content) - 1, -1, -1):
-                if content[i].startswith(char_label):
-                    self.last_ai_line_index = i
+            # Enter editing mode: highlight the last AI reply's content range
+            for i in range(len(self.conversation_history) - 1, -1, -1):
+                if self.conversation_history[i]["role"] == "assistant":
+                    self.editing_index = self._history_base() + i
                     break
             else:
-                self.chat_display.configure(state="disabled")
                 messagebox.showinfo("No AI Reply Found", "There is no previous AI message to edit.")
                 return
+            if not self.transcript.has_message(self.editing_index):
+                messagebox.showinfo("No AI Reply Found", "The last AI message is not on screen.")
+                return
 
-            # Put entire content back in editable state
-            # Highlight just the last AI reply line for editing
-            start = f"{self.last_ai_line_index + 1}.0"
-            end = f"{self.last_ai_line_index + 1}.end"
+            start, end = self.transcript.content_range(self.editing_index)
+            self.chat_display.configure(state="normal")
             self.chat_display.tag_add("edit", start, end)
-            self.chat_display.tag_config("edit", background="#444444")  # subtle highlight
             self.chat_display.mark_set("insert", end)
             self.chat_display.see(start)
             self.editing_reply = True
@@ -204,21 +231,99 @@ class ChatView(ctk.CTkFrame):
             return
 
         else:
-            # Save edits: update internal state and restore tag
-            edited_reply = self.chat_display.get(f"{self.last_ai_line_index + 1}.0", f"{self.last_ai_line_index + 1}.end").strip()
+            # Save edits: read the reply back by range and update internal state
+            start, end = self.transcript.content_range(self.editing_index)
+            edited_reply = self.transcript.get_content(self.editing_index).strip()
 
-            self.chat_display.tag_remove("edit", f"{self.last_ai_line_index + 1}.0", f"{self.last_ai_line_index + 1}.end")
-            self.chat_display.tag_add("bot", f"{self.last_ai_line_index + 1}.0", f"{self.last_ai_line_index + 1}.end")
+            self.chat_display.tag_remove("edit", start, end)
+            self.chat_display.tag_add("bot", start, end)
             self.chat_display.configure(state="disabled")
 
             self.editing_reply = False
             self.edit_button.configure(text="Edit Reply")
 
             # Update conversation history with the edited assistant reply
-            for i in range(len(self.conversation_history) - 1, -1, -1):
-                if self.conversation_history[i]["role"] == "assistant":
-                    self.conversation_history[i]["content"] = edited_reply
-                    break
+            i = self.editing_index - self._history_base()
+            if 0 <= i < len(self.conversation_history):
+                update_entry_content(self.conversation_history[i], edited_reply)
+                if self.history_store:
+                    self.history_store.rewrite_from(self.editing_index, self.conversation_history[i:])
+                if self.episodic_index and i == len(self.conversation_history) - 1:
+                    self.episodic_index.discard_from(self.editing_index - 1)
+                    self._index_last_exchange()
+
+    def _history_base(self):
+        # Absolute index (in the history store) of conversation_history[0]
+        if not self.history_store:
+            return 0
+        return len(self.history_store) - len(self.conversation_history)
+
+    def _last_history_index(self):
+        """Absolute index of the newest history entry."""
+        return self._history_base() + len(self.conversation_history) - 1
+
+    def _speaker_label(self, role):
+        if role == "user":
+            return self.user_character_config.get("name", "You")
+        return self.llm_character_config.get("name", "Bot")
+
+    def _append_history(self, role, content):
+        """Append a message to the on-disk history and the bounded in-memory window."""
+        entry = history_entry(role, content)
+        self.conversation_history.append(entry)
+        window_size = DEFAULT_WINDOW_SIZE
+        if self.history_store:
+            self.history_store.append(entry)
+            window_size = self.history_store.window_size
+        overflow = len(self.conversation_history) - window_size
+        if overflow > 0:
+            del self.conversation_history[:overflow]
+        return entry
+
+    def _truncate_history(self, length):
+        """Drop conversation_history[length:] from memory and from disk."""
+        absolute_length = self._history_base() + length
+        if self.history_store:
+            self.history_store.truncate(absolute_length)
+        if self.episodic_index:
+            # Exchanges that lost their reply are re-indexed once the new reply arrives
+            self.episodic_index.discard_from(absolute_length - 1)
+        del self.conversation_history[length:]
+
+    def _index_last_exchange(self):
+        """Queue the newest user/assistant pair for background embedding into the episodic index."""
+        if not self.episodic_index or len(self.conversation_history) < 2:
+            return
+        user_entry, bot_entry = self.conversation_history[-2], self.conversation_history[-1]
+        if user_entry.get("role") == "user" and bot_entry.get("role") == "assistant":
+            self.episodic_index.add_exchange(
+                self._last_history_index() - 1,
+                self._speaker_label("user"), user_entry.get("content", ""),
+                self._speaker_label("assistant"), bot_entry.get("content", ""),
+            )
+
+    def _close_session_files(self):
+        if self.history_store:
+            self.history_store.close()
+            self.history_store = None
+        if self.printout_log:
+            self.printout_log.close()
+            self.printout_log = None
+        if self.episodic_index:
+            self.episodic_index.close()
+            self.episodic_index = None
+
+    @staticmethod
+    def _open_history_store(session_folder, settings_data):
+        """Open the session's history, printout log and episodic index (worker thread; touches no widgets)."""
+        # Older sessions are migrated from chat.json here
+        history_store = HistoryStore(session_folder)
+        recent = history_store.recent()
+        printout_log = AppendLog(os.path.join(session_folder, "printout.txt"))
+        episodic_index = None
+        if settings_data.get("episodic_memory", True):
+            episodic_index = EpisodicIndex(session_folder, get_embedder, embedder_model_id())
+        return history_store, recent, printout_log, episodic_index
 
     def apply_theme_colors(self):
         entry_bg_color = self.controller.entry_bg_color
@@ -240,49 +345,42 @@ class ChatView(ctk.CTkFrame):
             font=font
         )
 
-    def save_session(self):
-        if not self.llm_character or not self.session_name:
-            messagebox.showerror("Missing Info", "Cannot save session without loaded character and session name.")
-            return
+    def _write_session_files(self, session_dir, session_name):
+        """Checkpoint the history journal and atomically write chat.json and session_info.json."""
+        if self.history_store:
+            self.history_store.compact()
 
-        # Confirm with user
-        confirm = messagebox.askyesno(
-            "Confirm Save",
-            "Warning: Saved bot posts cannot be retried after reloading.\n\nContinue with saving?"
-        )
-        if not confirm:
-            return
-
-        session_dir = os.path.join("Character", self.llm_character, "Sessions", self.session_name)
-        os.makedirs(session_dir, exist_ok=True)
-
-        # Save minimal chat.json
-        chat_path = os.path.join(session_dir, "chat.json")
         chat_data = {
-            "chat": self.chat_display.get("1.0", "end").strip(),
-            "conversation_history": self.conversation_history
+            "history_file": HISTORY_FILE,
+            "message_count": len(self.history_store) if self.history_store else len(self.conversation_history)
         }
-        with open(chat_path, "w", encoding="utf-8") as f:
-            json.dump(chat_data, f, indent=2)
+        atomic_write_json(os.path.join(session_dir, "chat.json"), chat_data)
 
-        # Save full session_info.json
-        info_path = os.path.join(session_dir, "session_info.json")
         info_data = {
             "llm_character": self.llm_character,
             "user_character": self.user_character,
-            "session_name": self.session_name,
+            "session_name": session_name,
             "scenario_file": self.scenario_file,
             "prefix_file": self.prefix_file
         }
-        with open(info_path, "w", encoding="utf-8") as f:
-            json.dump(info_data, f, indent=2)
+        atomic_write_json(os.path.join(session_dir, "session_info.json"), info_data)
+
+    def save_session(self):
+        if not self.llm_character or not self.session_name:
+            messagebox.showerror("Missing Info", "Cannot save session without loaded character and session name.")
+            return
+
+        # Messages are journaled as they happen; saving only checkpoints the journal
+        session_dir = os.path.join("Character", self.llm_character, "Sessions", self.session_name)
+        os.makedirs(session_dir, exist_ok=True)
+        self._write_session_files(session_dir, self.session_name)
 
-        messagebox.showinfo("Session Saved", f"Session saved to:\n{chat_path}\nand\n{info_path}")
+        messagebox.showinfo("Session Saved", f"Session saved to:\n{session_dir}")
 
     def confirm_back_to_main(self):
         if messagebox.askyesno(
             "Return to Main Menu",
-            "Are you sure you want to return to the main menu? Unsaved progress will be lost."
+            "Are you sure you want to return to the main menu? The chat history is saved automatically."
         ):
             self.reset_session_state()  # Clear old chat, characters, and memory
             self.controller.show_frame("StartMenu")
@@ -307,10 +405,8 @@ class ChatView(ctk.CTkFrame):
                     ""
                 ]
 
-                session_dir = os.path.join("Character", self.llm_character, "Sessions", self.session_name)
-                log_path = os.path.join(session_dir, "printout.txt")
-                with open(log_path, "a", encoding="utf-8") as f:
-                    f.write("\n".join(log_lines) + "\n")
+                if self.printout_log:
+                    self.printout_log.write("\n".join(log_lines) + "\n")
 
         settings = self.controller.frames["AdvancedSettings"]
         settings_data = settings.get_all_settings()
@@ -318,6 +414,10 @@ class ChatView(ctk.CTkFrame):
         user_input = self.entry.get("1.0", "end").strip()
         if not user_input:
             return
+        if self.turns and self.turns.pending(("send", user_input)):
+            print("[Session] That message is already being answered.")
+            return
+        self._clear_candidates()
 
         self.last_prompt = user_input
         self.entry.delete("1.0", "end")  # delete AFTER getting text
@@ -331,141 +431,180 @@ class ChatView(ctk.CTkFrame):
         self._thinking_dots = 0
         self._animate_thinking()
 
-        self.chat_display.configure(state="normal")
-        self.chat_display.insert("end", f"You: {user_input}\n\n", "user")
-        self.chat_display.configure(state="disabled")
+        self._append_history("user", user_input)
+        self.transcript.append_message(self._last_history_index(), "user", user_input)
 
         if settings_data.get("auto_scroll", True):
             self.chat_display.see("end")
 
-        self.conversation_history.append({"role": "user", "content": user_input})
-        if len(self.conversation_history) > 50:
-            self.conversation_history = self.conversation_history[-50:]
-
-        # Start background thread to fetch response
-        threading.Thread(
-            target=self.fetch_and_display_reply,
-            args=(user_input, settings_data, self.scenario, self.prefix)
-        ).start()
-
-        def fetch_and_display_reply(self, user_message, settings_data, scenario_ui, prefix_ui):
-            os.system("cls" if os.name == "nt" else "clear")
-            self.last_prompt = user_message
-
-            if "character_path" not in settings_data:
-                character_path = self.controller.active_session_data.get("character_path")
-                if not character_path:
-                    raise ValueError("character_path not found in active_session_data")
-                settings_data["character_path"] = character_path
-
-            # 1) Retrieve relevant memories
-            memory_objects, memory_debug_lines = retrieve_relevant_memories(
-                user_message,
-                self.memory_index,
-                self.memory_mapping,
-                self.embedder,
-                self.lemmatizer,
-                settings_data,
-                self.debug_mode
-            )
-
-            # 2) Compute trimmed history (we only need the slice for RAW)
-            _msgs_preview, filtered_history = self.conversation_service.build_chat_messages(
-                self.conversation_history,
-                self.scenario,
-                self.prefix,
-                memory_objects,
-                self.llm_character_config,
-                self.user_character_config
-            )
-
-            # 3) Build and save RAW PROMPT INPUT (only memories + rolling history)
-            raw_blob = self.conversation_service.build_raw_prompt_input(
-                memories=memory_objects,
-                trimmed_history=filtered_history,
-            )
-
-            try:
-                session_dir = os.path.join("Character", self.llm_character, "Sessions", self.session_name)
-                os.makedirs(session_dir, exist_ok=True)
-                raw_path = os.path.join(session_dir, "Raw Prompt Input.txt")
-                with open(raw_path, "w", encoding="utf-8") as f:
-                    f.write(raw_blob)
-                print(f"[Saved] {raw_path}")
-            except Exception as e:
-                print(f"[WARN] Could not save Raw Prompt Input: {e}")
-
-            # 4) Summarize raw to ~25% using the user's latest message and the prefix
-            enable_sum = settings_data.get("enable_summarization", True)
-            if enable_sum:
-                summary_text = self.conversation_service.summarize_text(
-                    raw_text=raw_blob,
-                    settings_data=settings_data,
-                    user_message=user_message,
-                    prefix=self.prefix,
-                )
-            else:
-                summary_text = raw_blob  # explicit bypass
-
-            # 5) Build final messages: scenario + prefix + character configs + summary + latest user msg
-            final_messages = self.conversation_service.compose_final_messages(
-                summary_text=summary_text,
-                scenario=self.scenario,
-                prefix=self.prefix,
-                llm_character_config=self.llm_character_config,
-                user_character_config=self.user_character_config,
-                user_message=user_message
-            )
+        # Retrieval, summaries and the LLM call run on the scheduler
+        self._start_turn(
+            ("send", user_input),
+            self.fetch_and_display_reply, user_input, settings_data, self.scenario, self.prefix,
+            on_cancelled=lambda: self._withdraw_user_message(user_input),
+        )
 
-            # 6) Build payload for the final generation
-            payload = self.conversation_service.build_payload(prompt="", settings_data=settings_data)
-            payload["messages"] = final_messages
+    def _handle_llm_response(self, prompt, payload, user_message, settings_data=None, cancel=None):
+        self.conversation_service.use_settings_snapshot(settings_data)
+        self.conversation_service.use_cancel_token(cancel)
+        self.conversation_service.usage.begin_turn()
+        replies = self.conversation_service.fetch_replies(payload, *self._candidate_settings(settings_data or {}))
+        print("[DEBUG] Raw reply returned by LLM:", repr(replies[0]))
+        return replies
 
-            # Save for retry functionality (store summary as the "prompt" snapshot)
-            self.last_built_prompt = summary_text
-            self.last_payload_used = payload
-            self.memory_debug_lines = memory_debug_lines
-            self.selected_memories = [m.get("memory_id", "???") for m in memory_objects]
+    def _start_turn(self, key, fn, *args, on_cancelled=None):
+        """
+        Queue a turn on the session's TurnExecutor (serialized, de-duplicated by `key`,
+        stoppable, bounded by llm_turn_deadline). The reply comes back to _finish_reply
+        on the Tk thread; on_cancelled undoes the turn if it is stopped or fails.
+        """
+        if not self.turns:
+            print("[Error] No session is open.")
+            return
+        token = self._load_token
+        settings_data = self.controller.frames["AdvancedSettings"].get_all_settings()
+        self.turns.submit(
+            key, fn, *args,
+            on_done=lambda reply: self._finish_reply(token, reply),
+            on_error=lambda e: self._turn_failed(token, e, on_cancelled),
+            on_cancelled=lambda: self._turn_cancelled(token, on_cancelled),
+            timeout=settings_data.get("llm_turn_deadline", DEFAULT_TURN_DEADLINE),
+        )
+        self.stop_button.configure(state="normal")
 
-            # Include names for debug printing
-            token_stats = getattr(self.conversation_service, "last_token_stats", {})
-            settings_data["llm_character"] = self.controller.active_session_data.get("llm_character", "(not set)")
-            settings_data["user_character"] = self.controller.active_session_data.get("user_character", "(not set)")
+    def _turn_settled(self):
+        if not (self.turns and self.turns.busy()):
+            self.stop_button.configure(state="disabled")
 
-            # 7) Kick off the call
-            thread = threading.Thread(
-                target=lambda: self._handle_llm_response(summary_text, payload, user_message)
-            )
-            thread.start()
+    def _finish_reply(self, token, replies):
+        """Record the first reply in the history and render it; keep the rest for Try Again (Tk thread)."""
+        if token != self._load_token:
+            print("[Session] Dropped a reply for a session that is no longer open.")
+            return
+        self._turn_settled()
+        self._record_reply(replies[0])
+        self._clear_candidates()
+        self._candidates_turn = self._last_history_index() - 1
+        self.reply_candidates = list(replies[1:])
+        self._refill_candidates()
+
+    def _record_reply(self, reply):
+        self._append_history("assistant", reply)
+        self._index_last_exchange()
+        self._display_reply(reply, self._last_history_index())
+
+    # --- Reply candidates ---
+    @staticmethod
+    def _candidate_settings(settings_data):
+        """(replies generated per turn, whether to ask the backend for them with `n`)."""
+        try:
+            n = max(1, int(settings_data.get("reply_candidates", 1)))
+        except (ValueError, TypeError):
+            n = 1
+        return n, bool(settings_data.get("reply_candidates_use_n", True))
+
+    def _clear_candidates(self):
+        if self._refill_cancel:
+            self._refill_cancel.cancel()
+            self._refill_cancel = None
+        self.reply_candidates = []
+        self._candidates_turn = None
+
+    def _refill_candidates(self):
+        """
+        Generate the missing alternatives in the background: after a reply is shown
+        (the turn only waits for the first) and after Try Again used one.
+        """
+        settings_data = self.controller.frames["AdvancedSettings"].get_all_settings()
+        n, use_n = self._candidate_settings(settings_data)
+        wanted = n - 1 - len(self.reply_candidates)
+        if wanted <= 0 or self._refill_cancel or self._candidates_turn is None or not self.last_payload_used:
+            return
 
-    def _handle_llm_response(self, prompt, payload, user_message):
-        reply = self.conversation_service.fetch_reply(
-            payload, self.conversation_history, prompt, debug_mode=self.debug_mode
-        )
-        self.after(0, lambda: self._display_reply(reply))
-        self.conversation_history.append({"role": "assistant", "content": reply})
-        if len(self.conversation_history) > 10:
-            self.conversation_history = self.conversation_history[-10:]
-        print("[DEBUG] Raw reply returned by LLM:", repr(reply))
+        cancel = CancelToken()
+        self._refill_cancel = cancel
+        turn, payload = self._candidates_turn, self.last_payload_used
+        service = self.conversation_service
 
-    def _display_reply(self, reply):
-        self.print_memory_debug()
+        def generate():
+            service.use_settings_snapshot(settings_data)
+            service.use_cancel_token(cancel)
+            try:
+                return service.fetch_replies(payload, wanted, use_n, stage="alternatives")
+            finally:
+                service.use_settings_snapshot(None)
+                service.use_cancel_token(None)
 
-        # Remove thinking line or tag
-        try:
-            self.chat_display.configure(state="normal")
+        def refilled(replies):
+            if cancel is not self._refill_cancel or turn != self._candidates_turn:
+                return
+            self._refill_cancel = None
+            self.reply_candidates.extend(replies)
+            if replies:
+                # Backends that ignore `n` return one reply per request
+                self._refill_candidates()
+
+        def refill_failed(error):
+            # Background extras only: Try Again still works, it just generates on demand
+            print(f"[Retry] Could not pre-generate alternatives: {error}")
+            if cancel is self._refill_cancel:
+                self._refill_cancel = None
+
+        self.controller.scheduler.run(generate, on_done=refilled, on_error=refill_failed)
+
+    def _turn_failed(self, token, error, on_cancelled=None):
+        print(f"[Error] Reply failed: {error}")
+        if token != self._load_token:
+            return
+        self._turn_settled()
+        self._stop_thinking()
+        if on_cancelled:
+            on_cancelled()
+        self.entry.configure(state="normal")
+        self.set_entry_buttons_state("normal")
+        messagebox.showerror("Reply Failed", self._describe_llm_error(error))
+
+    @staticmethod
+    def _describe_llm_error(error):
+        if isinstance(error, LLMDeadlineExceeded):
+            return "The model took too long to answer (llm_turn_deadline)."
+        if isinstance(error, CircuitOpenError):
+            return "The model server keeps failing and is paused for a moment. Please try again shortly."
+        if isinstance(error, LLMHTTPError) and not error.retryable:
+            return f"The model server rejected the request:\n{str(error)[:300]}"
+        if isinstance(error, LLMError):
+            return f"The model server could not be reached or is overloaded:\n{str(error)[:300]}"
+        return f"Generating the reply failed:\n{error}"
+
+    def _turn_cancelled(self, token, on_cancelled=None):
+        print("[Session] Generation stopped.")
+        if token != self._load_token:
+            return
+        self._turn_settled()
+        self._stop_thinking()
+        if on_cancelled:
+            on_cancelled()
+        self.entry.configure(state="normal")
+        self.set_entry_buttons_state("normal")
 
-            # Remove (Thinking...) if it exists
-            index = self.chat_display.search("(Thinking...)", "1.0", "end")
-            if index:
-                line_end = f"{index} lineend+1c"
-                self.chat_display.delete(index, line_end)
+    def _withdraw_user_message(self, user_input):
+        """A stopped send: take the unanswered message back out of the history and into the entry box."""
+        if not self.conversation_history:
+            return
+        last = self.conversation_history[-1]
+        if last.get("role") != "user" or last.get("content") != user_input:
+            return
+        index = self._last_history_index()
+        self._truncate_history(len(self.conversation_history) - 1)
+        self.transcript.remove_from(index)
+        if not self.entry.get("1.0", "end").strip():
+            self.entry.insert("1.0", user_input)
 
-            # Remove tag range if defined
-            self.chat_display.delete("thinking_tag.first", "thinking_tag.last")
-        except Exception:
-            pass
+    def stop_generation(self):
+        if self.turns and self.turns.stop():
+            print("[Session] Stopping generation...")
 
+    def _stop_thinking(self):
         # Stop spinner animation
         if self._thinking_anim_id:
             self.after_cancel(self._thinking_anim_id)
@@ -476,21 +615,12 @@ class ChatView(ctk.CTkFrame):
             self.thinking_label.destroy()
             self.thinking_label = None
 
-        # Insert full trimmed conversation into chat display
-        self.chat_display.delete("1.0", "end")
-
-        for entry in self.conversation_history:
-            role = entry.get("role", "")
-            content = entry.get("content", "").strip()
-            name = (
-                self.user_character_config.get("name", "You")
-                if role == "user"
-                else self.llm_character_config.get("name", "Bot")
-            )
-            tag = "user" if role == "user" else "bot"
-            self.chat_display.insert("end", f"{name}: {content}\n\n", tag)
+    def _display_reply(self, reply, index):
+        self.print_memory_debug()
+        self._stop_thinking()
 
-        self.chat_display.configure(state="disabled")
+        # Append just the new reply; earlier messages are already on screen
+        self.transcript.append_message(index, "assistant", reply)
 
         # Scroll if setting enabled
         if self.controller.frames["AdvancedSettings"].get_auto_scroll():
@@ -506,7 +636,12 @@ class ChatView(ctk.CTkFrame):
             self.load_character_assets()
             self.chat_initialized = True
 
-    def load_session_assets(self, force_reload=False):
+    def load_session_assets(self, force_reload=False, on_loaded=None):
+        """
+        Load the active session's characters, scenario, prefix, memory index and
+        history. Files and indexes are read on the scheduler while a progress label
+        is shown; the results are applied on the Tk thread, then on_loaded() runs.
+        """
         session = getattr(self.controller, "active_session_data", None)
         if not session:
             print("[Error] No active session data.")
@@ -517,128 +652,188 @@ class ChatView(ctk.CTkFrame):
         self.user_character = session.get("user_character", "")
         self.session_name = session.get("session_name", "")
 
-        char_name = self.llm_character
-        user_char = self.user_character
-        session_folder = os.path.join("Character", char_name, "Sessions", self.session_name)
-
-        if not char_name or not user_char:
+        if not self.llm_character or not self.user_character:
             print("[Error] Missing character or user character in session data.")
             return
 
-        # Load user character config and apply color
+        self._load_token += 1
+        token = self._load_token
+        self.chat_initialized = True
+        if self.turns:
+            self.turns.close()
+        self.turns = TurnExecutor(self.controller.scheduler)
+        self.conversation_service.usage.reset()
+        self._show_loading(f"Loading {self.llm_character}...")
+        self.controller.scheduler.run(
+            self._read_session_assets,
+            dict(session),
+            self.controller.frames["AdvancedSettings"].get_all_settings(),
+            on_done=lambda assets: self._apply_session_assets(token, assets, on_loaded),
+            on_error=lambda e: self._session_load_failed(token, e),
+            on_progress=lambda step: self._update_loading(token, step),
+        )
+
+    def _read_session_assets(self, session, settings_data, progress):
+        """Worker side of load_session_assets: all file and index reads, no widgets or view state."""
+        char_name = session.get("llm_character", "")
+        user_char = session.get("user_character", "")
+        path = os.path.join("Character", char_name)
+        assets = {
+            "user_character_config": None,
+            "llm_character_config": {"name": "Bot"},
+            "scenario_data": {},
+            "prefix_data": {},
+            "memory_index": None,
+            "memory_mapping": [],
+            "memory_attributes": None,
+            "history": None,
+        }
+
+        progress("characters")
+        # Load user character config
         user_path = os.path.join("Character", user_char, "character_config.json")
         if os.path.exists(user_path):
-            with open(user_path, "r", encoding="utf-8") as f:
-                self.user_character_config = json.load(f)
-            user_color = self.user_character_config.get("text_color", "#00ccff")
-            self.chat_display.tag_config("user", foreground=user_color)
+            assets["user_character_config"] = read_json(user_path, {})
 
-        # Load and store LLM character config
-        llm_path = os.path.join("Character", char_name, "character_config.json")
+        # Load LLM character config
+        llm_path = os.path.join(path, "character_config.json")
         if os.path.exists(llm_path):
-            with open(llm_path, "r", encoding="utf-8") as f:
-                self.llm_character_config = json.load(f)
-        else:
-            self.llm_character_config = {"name": "Bot"}
+            assets["llm_character_config"] = read_json(llm_path, {})
 
-        path = os.path.join("Character", char_name)
-        config_path = os.path.join(path, "character_config.json")
+        # Load scenario and prefix from selected files
+        scenario_file = session.get("scenario_file")
+        prefix_file = session.get("prefix_file")
+        scenario_path = os.path.join(path, "Scenarios", scenario_file) if scenario_file else None
+        prefix_path = os.path.join(path, "Prefix", prefix_file) if prefix_file else None
+        try:
+            if scenario_path and os.path.exists(scenario_path):
+                assets["scenario_data"] = read_json(scenario_path, {})
+                print(f"[Session] Loaded scenario: {scenario_file}")
+            if prefix_path and os.path.exists(prefix_path):
+                assets["prefix_data"] = read_json(prefix_path, {})
+                print(f"[Session] Loaded prefix: {prefix_file}")
+        except Exception as e:
+            print(f"[Warning] Failed to load scenario or prefix: {e}")
+
+        progress("memory index")
         index_path = os.path.join(path, "memory_index.faiss")
         mapping_path = os.path.join(path, "memory_mapping.json")
-
-        if self.llm_character_config:
-            self.character_color = self.llm_character_config.get("text_color", "#ffeb0f")
-            self.chat_display.tag_config("bot", foreground=self.character_color)
-
-            # Load scenario and prefix from selected files
-            scenario_file = session.get("scenario_file")
-            prefix_file = session.get("prefix_file")
-            self.scenario_file = scenario_file or ""
-            self.prefix_file = prefix_file or ""
-            scenario_path = os.path.join("Character", char_name, "Scenarios", scenario_file) if scenario_file else None
-            prefix_path = os.path.join("Character", char_name, "Prefix", prefix_file) if prefix_file else None
-
-            try:
-                if scenario_path and os.path.exists(scenario_path):
-                    self.loaded_scenario_data = {}
-                    if scenario_path and os.path.exists(scenario_path):
-                        with open(scenario_path, "r", encoding="utf-8") as f:
-                            self.loaded_scenario_data = json.load(f)
-                            self.scenario = self.loaded_scenario_data.get("content", "").strip()
-                            print(f"[Session] Loaded scenario: {scenario_file}")
-
-                    print(f"[Session] Loaded scenario: {scenario_file}")
-
-                if prefix_path and os.path.exists(prefix_path):
-                    self.loaded_prefix_data = {}
-                    if prefix_path and os.path.exists(prefix_path):
-                        with open(prefix_path, "r", encoding="utf-8") as f:
-                            self.loaded_prefix_data = json.load(f)
-                            self.prefix = self.loaded_prefix_data.get("content", "").strip()
-                            print(f"[Session] Loaded prefix: {prefix_file}")
-                    print(f"[Session] Loaded prefix: {prefix_file}")
-            except Exception as e:
-                print(f"[Warning] Failed to load scenario or prefix: {e}")
-
         if os.path.exists(index_path) and os.path.exists(mapping_path):
-            self.memory_index = faiss.read_index(index_path)
+            assets["memory_index"] = load_memory_index(path)
             with open(mapping_path, "r", encoding="utf-8") as f:
-                self.memory_mapping = json.load(f)
+                assets["memory_mapping"] = json.load(f)
+            assets["memory_attributes"] = MemoryAttributes.load(path, assets["memory_mapping"])
+            check_index_model(path)
         else:
             print("[Warning] Memory index or mapping file missing.")
 
-        if not self.chat_display.get("1.0", "end").strip():
-            self.chat_display.configure(state="normal")
-            self.chat_display.insert("end", f"--- {char_name} loaded ---\nScenario: {self.scenario}\n\n")
-            self.chat_display.configure(state="disabled")
+        progress("chat history")
+        session_folder = os.path.join(path, "Sessions", session.get("session_name", ""))
+        try:
+            assets["history"] = self._open_history_store(session_folder, settings_data)
+        except Exception as e:
+            print(f"[Warning] Failed to load chat history: {e}")
+        assets["settings_data"] = settings_data
+        return assets
+
+    def _apply_session_assets(self, token, assets, on_loaded=None):
+        """Tk side of load_session_assets: install what the worker read and update the display."""
+        if token != self._load_token:
+            # The user left or switched sessions while this one was loading
+            if assets.get("history"):
+                history_store, _recent, printout_log, episodic_index = assets["history"]
+                for resource in (history_store, printout_log, episodic_index):
+                    if resource:
+                        resource.close()
+            return
 
-        # Load chat history if chat.json exists
-        chat_json_path = os.path.join(session_folder, "chat.json")
-        if os.path.exists(chat_json_path):
-            try:
-                with open(chat_json_path, "r", encoding="utf-8") as f:
-                    saved = json.load(f)
-                self.conversation_history = saved.get("conversation_history", [])
-                print(f"[Session] Loaded chat history ({len(self.conversation_history)} messages).")
-            except Exception as e:
-                print(f"[Warning] Failed to load chat history: {e}")
+        session = self.controller.active_session_data
+        self.scenario_file = session.get("scenario_file") or ""
+        self.prefix_file = session.get("prefix_file") or ""
 
-        self.chat_initialized = True
+        if assets["user_character_config"] is not None:
+            self.user_character_config = assets["user_character_config"]
+            user_color = self.user_character_config.get("text_color", "#00ccff")
+            self.chat_display.tag_config("user", foreground=user_color)
 
-    def render_conversation_to_display(self):
-        self.chat_display.configure(state="normal")
-        self.chat_display.delete("1.0", "end")
-
-        # Fallback label if user character is not defined
-        session = getattr(self.controller, "active_session_data", {})
-        user_label = session.get("user_character", "You")
-        bot_label = session.get("llm_character", self.controller.selected_character)
-
-        for entry in self.conversation_history:
-            role = entry.get("role")
-            content = entry.get("content", "")
-            if role == "user":
-                tag = "user"
-                label = user_label
-            else:
-                tag = "bot"
-                label = bot_label
+        self.llm_character_config = assets["llm_character_config"]
+        if self.llm_character_config:
+            self.character_color = self.llm_character_config.get("text_color", "#ffeb0f")
+            self.chat_display.tag_config("bot", foreground=self.character_color)
+            if assets["scenario_data"]:
+                self.loaded_scenario_data = assets["scenario_data"]
+                self.scenario = self.loaded_scenario_data.get("content", "").strip()
+                self.memory_filter = self.loaded_scenario_data.get("memory_filter")
+            if assets["prefix_data"]:
+                self.loaded_prefix_data = assets["prefix_data"]
+                self.prefix = self.loaded_prefix_data.get("content", "").strip()
+
+        if assets["memory_index"] is not None:
+            self.memory_index = assets["memory_index"]
+            self.memory_mapping = assets["memory_mapping"]
+            self.memory_attributes = assets["memory_attributes"]
+
+        if not self.chat_display.get("1.0", "2.0").strip():
+            self.transcript.set_block("banner", f"--- {self.llm_character} loaded ---\nScenario: {self.scenario}\n\n")
+
+        if assets["history"]:
+            self._close_session_files()
+            self.history_store, self.conversation_history, self.printout_log, self.episodic_index = assets["history"]
+
+            # Only a window of the transcript lives in the textbox; older messages page in on scroll
+            self.transcript.attach_source(
+                self.history_store.get_range,
+                self.history_store.__len__,
+                assets["settings_data"].get("transcript_window", 200),
+            )
+            if self.episodic_index:
+                # Exchanges from before the index existed are embedded in the background
+                self.episodic_index.catch_up(
+                    self.history_store, self._speaker_label("user"), self._speaker_label("assistant")
+                )
+            print(f"[Session] Loaded chat history ({len(self.history_store)} messages, "
+                  f"{len(self.conversation_history)} in memory).")
 
-            self.chat_display.insert("end", f"{label}: ", tag)
-            self.chat_display.insert("end", content.strip() + "\n\n", tag)
+        self._hide_loading()
+        if on_loaded:
+            on_loaded()
 
-        self.chat_display.configure(state="disabled")
+    def _session_load_failed(self, token, error):
+        if token != self._load_token:
+            return
+        self._hide_loading()
+        messagebox.showerror("Load Failed", f"Could not load the session:\n{error}")
+
+    def _show_loading(self, text):
+        if not self.loading_label:
+            self.loading_label = ctk.CTkLabel(self.entry.master, font=self.get_ui_font())
+            self.loading_label.pack(pady=(0, 5))
+        self.loading_label.configure(text=text)
+        self.entry.configure(state="disabled")
+        self.set_entry_buttons_state("disabled")
+
+    def _update_loading(self, token, step):
+        if token == self._load_token and self.loading_label:
+            self.loading_label.configure(text=f"Loading {self.llm_character}: {step}...")
+
+    def _hide_loading(self):
+        if self.loading_label:
+            self.loading_label.destroy()
+            self.loading_label = None
+        self.entry.configure(state="normal")
+        self.set_entry_buttons_state("normal")
+
+    def render_conversation_to_display(self):
+        """Full render of the in-memory history (on load); turns update the display incrementally."""
+        self.transcript.render(self.conversation_history, self._history_base())
         self.chat_display.see("end")  # Auto-scroll to most recent message
 
     def reset_chat(self):
         self.chat_initialized = False
-        self.chat_display.configure(state="normal")
-        self.chat_display.delete("1.0", "end")
-        self.chat_display.configure(state="disabled")
+        self.transcript.clear()
         self.entry.delete("1.0", "end")
 
-        self.load_session_assets(force_reload=True)
-        self.conversation_history.clear()
+        self.load_session_assets(force_reload=True, on_loaded=lambda: self.conversation_history.clear())
         self.last_prompt = None
 
     def _animate_thinking(self):
@@ -652,8 +847,23 @@ class ChatView(ctk.CTkFrame):
 
     def reset_session_state(self):
         self.chat_initialized = False
-        self.conversation_history.clear()
+        self._load_token += 1  # pending loads and replies belong to the old session
+        self._clear_candidates()
+        if self.turns:
+            self.turns.close()
+            self.turns = None
+        if hasattr(self, "stop_button"):
+            self.stop_button.configure(state="disabled")
+        self._close_session_files()
+        if hasattr(self, "transcript"):
+            self.transcript.detach_source()
+        self._stop_thinking()
+        if self.loading_label:
+            self._hide_loading()
+        self.conversation_service.last_rolling_count = None
+        self.conversation_history = []
         self.scenario = ""
+        self.memory_filter = None
         self.prefix = ""
         self.last_prompt = None
         self.last_payload_used = None
@@ -661,10 +871,11 @@ class ChatView(ctk.CTkFrame):
         self.selected_memories = []
         self.memory_debug_lines = []
 
-        if hasattr(self, "chat_display"):
-            self.chat_display.configure(state="normal")
-            self.chat_display.delete("1.0", "end")
-            self.chat_display.configure(state="disabled")
+        if hasattr(self, "transcript"):
+            self.transcript.clear()
+        if self.editing_reply:
+            self.editing_reply = False
+            self.edit_button.configure(text="Edit Reply")
 
         if hasattr(self, "entry"):
             self.entry.delete("1.0", "end")
@@ -697,8 +908,7 @@ class ChatView(ctk.CTkFrame):
 
         # Store active session and load assets
         self.controller.active_session_data = session_data
-        self.load_session_assets(force_reload=True)
-        self.render_conversation_to_display()
+        self.load_session_assets(force_reload=True, on_loaded=self.render_conversation_to_display)
 
     def prompt_and_load_session_folder(self):
         char_name = self.llm_character or self.controller.selected_character
@@ -748,26 +958,11 @@ class ChatView(ctk.CTkFrame):
 
         os.makedirs(new_session_dir, exist_ok=True)
 
-        # Save chat.json
-        chat_path = os.path.join(new_session_dir, "chat.json")
-        chat_data = {
-            "chat": self.chat_display.get("1.0", "end").strip(),
-            "conversation_history": self.conversation_history
-        }
-        with open(chat_path, "w", encoding="utf-8") as f:
-            json.dump(chat_data, f, indent=2)
-
-        # Save session_info.json
-        info_path = os.path.join(new_session_dir, "session_info.json")
-        info_data = {
-            "llm_character": self.llm_character,
-            "user_character": self.user_character,
-            "session_name": new_name,
-            "scenario_file": self.scenario_file,
-            "prefix_file": self.prefix_file
-        }
-        with open(info_path, "w", encoding="utf-8") as f:
-            json.dump(info_data, f, indent=2)
+        # Copy the full on-disk history, then write the session files
+        if self.history_store:
+            self.history_store.sync()
+            shutil.copyfile(self.history_store.path, os.path.join(new_session_dir, HISTORY_FILE))
+        self._write_session_files(new_session_dir, new_name)
 
         messagebox.showinfo("Session Saved", f"Session saved as '{new_name}'.")
 
@@ -851,7 +1046,12 @@ class ChatView(ctk.CTkFrame):
             print(f"[WARN] summarize_memories failed: {e}")
             return raw_mems
 
-    def fetch_and_display_reply(self, user_message, settings_data, scenario_ui, prefix_ui):
+    def fetch_and_display_reply(self, user_message, settings_data, scenario_ui, prefix_ui, cancel=None):
+        """Turn pipeline (TurnExecutor worker): returns the reply; _finish_reply records and shows it."""
+        self.conversation_service.use_settings_snapshot(settings_data)
+        self.conversation_service.use_cancel_token(cancel)
+        self.conversation_service.usage.begin_turn()
+
         # 1) Ensure character_path is present
         if "character_path" not in settings_data:
             character_path = self.controller.active_session_data.get("character_path")
@@ -859,7 +1059,12 @@ class ChatView(ctk.CTkFrame):
                 raise ValueError("character_path not found in active_session_data")
             settings_data["character_path"] = character_path
 
-        # 2) Retrieve memories
+        # 2) Retrieve memories (and past exchanges that left the rolling window)
+        settings_data["episodic_exclude_from"] = self.conversation_service.episodic_cutoff(
+            self._last_history_index() + 1
+        )
+        if self.memory_filter:
+            settings_data["memory_filter"] = self.memory_filter
         memory_objects, memory_debug_lines = retrieve_relevant_memories(
             user_message,
             self.memory_index,
@@ -867,10 +1072,14 @@ class ChatView(ctk.CTkFrame):
             self.embedder,
             self.lemmatizer,
             settings_data,
-            self.debug_mode
+            self.debug_mode,
+            episodic_index=self.episodic_index,
+            memory_attributes=self.memory_attributes
         )
         self.memory_debug_lines = memory_debug_lines
         self.selected_memories = [m.get("memory_id", "???") for m in memory_objects]
+        if cancel is not None and cancel.cancelled:
+            return None
 
         # HOOK: store for later human-readable formatting
         self.controller.last_retrieved_memories = memory_objects
@@ -918,6 +1127,8 @@ class ChatView(ctk.CTkFrame):
             print(f"[WARN] Could not save Rolling Memory Summary: {e}")
 
         self.conversation_service.last_rolling_summary = hist_summary_text
+        if cancel is not None and cancel.cancelled:
+            return None
 
         # 6) Build and save Raw Retrieved Memories (with your instruction sections)
         raw_mems = self.conversation_service.build_raw_memories_input(
@@ -956,6 +1167,8 @@ class ChatView(ctk.CTkFrame):
 
         # Always stash the latest memory summary, even if it is "(no relevant memories)"
         self.conversation_service.last_memory_summary = mems_summary_text
+        if cancel is not None and cancel.cancelled:
+            return None
 
         # Save RAG Memory Output (the monologue)
         try:
@@ -1052,12 +1265,6 @@ class ChatView(ctk.CTkFrame):
         self.last_built_prompt = final_user_content
         self.last_payload_used = payload
 
-        # 10) Call LLM and display
-        reply = self.conversation_service.fetch_reply(
-            payload, self.conversation_history, final_user_content, debug_mode=self.debug_mode
-        )
-        self.after(0, lambda: self._display_reply(reply))
-        self.conversation_history.append({"role": "assistant", "content": reply})
-        if len(self.conversation_history) > 10:
-            self.conversation_history = self.conversation_history[-10:]
+        # 10) Call LLM; any extra candidates are kept for Try Again (displayed by _finish_reply on the Tk thread)
+        return self.conversation_service.fetch_replies(payload, *self._candidate_settings(settings_data))
         print("[DEBUG] Raw reply returned by LLM:", repr(reply))
\ No newline at end of file
@@ -0,0 +1,324 @@
+"""
+transcript_renderer.py
+
+Incremental rendering of the conversation into the chat textbox.
+
+Every rendered message is bracketed by Tk marks, so the renderer always knows
+the text range of each message (and of its content, without the "Name: " label).
+New messages are appended at the end, the last reply is replaced in place and
+edits are read back by range, so the cost of a turn does not depend on how
+long the conversation already is.
+
+With a message source attached (attach_source), the transcript is virtualized:
+only the newest `max_rendered` messages are materialized in the widget, older
+ones are paged in from the session's history store as the user scrolls to the
+top, and the far end is trimmed so the widget never grows past the cap.
+"""
+from contextlib import contextmanager
+
+
+class TranscriptRenderer:
+    """
+    Keeps a per-message index of text ranges in a textbox.
+
+    Messages are keyed by their absolute index in the session history. Marks:
+      <id>.start / <id>.end   - whole block, "Name: content\\n\\n"
+      <id>.cs / <id>.ce       - the content only (what gets edited)
+    The content-end mark has right gravity so text typed at the end of a reply
+    during an edit stays inside the reply's range.
+    """
+
+    # Fraction of the scroll range from an edge at which the next page is loaded
+    SCROLL_EDGE = 0.02
+
+    def __init__(self, textbox, label_for_role, max_rendered=0, page_size=50):
+        self.textbox = textbox
+        # CTkTextbox wraps a tk.Text; use the raw widget for marks and compare()
+        self.text = getattr(textbox, "_textbox", textbox)
+        self.label_for_role = label_for_role
+        self._messages = {}   # absolute index -> (mark id, role)
+        self._order = []      # absolute indices, in display order
+        self._blocks = {}     # block name -> mark id (non-message text, e.g. debug report)
+        self._serial = 0
+
+        # Virtualization (off until attach_source is called with max_rendered > 0)
+        self.max_rendered = max_rendered
+        self.page_size = max(1, int(page_size))
+        self._fetch_range = None   # (start, stop) -> list of history entries
+        self._total_count = None   # () -> number of messages in the session
+        self._scroll_hooked = False
+        self._paging = False
+
+    # --- Helpers ---
+    def _new_id(self, prefix):
+        self._serial += 1
+        return f"{prefix}{self._serial}"
+
+    def _set_mark(self, name, index, gravity="left"):
+        self.text.mark_set(name, index)
+        self.text.mark_gravity(name, gravity)
+
+    def _unset_marks(self, mark_id, parts):
+        for part in parts:
+            self.text.mark_unset(f"{mark_id}.{part}")
+
+    @contextmanager
+    def _writable(self):
+        """The textbox is read-only except while being written (or while a reply is edited)."""
+        previous = self.text.cget("state")
+        self.textbox.configure(state="normal")
+        try:
+            yield
+        finally:
+            self.textbox.configure(state=previous)
+
+    def _insert_message(self, index, role, content):
+        """Append one message block at the end of the textbox and mark its ranges."""
+        self._set_mark("vend", "end-1c", "right")
+        self._insert_message_at("vend", index, role, content)
+        self.text.mark_unset("vend")
+
+    def _insert_message_at(self, cursor, index, role, content):
+        """Insert one message block at a right-gravity cursor mark and mark its ranges."""
+        tag = "user" if role == "user" else "bot"
+        mark_id = self._new_id("msg")
+        text = self.text
+
+        start = text.index(cursor)
+        text.insert(cursor, f"{self.label_for_role(role)}: ", tag)
+        cs = text.index(cursor)
+        text.insert(cursor, content, tag)
+        ce = text.index(cursor)
+        text.insert(cursor, "\n\n", tag)
+        end = text.index(cursor)
+
+        self._set_mark(f"{mark_id}.start", start)
+        self._set_mark(f"{mark_id}.cs", cs)
+        self._set_mark(f"{mark_id}.ce", ce, "right")
+        self._set_mark(f"{mark_id}.end", end)
+        self._messages[index] = (mark_id, role)
+        return mark_id
+
+    # --- Whole transcript ---
+    def clear(self):
+        with self._writable():
+            self.text.delete("1.0", "end")
+        for mark_id, _role in self._messages.values():
+            self._unset_marks(mark_id, ("start", "cs", "ce", "end"))
+        for mark_id in self._blocks.values():
+            self._unset_marks(mark_id, ("start", "end"))
+        self._messages.clear()
+        self._order.clear()
+        self._blocks.clear()
+
+    def render(self, entries, start_index=0):
+        """Replace the transcript with `entries` (absolute indices start at start_index)."""
+        if self.virtual:
+            self.render_tail()
+            return
+        self.clear()
+        with self._writable():
+            for offset, entry in enumerate(entries):
+                index = start_index + offset
+                self._insert_message(index, entry.get("role", ""), (entry.get("content") or "").strip())
+                self._order.append(index)
+
+    def render_tail(self):
+        """Virtual mode: show the newest page of the session, fetched from the source."""
+        total = self._total_count()
+        start = max(0, total - min(self.page_size, self.max_rendered))
+        self.clear()
+        with self._writable():
+            for offset, entry in enumerate(self._fetch_range(start, total)):
+                self._insert_message(start + offset, entry.get("role", ""), (entry.get("content") or "").strip())
+                self._order.append(start + offset)
+
+    # --- Messages ---
+    def has_message(self, index) -> bool:
+        return index in self._messages
+
+    def append_message(self, index, role, content):
+        if index in self._messages:
+            self.replace_message(index, content)
+            return
+        if self.virtual and self._order and self._order[-1] != index - 1:
+            # The user paged far back and the live end is not materialized; jump to it
+            self.render_tail()
+            return
+        with self._writable():
+            self._insert_message(index, role, (content or "").strip())
+        self._order.append(index)
+        if self.virtual and len(self._order) > self.max_rendered:
+            self._trim_top(len(self._order) - self.max_rendered)
+
+    def replace_message(self, index, content):
+        """Swap a message's content in place, leaving everything around it untouched."""
+        mark_id, role = self._messages[index]
+        tag = "user" if role == "user" else "bot"
+        with self._writable():
+            self.text.delete(f"{mark_id}.cs", f"{mark_id}.ce")
+            self.text.insert(f"{mark_id}.cs", (content or "").strip(), tag)
+
+    def remove_from(self, index):
+        """Remove message `index` and everything rendered after it."""
+        if index not in self._messages:
+            return
+        mark_id, _role = self._messages[index]
+        cut = self.text.index(f"{mark_id}.start")
+        with self._writable():
+            self.text.delete(cut, "end")
+
+        keep = []
+        for i in self._order:
+            if i >= index:
+                self._unset_marks(self._messages.pop(i)[0], ("start", "cs", "ce", "end"))
+            else:
+                keep.append(i)
+        self._order = keep
+        for name, block_id in list(self._blocks.items()):
+            if self.text.compare(f"{block_id}.start", ">=", cut):
+                self._unset_marks(block_id, ("start", "end"))
+                del self._blocks[name]
+
+    def content_range(self, index):
+        """(start, end) text indices of a message's content, for highlighting and edits."""
+        mark_id, _role = self._messages[index]
+        return self.text.index(f"{mark_id}.cs"), self.text.index(f"{mark_id}.ce")
+
+    def get_content(self, index) -> str:
+        mark_id, _role = self._messages[index]
+        return self.text.get(f"{mark_id}.cs", f"{mark_id}.ce")
+
+    # --- Virtualization ---
+    @property
+    def virtual(self) -> bool:
+        return bool(self.max_rendered) and self._fetch_range is not None
+
+    def attach_source(self, fetch_range, total_count, max_rendered=None):
+        """
+        Virtualize the transcript over a message source: fetch_range(start, stop)
+        returns history entries by absolute index, total_count() the session length.
+        """
+        self._fetch_range = fetch_range
+        self._total_count = total_count
+        if max_rendered is not None:
+            self.max_rendered = max(0, int(max_rendered))
+        if not self._scroll_hooked:
+            # Chain our scroll watcher in front of the textbox's own scrollbar update
+            original = self.text.cget("yscrollcommand")
+
+            def on_yscroll(first, last):
+                if original:
+                    self.text.tk.eval(f"{original} {first} {last}")
+                self._on_scroll(float(first), float(last))
+
+            self.text.configure(yscrollcommand=on_yscroll)
+            self._scroll_hooked = True
+
+    def detach_source(self):
+        self._fetch_range = None
+        self._total_count = None
+
+    def _on_scroll(self, first, last):
+        if not self.virtual or self._paging or not self._order:
+            return
+        room = len(self._order) < self.max_rendered
+        if first <= self.SCROLL_EDGE and self._order[0] > 0 and (last < 1.0 or room):
+            self._paging = True
+            self.text.after_idle(self._load_older)
+        elif last >= 1.0 - self.SCROLL_EDGE and self._order[-1] + 1 < self._total_count() and (first > 0.0 or room):
+            self._paging = True
+            self.text.after_idle(self._load_newer)
+
+    def _keep_view(self):
+        """Pin the text at the top of the viewport so paging doesn't make the view jump."""
+        # Right gravity: text inserted exactly at the pinned spot lands above it
+        self._set_mark("vtop", self.text.index("@0,0"), "right")
+
+    def _restore_view(self):
+        self.text.yview("vtop")
+        self.text.mark_unset("vtop")
+
+    def _load_older(self):
+        try:
+            if not self.virtual or not self._order:
+                return
+            first = self._order[0]
+            start = max(0, first - self.page_size)
+            entries = self._fetch_range(start, first)
+            if not entries:
+                return
+
+            first_id = self._messages[first][0]
+            self._keep_view()
+            with self._writable():
+                # Insert before the oldest rendered message through a right-gravity cursor
+                self._set_mark("vins", f"{first_id}.start", "right")
+                added = []
+                for offset, entry in enumerate(entries):
+                    index = start + offset
+                    self._insert_message_at("vins", index, entry.get("role", ""), (entry.get("content") or "").strip())
+                    added.append(index)
+                # The old first message's start mark had left gravity and stayed in front
+                self._set_mark(f"{first_id}.start", self.text.index("vins"))
+                self.text.mark_unset("vins")
+            self._order[:0] = added
+
+            if len(self._order) > self.max_rendered:
+                self.remove_from(self._order[self.max_rendered])
+            self._restore_view()
+        finally:
+            self._paging = False
+
+    def _load_newer(self):
+        try:
+            if not self.virtual or not self._order:
+                return
+            last = self._order[-1]
+            entries = self._fetch_range(last + 1, last + 1 + self.page_size)
+            if not entries:
+                return
+            self._keep_view()
+            with self._writable():
+                for offset, entry in enumerate(entries):
+                    index = last + 1 + offset
+                    self._insert_message(index, entry.get("role", ""), (entry.get("content") or "").strip())
+                    self._order.append(index)
+            if len(self._order) > self.max_rendered:
+                self._trim_top(len(self._order) - self.max_rendered)
+            self._restore_view()
+        finally:
+            self._paging = False
+
+    def _trim_top(self, count):
+        """Drop the `count` oldest rendered messages from the widget."""
+        drop, self._order = self._order[:count], self._order[count:]
+        first_id = self._messages[drop[0]][0]
+        keep_id = self._messages[self._order[0]][0]
+        with self._writable():
+            self.text.delete(f"{first_id}.start", f"{keep_id}.start")
+        for index in drop:
+            self._unset_marks(self._messages.pop(index)[0], ("start", "cs", "ce", "end"))
+
+    # --- Non-message blocks ---
+    def set_block(self, name, text, tag=None):
+        """Append a named block (replacing that block's previous text, wherever it was)."""
+        self.remove_block(name)
+        block_id = self._new_id("blk")
+        with self._writable():
+            start = self.text.index("end-1c")
+            if tag:
+                self.text.insert("end", text, tag)
+            else:
+                self.text.insert("end", text)
+            self._set_mark(f"{block_id}.start", start)
+            self._set_mark(f"{block_id}.end", self.text.index("end-1c"))
+        self._blocks[name] = block_id
+
+    def remove_block(self, name):
+        block_id = self._blocks.pop(name, None)
+        if block_id is None:
+            return
+        with self._writable():
+            self.text.delete(f"{block_id}.start", f"{block_id}.end")
+        self._unset_marks(block_id, ("start", "end"))